@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# Python 2/3 Compatibility
+try:
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urllib import unquote
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, unquote, urlparse
+
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+
+# Chunked requests are sent with the whole unix socket URL as path, so routes
+# only match the API version and what follows it.
+ROUTES = [
+    ('GET', re.compile(r'/v[\d.]+/images/json$'), 'images'),
+    ('GET', re.compile(r'/v[\d.]+/images/(.+)/json$'), 'inspect_image'),
+    ('POST', re.compile(r'/v[\d.]+/images/create$'), 'pull'),
+    ('POST', re.compile(r'/v[\d.]+/build$'), 'build'),
+    ('POST', re.compile(r'/v[\d.]+/containers/create$'), 'create_container'),
+    ('POST', re.compile(r'/v[\d.]+/containers/(\w+)/start$'), 'start'),
+    ('POST', re.compile(r'/v[\d.]+/containers/(\w+)/wait$'), 'wait'),
+    ('GET', re.compile(r'/v[\d.]+/containers/(\w+)/logs$'), 'logs'),
+    ('POST', re.compile(r'/v[\d.]+/containers/(\w+)/copy$'), 'copy'),
+    ('DELETE', re.compile(r'/v[\d.]+/containers/(\w+)$'), 'remove_container'),
+    ('POST', re.compile(r'/v[\d.]+/commit$'), 'commit'),
+    ('DELETE', re.compile(r'/v[\d.]+/images/(.+)$'), 'remove_image'),
+]
+
+STDOUT = 1
+
+
+def multiplex(lines):
+    """Frame log lines the way the daemon does for a container without tty."""
+    return b''.join(struct.pack('>BxxxL', STDOUT, len(line)) + line
+                    for line in lines)
+
+
+class Recording(object):
+    """
+    Responses replayed by FakeDaemon.  build and logs are lists of byte
+    lines and copy maps a container path to a tar archive on disk sent for
+    it.  Container changes are not served: RPMs are found by fetching their
+    directories, never by listing the changes of the build container.
+    """
+
+    def __init__(self, build=None, logs=None, copy=None):
+        self.build = build or [b'{"stream": "Successfully built 0123456789ab\\n"}\r\n']
+        self.logs = logs or []
+        self.copy = copy or {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        self.query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        for route_method, pattern, name in ROUTES:
+            match = pattern.search(url.path)
+            if route_method == method and match:
+                return getattr(self, name)(*match.groups())
+        self.read_body()
+        self.reply(404, {'message': 'no route for %s %s' % (method, url.path)})
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    @property
+    def daemon(self):
+        return self.server.daemon
+
+    def read_body(self):
+        """Read the request body, counting its size, without keeping it."""
+        size = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                length = int(self.rfile.readline().split(b';')[0], 16)
+                remaining = length
+                while remaining:
+                    remaining -= len(self.rfile.read(min(remaining, 65536)))
+                self.rfile.readline()
+                size += length
+                if not length:
+                    break
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            size = remaining
+            while remaining:
+                remaining -= len(self.rfile.read(min(remaining, 65536)))
+        return size
+
+    def reply(self, status, body=None, content_type='application/json'):
+        if body is None:
+            data = b''
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def reply_file(self, path):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, 65536)
+
+    def reply_chunked(self, chunks):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write(('%x\r\n' % len(chunk)).encode('ascii') + chunk + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def images(self):
+        repository = self.query.get('filter')
+        self.reply(200, [{'Id': image_id, 'RepoTags': [tag]}
+                         for tag, image_id in sorted(self.daemon.images.items())
+                         if repository is None or tag.startswith(repository + ':')])
+
+    def inspect_image(self, name):
+        if name not in self.daemon.images:
+            return self.reply(404, {'message': 'No such image: %s' % name})
+        self.reply(200, {'Id': self.daemon.images[name],
+                         'Config': {'Cmd': ['rpmbuild']}})
+
+    def pull(self):
+        self.daemon.tag('%s:%s' % (self.query['fromImage'], self.query.get('tag') or 'latest'))
+        self.reply(200, {'status': 'Downloaded newer image'})
+
+    def build(self):
+        self.daemon.uploaded.append(self.read_body())
+        self.daemon.tag(self.query['t'])
+        self.reply_chunked(self.daemon.recording.build)
+
+    def create_container(self):
+        self.read_body()
+        self.reply(201, {'Id': self.daemon.container_id, 'Warnings': None})
+
+    def start(self, container):
+        self.read_body()
+        self.reply(204)
+
+    def wait(self, container):
+        self.reply(200, {'StatusCode': 0})
+
+    def logs(self, container):
+        self.reply(200, self.daemon.logs, 'application/vnd.docker.raw-stream')
+
+    def copy(self, container):
+        length = int(self.headers.get('Content-Length') or 0)
+        resource = json.loads(self.rfile.read(length).decode('utf-8'))['Resource']
+        if resource not in self.daemon.recording.copy:
+            return self.reply(404, {'message': 'Could not find the file %s' % resource})
+        self.reply_file(self.daemon.recording.copy[resource])
+
+    def remove_container(self, container):
+        self.reply(204)
+
+    def commit(self):
+        self.read_body()
+        self.daemon.tag('%s:%s' % (self.query['repo'], self.query.get('tag') or 'latest'))
+        self.reply(201, {'Id': self.daemon.images[self.query['repo'] + ':' +
+                                                  (self.query.get('tag') or 'latest')]})
+
+    def remove_image(self, name):
+        name = unquote(name)
+        self.daemon.images.pop(name, None)
+        self.reply(200, [{'Untagged': name}])
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDaemon(object):
+    """
+    Stand-in for the Docker remote API on a unix socket, serving the calls
+    Packager makes from a Recording instead of running anything.  Images
+    built or pulled are remembered, so image_exists behaves as against a real
+    daemon.  Use as a context manager; base_url is passed to docker.Client.
+    """
+
+    container_id = 'c0ffee'
+
+    def __init__(self, recording, images=None):
+        self.recording = recording
+        self.images = {}
+        self.uploaded = []
+        self.logs = multiplex(recording.logs)
+        self.path = tempfile.mkdtemp()
+        self.socket = os.path.join(self.path, 'docker.sock')
+        self.base_url = 'unix://' + self.socket
+        for name in images or ():
+            self.tag(name)
+
+    def tag(self, name):
+        if ':' not in name:
+            name += ':latest'
+        self.images.setdefault(name, '%064x' % (len(self.images) + 1))
+
+    def __enter__(self):
+        self.server = _Server(self.socket, _Handler)
+        self.server.daemon = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+"""Benchmarks for the docker-rpmbuild hot paths against a fake docker daemon.
+
+Run from the repository root as ``python -m benchmarks.run``.
+
+Usage:
+    run.py [--repeat=<n>] [--scale=<factor>] [<name>...]
+    run.py --list
+
+Options:
+    -h --help          Show this screen.
+    --list             List the benchmarks.
+    --repeat=<n>       Runs of every benchmark [default: 5].
+    --scale=<factor>   Multiply the size of every synthetic input [default: 1].
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+from collections import OrderedDict
+from docopt import docopt
+
+from benchmarks.daemon import FakeDaemon, Recording
+from rpmbuild import Packager, PackagerContext, RPM_DIRECTORIES
+from rpmbuild import build
+
+BASE_IMAGE = 'centos:7'
+BLOCK = os.urandom(1 << 20)
+MIB = float(1 << 20)
+
+SMALL_SOURCES = 200
+SMALL_SOURCES_DIR_FILES = 2000
+SMALL_FILE_SIZE = 4096
+HUGE_TARBALL_SIZE = 256 << 20
+RPMS = 300
+RPM_SIZE = 256 << 10
+BUILD_OUTPUT_LINES = 20000
+RPMBUILD_LOG_LINES = 200000
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    def register(f):
+        BENCHMARKS[name] = f
+        return f
+    return register
+
+
+def discard(message):
+    pass
+
+
+def write_file(path, size):
+    with open(path, 'wb') as f:
+        while size > 0:
+            f.write(BLOCK[:size])
+            size -= len(BLOCK)
+    return path
+
+
+class Workspace(object):
+    """
+    Synthetic inputs for the benchmarks, generated once in a temporary
+    directory and sized by scale.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.path = tempfile.mkdtemp(prefix='rpmbuild-bench-')
+        self.spec = os.path.join(self.path, 'foo.spec')
+        with open(self.spec, 'w') as f:
+            f.write('Name: foo\nVersion: 1.0\nRelease: 1\n')
+
+    def scaled(self, value):
+        return max(1, int(value * self.scale))
+
+    def subdir(self, name):
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def many_small_sources(self):
+        """Keyword arguments of a context of many small sources."""
+        path = os.path.join(self.path, 'small')
+        if not os.path.isdir(path):
+            sources_dir = self.subdir('small/SOURCES')
+            for i in range(self.scaled(SMALL_SOURCES_DIR_FILES)):
+                directory = self.subdir('small/SOURCES/%02d' % (i % 50))
+                write_file(os.path.join(directory, 'patch%05d.patch' % i),
+                           SMALL_FILE_SIZE)
+            for i in range(self.scaled(SMALL_SOURCES)):
+                write_file(os.path.join(self.subdir('small/sources'),
+                                        'source%04d.tar' % i), SMALL_FILE_SIZE)
+        sources = os.path.join(path, 'sources')
+        return {'spec': self.spec,
+                'sources_dir': os.path.join(path, 'SOURCES'),
+                'sources': [os.path.join(sources, name)
+                            for name in sorted(os.listdir(sources))]}
+
+    def huge_tarball(self):
+        """Keyword arguments of a context of one huge source tarball."""
+        tarball = os.path.join(self.path, 'huge', 'foo-1.0.tar')
+        if not os.path.exists(tarball):
+            self.subdir('huge')
+            write_file(tarball, self.scaled(HUGE_TARBALL_SIZE))
+        return {'spec': self.spec, 'sources': [tarball]}
+
+    def rpm_archives(self):
+        """Archives served for RPM_DIRECTORIES, as docker copy sends them."""
+        path = self.subdir('archives')
+        archives = dict((d, os.path.join(path, '%s.tar' % os.path.basename(d)))
+                        for d in RPM_DIRECTORIES)
+        if not os.path.exists(archives[RPM_DIRECTORIES[0]]):
+            rpm = write_file(os.path.join(path, 'foo.rpm'), RPM_SIZE)
+            with tarfile.open(archives[RPM_DIRECTORIES[0]], 'w') as archive:
+                archive.add(path, 'RPMS', recursive=False)
+                for i in range(self.scaled(RPMS)):
+                    archive.add(rpm, 'RPMS/x86_64/foo-sub%04d-1.0-1.x86_64.rpm' % i)
+            with tarfile.open(archives[RPM_DIRECTORIES[1]], 'w') as archive:
+                archive.add(rpm, 'SRPMS/foo-1.0-1.src.rpm')
+        return archives
+
+    def empty_archives(self):
+        path = self.subdir('empty')
+        archives = dict((d, os.path.join(path, '%s.tar' % os.path.basename(d)))
+                        for d in RPM_DIRECTORIES)
+        for archive in archives.values():
+            tarfile.open(archive, 'w').close()
+        return archives
+
+    def build_output(self):
+        lines = []
+        for i in range(self.scaled(BUILD_OUTPUT_LINES)):
+            if i % 100 == 0:
+                stream = 'Step %d : RUN yum -y install foo\n' % (i // 100)
+            else:
+                stream = 'Installing : foo-devel-1.0-%d.x86_64  %d/%d\n' % (i, i, i)
+            lines.append(json.dumps({'stream': stream}).encode('utf-8') + b'\r\n')
+        lines.append(b'{"stream": "Successfully built 0123456789ab\\n"}\r\n')
+        return lines
+
+    def rpmbuild_log(self):
+        return [('gcc -O2 -g -c src/file%05d.c -o src/file%05d.o\n' % (i, i)).encode('utf-8')
+                for i in range(self.scaled(RPMBUILD_LOG_LINES))]
+
+    def output(self):
+        """An empty output directory."""
+        path = os.path.join(self.path, 'output')
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        return path
+
+    def close(self):
+        shutil.rmtree(self.path)
+
+
+def packager(daemon, **kwargs):
+    return Packager(PackagerContext(BASE_IMAGE, **kwargs),
+                    {'base_url': daemon.base_url})
+
+
+def timed(run, repeat, before=None, after=None):
+    """Durations of repeat calls of run, each between before and after."""
+    durations = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.time()
+        run()
+        durations.append(time.time() - start)
+        if after is not None:
+            after()
+    return durations
+
+
+def bench_setup(ws, repeat, context):
+    context = PackagerContext(BASE_IMAGE, **context)
+    return timed(context.setup, repeat, after=context.teardown), context.size
+
+
+def bench_upload(ws, repeat, context, stream):
+    with FakeDaemon(Recording(), images=[BASE_IMAGE]) as daemon:
+        with packager(daemon, stream=stream, **context) as p:
+            durations = timed(lambda: list(p.build_image()), repeat)
+    return durations, daemon.uploaded[-1]
+
+
+@benchmark('setup.many-small-sources')
+def setup_many_small_sources(ws, repeat):
+    return bench_setup(ws, repeat, ws.many_small_sources())
+
+
+@benchmark('setup.huge-tarball')
+def setup_huge_tarball(ws, repeat):
+    return bench_setup(ws, repeat, ws.huge_tarball())
+
+
+@benchmark('upload.many-small-sources')
+def upload_many_small_sources(ws, repeat):
+    return bench_upload(ws, repeat, ws.many_small_sources(), stream=False)
+
+
+@benchmark('upload.many-small-sources.stream')
+def upload_many_small_sources_stream(ws, repeat):
+    return bench_upload(ws, repeat, ws.many_small_sources(), stream=True)
+
+
+@benchmark('upload.huge-tarball')
+def upload_huge_tarball(ws, repeat):
+    return bench_upload(ws, repeat, ws.huge_tarball(), stream=False)
+
+
+@benchmark('upload.huge-tarball.stream')
+def upload_huge_tarball_stream(ws, repeat):
+    return bench_upload(ws, repeat, ws.huge_tarball(), stream=True)
+
+
+@benchmark('export.many-rpms')
+def export_many_rpms(ws, repeat):
+    archives = ws.rpm_archives()
+    state = {}
+    with FakeDaemon(Recording(copy=archives), images=[BASE_IMAGE]) as daemon:
+        with packager(daemon, spec=ws.spec) as p:
+            p.container = {'Id': daemon.container_id}
+            durations = timed(lambda: p.export_package(state['output']), repeat,
+                              before=lambda: state.update(output=ws.output()))
+    return durations, sum(os.path.getsize(a) for a in archives.values())
+
+
+@benchmark('logs.build-output')
+def logs_build_output(ws, repeat):
+    recording = Recording(build=ws.build_output())
+    with FakeDaemon(recording, images=[BASE_IMAGE]) as daemon:
+        with packager(daemon, spec=ws.spec, stream=True) as p:
+            durations = timed(
+                lambda: build.log_build_output(p.build_image(), discard), repeat)
+    return durations, sum(len(line) for line in recording.build)
+
+
+@benchmark('logs.rpmbuild')
+def logs_rpmbuild(ws, repeat):
+    recording = Recording(logs=ws.rpmbuild_log(), copy=ws.empty_archives())
+    with FakeDaemon(recording, images=[BASE_IMAGE]) as daemon:
+        with packager(daemon, spec=ws.spec) as p:
+            daemon.tag(p.image_name)
+            durations = timed(
+                lambda: build.run_packager(p, ws.path, logger=discard), repeat)
+    return durations, len(daemon.logs)
+
+
+def format_size(size):
+    return '%.1f MiB' % (size / MIB)
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv=argv)
+
+    if args['--list']:
+        for name in BENCHMARKS:
+            print(name)
+        return
+
+    names = args['<name>'] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit('Unknown benchmark: %s' % ', '.join(unknown))
+
+    ws = Workspace(float(args['--scale']))
+    try:
+        print('%-34s %9s %9s %9s %11s %11s' % (
+            'benchmark', 'min', 'median', 'max', 'size', 'throughput'))
+        for name in names:
+            durations, size = BENCHMARKS[name](ws, int(args['--repeat']))
+            durations.sort()
+            print('%-34s %8.3fs %8.3fs %8.3fs %11s %7.1f MiB/s' % (
+                name, durations[0], durations[len(durations) // 2],
+                durations[-1], format_size(size),
+                size / MIB / max(durations[0], 1e-9)))
+            sys.stdout.flush()
+    finally:
+        ws.close()
+
+
+if __name__ == '__main__':
+    main()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
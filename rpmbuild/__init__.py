@@ -1,15 +1,59 @@
 #!/usr/bin/env python
 
+import copy
+import errno
 import os
 import re
 import ntpath
+import hashlib
+import math
+import gzip
+import io
 import shutil
+import subprocess
+import tarfile
 import tempfile
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from jinja2 import Template
 import docker
 
+from rpmbuild.locks import FileLock, named_lock
+
 INVALID_DOCKER_TAGNAME = '[^a-z0-9_.]'
+READ_BLOCKSIZE = 65536
+DIGEST_TAG_LENGTH = 12
+BASE_IMAGE_REPOSITORY = 'rpmbuild_base'
+RPM_DIRECTORIES = ('/rpmbuild/build/RPMS', '/rpmbuild/build/SRPMS')
+YUM_CACHE_DIRECTORIES = ('/var/cache/yum', '/var/cache/dnf')
+LOCAL_DOCKER_URL = re.compile(
+    r'^((http\+)?unix://|((tcp|https?)://)?(localhost|127(\.\d{1,3}){3})(:\d+)?/?$)')
+CCACHE_DIRECTORY = '/rpmbuild/ccache'
+TMPFS_DIRECTORIES = ('/rpmbuild/build/BUILD', '/rpmbuild/build/BUILDROOT')
+SIZE = re.compile(r'^(\d+)([kmgKMG]?)$')
+SIZE_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+CPU_PERIOD = 100000
+FICLONE = 0x40049409
+PACKED_SOURCES_CACHE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'docker-rpmbuild', 'sources')
+PACKED_SOURCES_MAX_AGE = 30 * 24 * 60 * 60
+
+def parse_size(value):
+    """Bytes in a size such as 512m or 8g, as docker takes them."""
+    match = SIZE.match(str(value))
+    if match is None:
+        raise PackagerException(
+            "Invalid size {0}, expected e.g. 8g".format(value))
+    return int(match.group(1)) * SIZE_UNITS[match.group(2).lower()]
 
 def path_leaf(path):
     if path is None:
@@ -17,16 +61,222 @@ def path_leaf(path):
     head, tail = ntpath.split(path)
     return tail or ntpath.basename(head)
 
+def is_local_docker(docker_config):
+    """
+    Whether the docker daemon of docker_config runs on this host, so paths
+    of this host can be bind-mounted into its containers.
+    """
+    base_url = dict(docker_config).get('base_url')
+    return not base_url or LOCAL_DOCKER_URL.match(base_url) is not None
+
+
 def replace_invalid_chars(value):
     if value is None:
         return None
     return re.sub(INVALID_DOCKER_TAGNAME, '_', value)
 
+_templates = {}
+
+def compile_template(source):
+    """
+    Jinja template for source, compiled once per process, so a long running
+    build service does not recompile it for every package.
+    """
+    template = _templates.get(source)
+    if template is None:
+        template = _templates[source] = Template(source)
+    return template
+
+def update_digest(digest, path, arcname, _parents=()):
+    """
+    Feed the name, mode and content of a file, or of every entry below a
+    directory, empty directories included, into a hashlib digest object.
+    Symlinks are hashed with their target, then followed, directories too.
+    """
+    digest.update(arcname.encode('utf-8') + b'\0')
+    if os.path.islink(path):
+        digest.update(b'l' + os.readlink(path).encode('utf-8') + b'\0')
+        if not os.path.exists(path):
+            return
+
+    stat = os.stat(path)
+    digest.update(('%o\0' % (stat.st_mode & 0o7777)).encode('utf-8'))
+    if os.path.isdir(path):
+        digest.update(b'd\0')
+        real_path = os.path.realpath(path)
+        if real_path in _parents:
+            return
+        for name in sorted(os.listdir(path)):
+            update_digest(digest, os.path.join(path, name),
+                          '%s/%s' % (arcname, name), _parents + (real_path,))
+        return
+
+    digest.update(('f%d\0' % stat.st_size).encode('utf-8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_BLOCKSIZE), b''):
+            digest.update(block)
+
+
+def evict_packed_sources(keep=(), max_age=PACKED_SOURCES_MAX_AGE):
+    """
+    Delete the files of PACKED_SOURCES_CACHE not used for max_age seconds,
+    but those in keep.  pack_sources touches the tarballs it uses.
+    """
+    try:
+        names = os.listdir(PACKED_SOURCES_CACHE)
+    except OSError:
+        return
+    oldest = time.time() - max_age
+    for name in names:
+        path = os.path.join(PACKED_SOURCES_CACHE, name)
+        try:
+            if path not in keep and os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def tar_stream(path, arcname):
+    """
+    Yield tar blocks for a file, or a directory tree, read in place.  Memory
+    use is bounded by READ_BLOCKSIZE no matter how large the file is.
+    """
+    stat = os.stat(path)
+    info = tarfile.TarInfo(arcname)
+    info.mode = stat.st_mode & 0o7777
+    info.mtime = int(stat.st_mtime)
+
+    if os.path.isdir(path):
+        info.type = tarfile.DIRTYPE
+        yield info.tobuf(tarfile.GNU_FORMAT)
+        for name in sorted(os.listdir(path)):
+            for block in tar_stream(os.path.join(path, name),
+                                    '%s/%s' % (arcname, name)):
+                yield block
+        return
+
+    info.size = stat.st_size
+    yield info.tobuf(tarfile.GNU_FORMAT)
+
+    remaining = info.size
+    with open(path, 'rb') as f:
+        while remaining:
+            block = f.read(min(READ_BLOCKSIZE, remaining))
+            if not block:
+                raise PackagerException(
+                    "{0} changed while it was being sent".format(path))
+            remaining -= len(block)
+            yield block
+
+    if info.size % tarfile.BLOCKSIZE:
+        yield tarfile.NUL * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE)
+
+
+def _reflink(path, target):
+    """Clone path to target with FICLONE, sharing extents on btrfs or xfs."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflinks are not supported')
+    src = os.open(path, os.O_RDONLY)
+    try:
+        dst = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(dst, FICLONE, src)
+        except (IOError, OSError):
+            os.close(dst)
+            os.remove(target)
+            raise
+        os.close(dst)
+    finally:
+        os.close(src)
+    shutil.copymode(path, target)
+
+
+def stage_file(path, directory, name=None):
+    """
+    Put the file path in directory, as name if given, without copying its
+    data when possible: as a hardlink, else as a reflink, else as a plain
+    copy.  Hardlinks and reflinks only work within one filesystem.  A file
+    staged earlier under the same name is replaced, never written through.
+    """
+    target = os.path.join(directory, name or os.path.basename(path))
+    destination = directory if name is None else target
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(os.path.realpath(path), target)
+        return
+    except (AttributeError, OSError) as e:
+        if getattr(e, 'errno', None) == errno.EXDEV:
+            return shutil.copy(path, destination)
+
+    try:
+        _reflink(path, target)
+    except (IOError, OSError):
+        shutil.copy(path, destination)
+
+
+def _which(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _root_owned(info):
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    return info
+
+
+def pack_directory(path, target):
+    """
+    Write the content of the directory path to target as a gzipped tar, as
+    ``tar -C path -czf target .`` does, owned by root.  The compression
+    runs in pigz, on every core, when it is installed.  target is replaced
+    atomically, so concurrent packers of one directory do not clash.
+    """
+    tmp = '%s.%d.%d' % (target, os.getpid(), threading.current_thread().ident)
+    pigz = _which('pigz')
+    with open(tmp, 'wb') as f:
+        if pigz:
+            process = subprocess.Popen([pigz, '-n', '-c'], stdin=subprocess.PIPE,
+                                       stdout=f)
+            out = process.stdin
+        else:
+            out = gzip.GzipFile('', 'wb', fileobj=f, mtime=0)
+        try:
+            archive = tarfile.open(fileobj=out, mode='w|', format=tarfile.GNU_FORMAT)
+            archive.add(path, '.', recursive=False, filter=_root_owned)
+            for name in sorted(os.listdir(path)):
+                archive.add(os.path.join(path, name), './' + name,
+                            filter=_root_owned)
+            archive.close()
+        finally:
+            out.close()
+        if pigz and process.wait():
+            raise PackagerException('pigz failed to pack {0}'.format(path))
+    os.rename(tmp, target)
+
+
+def stage_tree(path, target):
+    """shutil.copytree with every file staged by stage_file."""
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    for name in sorted(os.listdir(path)):
+        source = os.path.join(path, name)
+        if os.path.isdir(source):
+            stage_tree(source, os.path.join(target, name))
+        else:
+            stage_file(source, target)
+
 
 class PackagerContext(object):
 
     def __init__(self, image, defines=None, sources=None, sources_dir=None,
-                 spec=None, macrofiles=None, retrieve=None, srpm=None):
+                 spec=None, macrofiles=None, retrieve=None, srpm=None,
+                 stream=False, repo=None, yum_cache=None, ccache=None,
+                 staging_dir=None, tmpfs_build=None, cpus=None, memory=None):
         self.image = image
         self.defines = defines
         self.sources = sources
@@ -34,6 +284,20 @@ class PackagerContext(object):
         self.spec = spec
         self.srpm = srpm
         self.retrieve = retrieve
+        self.stream = stream
+        self.repo = repo
+        self.yum_cache = yum_cache
+        self.ccache = ccache
+        self.staging_dir = staging_dir
+        self.path = None
+        self.tmpfs_build = tmpfs_build
+        self.cpus = cpus
+        self.memory = memory
+        self.base_image = None
+        self.deps_image = None
+        self._files_digests = {}
+        self._entry_digests = {}
+        self._packed = None
 
         if not defines:
             self.defines = []
@@ -44,6 +308,9 @@ class PackagerContext(object):
         if not macrofiles:
             self.macrofiles = []
 
+        if not repo:
+            self.repo = []
+
         if sources_dir and os.path.exists(sources_dir):
             self.sources_dir = sources_dir
         else:
@@ -53,94 +320,350 @@ class PackagerContext(object):
             raise PackagerException("Must provide base docker <image>")
         if spec is None and srpm is None:
             raise PackagerException("Must provide <spec> or <srpm>. See -h")
+        if yum_cache and spec is None:
+            raise PackagerException("A yum cache needs a <spec>")
+        if tmpfs_build is not None:
+            parse_size(tmpfs_build)
+        if memory is not None:
+            parse_size(memory)
+        if cpus is not None:
+            try:
+                self.cpus = float(cpus)
+            except ValueError:
+                self.cpus = 0
+            if self.cpus <= 0:
+                raise PackagerException(
+                    "Invalid number of cpus {0}, expected e.g. 4".format(cpus))
 
         # We do this so it's always easy to referrer to the generated Dockerfile in sphinx.
-        self.template = Template(self._dockerfile())
+        self.template = compile_template(self._dockerfile())
+        self.base_template = compile_template(self._base_dockerfile())
 
     def __str__(self):
         return replace_invalid_chars(path_leaf(self.spec)) or replace_invalid_chars(path_leaf(self.srpm))
 
-    def _dockerfile(self):
-        """Hacking up the unintentional tarball unpack
-        https://github.com/dotcloud/docker/issues/3050"""
+    def _base_dockerfile(self):
+        """Toolchain shared by every package built on the same base image."""
         return """
             FROM {{ image }}
 
-            RUN yum -y install rpmdevtools yum-utils tar
+            RUN yum -y install rpmdevtools yum-utils tar createrepo
             RUN rpmdev-setuptree
             
             RUN sed -i 's/%_topdir.*/%_topdir \/rpmbuild\/build/g' $HOME/.rpmmacros
+            """
+
+    def _dockerfile(self):
+        """Sources are copied with COPY, which unlike ADD never unpacks a
+        tarball (https://github.com/dotcloud/docker/issues/3050).  Sources
+        that are directories were packed into tarballs by pack_sources.  The
+        spec and macrofiles, and all sources, are gathered in one directory
+        each, so they take one layer however many there are; COPY creates
+        them owned by root.
 
-            {% if sources_dir is not none %}
-            ADD SOURCES /rpmbuild/build/SOURCES
+        The spec is added and its BuildRequires installed before any source,
+        so the dependency layers stay cached when only sources change.  With
+        a yum cache the BuildRequires are installed by Packager instead, in
+        a deps image of its own: rendered with deps, the template is the
+        Dockerfile of that image, up to the spec, and with deps_image the
+        package image is built FROM it with the sources only."""
+        return """
+            FROM {{ deps_image or base_image }}
+
+            {% if not deps_image %}
+            {% if repo %}
+            ADD repo /rpmbuild/repo
+            RUN createrepo /rpmbuild/repo && printf '[rpmbuild-local]\\nname=docker-rpmbuild local repository\\nbaseurl=file:///rpmbuild/repo\\nenabled=1\\ngpgcheck=0\\n' > /etc/yum.repos.d/rpmbuild-local.repo
+            {% endif %}
+
+            {% if ccache %}
+            RUN yum -y install ccache || (yum -y install epel-release && yum -y install ccache)
+            ENV PATH /usr/lib64/ccache:/usr/lib/ccache:$PATH
+            ENV CCACHE_DIR {{ ccache_dir }}
             {% endif %}
-            {% for source in sources %}
-            ADD {{ source }} /rpmbuild/build/SOURCES/{{ source }}
-            RUN cd /rpmbuild/build/SOURCES; if [ -d {{ source }} ]; then mv {{ source }} {{ source }}.tmp; tar -C {{ source }}.tmp -czvf {{ source }} .; rm -r {{ source }}.tmp; fi
-            RUN chown -R root:root /rpmbuild/build/SOURCES
-            {% endfor %}
 
             {% if spec %}
-            {% for macrofile in macrofiles %}
-            ADD {{ macrofile }} /rpmbuild/build/SPECS/{{ macrofile }}
-            {% endfor %}
-            ADD {{ spec }} /rpmbuild/build/SPECS/{{ spec }}
-            RUN chown -R root:root /rpmbuild/build/SPECS
+            COPY SPECS /rpmbuild/build/SPECS
+            {% endif %}
+            {% endif %}
+
+            {% if not deps %}
+            {% if spec %}
             {% if retrieve %}
             RUN spectool -g -R -A /rpmbuild/build/SPECS/{{ spec }}
             {% endif %}
+            {% if not yum_cache %}
             RUN yum-builddep -y /rpmbuild/build/SPECS/{{ spec }}
-            CMD rpmbuild {% for define in defines %} --define '{{ define }}' {% endfor %} -ba /rpmbuild/build/SPECS/{{ spec }}
+            {% endif %}
+            {% endif %}
+
+            {% if sources_dir is not none or sources %}
+            COPY SOURCES /rpmbuild/build/SOURCES
             {% endif %}
 
             {% if srpm %}
-            ADD {{ srpm }} /rpmbuild/build/SRPMS/{{ srpm }}
-            RUN chown -R root:root /rpmbuild/build/SRPMS
-            CMD rpmbuild --rebuild /rpmbuild/build/SRPMS/{{ srpm }}
+            COPY {{ srpm }} /rpmbuild/{{ srpm }}
+            {% endif %}
+            CMD {{ command }}
             {% endif %}
 
             """
 
-    def setup(self):
+    def _context_files(self, deps=False):
         """
-        Setup context for docker container build.  Copies the source tarball
-        and SPEC file to the context directory.  Writes a Dockerfile from the
-        template above.
+        List the (path, arcname) pairs of everything that goes into the
+        build context besides the Dockerfile.  The spec, macrofiles and
+        local repository go into the context of the deps image, if there is
+        one, listed with deps, and not into that of the package image.
         """
-        self.path = tempfile.mkdtemp()
-        self.dockerfile = os.path.join(self.path, 'Dockerfile')
+        spec_files = [(m, 'SPECS/%s' % os.path.basename(m)) for m in self.macrofiles]
+
+        if self.spec:
+            spec_files.append((self.spec, 'SPECS/%s' % os.path.basename(self.spec)))
 
-        for source in self.sources:
-            shutil.copy(source, self.path)
+        repo_files = [(r, 'repo/%s' % os.path.basename(r)) for r in self.repo]
 
-        for macrofile in self.macrofiles:
-            shutil.copy(macrofile, self.path)
+        if deps:
+            return spec_files + repo_files
 
-        if self.spec:
-            shutil.copy(self.spec, self.path)
+        if self.deps_image:
+            spec_files = repo_files = []
+
+        files = spec_files
 
         if self.srpm:
-            shutil.copy(self.srpm, self.path)
+            files.append((self.srpm, os.path.basename(self.srpm)))
 
+        # Sources come after sources_dir, so they win over files of the
+        # same name in it.
         if self.sources_dir:
-            shutil.copytree(self.sources_dir,
-                            os.path.join(self.path, 'SOURCES'))
+            files.append((self.sources_dir, 'SOURCES'))
+
+        files.extend((s, 'SOURCES/%s' % os.path.basename(s)) for s in self.sources)
+
+        return files + repo_files
+
+    def render_base(self):
+        """Render the toolchain Dockerfile template for the base image."""
+        return self.base_template.render(image=self.image)
+
+    def render(self, deps=False):
+        """
+        Render the Dockerfile template for this context, or with deps for
+        its deps image.
+        """
+        return self.template.render(
+            image=self.image,
+            base_image=self.base_image,
+            deps=deps,
+            deps_image=None if deps else self.deps_image,
+            defines=self.defines,
+            sources=[os.path.basename(s) for s in self.sources],
+            sources_dir=self.sources_dir,
+            spec=self.spec and os.path.basename(self.spec),
+            macrofiles=[os.path.basename(s) for s in self.macrofiles],
+            retrieve=self.retrieve,
+            srpm=self.srpm and os.path.basename(self.srpm),
+            repo=bool(self.repo),
+            yum_cache=bool(self.yum_cache),
+            ccache=bool(self.ccache),
+            ccache_dir=CCACHE_DIRECTORY,
+            command=self.command(),
+        )
+
+    def command(self, jobs=None):
+        """
+        The shell command building the package: rpmbuild, with jobs
+        parallel make jobs if given, and the ccache statistics around it.
+        The image runs it without jobs, so they do not change its digest;
+        the Packager passes them when starting the container.
+        """
+        if self.srpm:
+            args = ['rpmbuild']
+        else:
+            args = ['rpmbuild'] + ["--define '%s'" % d for d in self.defines]
+        if jobs:
+            args.append("--define '_smp_mflags -j%d'" % jobs)
+        if self.srpm:
+            args.append('--rebuild /rpmbuild/%s' % os.path.basename(self.srpm))
+        else:
+            args.append('-ba /rpmbuild/build/SPECS/%s' % os.path.basename(self.spec))
+
+        command = ' '.join(args)
+        if self.ccache:
+            command = 'ccache -z; %s; status=$?; ccache -s; exit $status' % command
+        return command
+
+    @property
+    def jobs(self):
+        """
+        Parallel make jobs matching cpus, which rpmbuild is told through
+        _smp_mflags unless the defines already set it.
+        """
+        if self.cpus is None:
+            return None
+        if any(d.split(None, 1)[0] == '_smp_mflags' for d in self.defines if d.strip()):
+            return None
+        return max(1, int(math.ceil(self.cpus)))
+
+    @property
+    def size(self):
+        """Total size in bytes of the files sent as build context."""
+        size = len(self.render().encode('utf-8'))
+        for path, arcname in self._staged_files():
+            if not os.path.isdir(path):
+                size += os.path.getsize(path)
+                continue
+            for root, dirs, files in os.walk(path):
+                size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return size
+
+    def _entry_digest(self, path, arcname):
+        """Content hash of one context file or directory."""
+        key = (path, arcname)
+        if key not in self._entry_digests:
+            digest = hashlib.sha256()
+            update_digest(digest, path, arcname)
+            self._entry_digests[key] = digest.hexdigest()
+        return self._entry_digests[key]
+
+    def _hash_files(self, deps=False):
+        """Content hash of the context files, computed once per context."""
+        files = tuple(self._context_files(deps))
+        if files not in self._files_digests:
+            files_digest = hashlib.sha256()
+            for path, arcname in files:
+                files_digest.update(
+                    self._entry_digest(path, arcname).encode('utf-8'))
+            self._files_digests[files] = files_digest.hexdigest()
+        return self._files_digests[files]
+
+    def pack_sources(self):
+        """
+        Pack every source that is a directory into a gzipped tar, in
+        parallel, returning a dict of directory to tarball.  The tarballs are
+        kept in PACKED_SOURCES_CACHE under the content hash of the directory,
+        so an unchanged directory is never packed again, and those not used
+        for PACKED_SOURCES_MAX_AGE are deleted.
+        """
+        if self._packed is None:
+            packed = {}
+            for source in self.sources:
+                if os.path.isdir(source):
+                    digest = self._entry_digest(source, os.path.basename(source))
+                    packed[source] = os.path.join(PACKED_SOURCES_CACHE,
+                                                  digest + '.tar.gz')
+
+            missing = [(d, t) for d, t in packed.items() if not os.path.exists(t)]
+            if missing:
+                if not os.path.isdir(PACKED_SOURCES_CACHE):
+                    try:
+                        os.makedirs(PACKED_SOURCES_CACHE)
+                    except OSError as e:
+                        if e.errno != errno.EEXIST:
+                            raise
+                pool = ThreadPool(len(missing))
+                try:
+                    pool.map(lambda dt: pack_directory(*dt), missing)
+                finally:
+                    pool.close()
+            for target in packed.values():
+                os.utime(target, None)
+            if packed:
+                evict_packed_sources(keep=set(packed.values()))
+            self._packed = packed
+        return self._packed
+
+    def _staged_files(self, deps=False):
+        """_context_files, with directory sources replaced by their tarball."""
+        packed = self.pack_sources()
+        return [(packed.get(path, path), arcname)
+                for path, arcname in self._context_files(deps)]
+
+    @property
+    def digest(self):
+        """
+        Content hash of the rendered Dockerfile and every file copied into
+        the build context.  Identical inputs always give the same digest.
+        """
+        digest = hashlib.sha256(self.render().encode('utf-8'))
+        digest.update(self._hash_files().encode('utf-8'))
+        return digest.hexdigest()
+
+    @property
+    def deps_digest(self):
+        """
+        Content hash of the inputs of the deps image: its Dockerfile, the
+        spec, macrofiles and local repository, but none of the sources.
+        """
+        digest = hashlib.sha256(self.render(deps=True).encode('utf-8'))
+        digest.update(self._hash_files(deps=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def for_image(self, image):
+        """
+        Copy of this context building on another base image.  The copies
+        share the hash of the context files, so it is computed only once.
+        """
+        self._hash_files()
+        context = copy.copy(self)
+        context.image = image
+        context.base_image = None
+        context.deps_image = None
+        context.path = None
+        return context
+
+    def archive(self, deps=False):
+        """
+        Generate the build context as a tar stream: the rendered Dockerfile
+        followed by every context file, read in place without a staging copy.
+        With deps, it is the context of the deps image.
+        """
+        dockerfile = self.render(deps).encode('utf-8')
+        info = tarfile.TarInfo('Dockerfile')
+        info.size = len(dockerfile)
+        yield info.tobuf(tarfile.GNU_FORMAT)
+        yield dockerfile
+        if info.size % tarfile.BLOCKSIZE:
+            yield tarfile.NUL * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE)
+
+        for path, arcname in self._staged_files(deps):
+            for block in tar_stream(path, arcname):
+                yield block
+
+        yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+    def setup(self):
+        """
+        Setup context for docker container build.  Stages the source tarball
+        and SPEC file in a context directory under staging_dir, hardlinked or
+        reflinked when it is on the filesystem of the files.  Writes a
+        Dockerfile from the template above.  A streamed context is generated
+        by archive() instead, so nothing is staged on disk.
+        """
+        if self.stream:
+            self.path = None
+            return
+
+        self.path = tempfile.mkdtemp(dir=self.staging_dir)
+        self.dockerfile = os.path.join(self.path, 'Dockerfile')
+
+        for path, arcname in self._staged_files():
+            if os.path.isdir(path):
+                stage_tree(path, os.path.join(self.path, arcname))
+                continue
+
+            directory = os.path.dirname(os.path.join(self.path, arcname))
+            if os.path.dirname(arcname) and not os.path.isdir(directory):
+                os.makedirs(directory)
+            stage_file(path, directory, os.path.basename(arcname))
 
         with open(self.dockerfile, 'w') as f:
-            content = self.template.render(
-                image=self.image,
-                defines=self.defines,
-                sources=[os.path.basename(s) for s in self.sources],
-                sources_dir=self.sources_dir,
-                spec=self.spec and os.path.basename(self.spec),
-                macrofiles=[os.path.basename(s) for s in self.macrofiles],
-                retrieve=self.retrieve,
-                srpm=self.srpm and os.path.basename(self.srpm),
-            )
-            f.write(content)
+            f.write(self.render())
 
     def teardown(self):
-        shutil.rmtree(self.path)
+        if self.path is not None:
+            shutil.rmtree(self.path)
 
 
 class PackagerException(Exception):
@@ -148,65 +671,442 @@ class PackagerException(Exception):
 
 
 class Packager(object):
+    """
+    Builds the package of a context with docker.  Given a ClientPool, the
+    docker client is borrowed from it for the duration of the with block
+    instead of created for this Packager alone.
+    """
 
-    def __init__(self, context, docker_config):
+    def __init__(self, context, docker_config, pool=None):
         self.context = context
-        self.client = docker.Client(**dict(docker_config))
+        self.docker_config = docker_config
+        self.pool = pool
+        self.client = None
+        if pool is None:
+            self.client = docker.Client(**dict(docker_config))
+        self.bind_output = None
+        self._base_image_name = None
 
     def __enter__(self):
-        self.context.setup()
+        self.check_host()
+        if self.pool is not None:
+            self.client = self.pool.acquire(self.docker_config)
+        try:
+            self.context.base_image = self.base_image_name
+            self.name_deps_image()
+        except BaseException:
+            self._release_client()
+            raise
         return self
 
     def __exit__(self, type, value, traceback):
-        self.context.teardown()
+        try:
+            self.context.teardown()
+        finally:
+            self._release_client()
+
+    @property
+    def local(self):
+        """Whether the docker daemon runs on this host, see is_local_docker."""
+        return is_local_docker(self.docker_config)
+
+    def check_host(self):
+        """
+        Raise PackagerException if the context mounts directories of this
+        host, the yum or ccache cache, but the docker daemon runs elsewhere.
+        """
+        if not self.local and (self.context.yum_cache or self.context.ccache):
+            raise PackagerException(
+                'yum_cache and ccache need a docker daemon on this host, '
+                'not {0}'.format(dict(self.docker_config).get('base_url')))
+
+    def stage(self):
+        """
+        Set up the build context, unless it is streamed or already set up.
+        Only building the image needs it, so a build whose image is cached,
+        or which is skipped as unchanged, never stages the sources.
+        """
+        if not self.context.stream and self.context.path is None:
+            self.context.setup()
+
+    def _release_client(self):
+        if self.pool is not None and self.client is not None:
+            self.pool.release(self.docker_config, self.client)
+            self.client = None
 
     def __str__(self):
         return self.context.image
 
     def export_package(self, output):
         """
-        Finds RPMs build in the container and copies to host output directory.
+        Fetches the RPMS and SRPMS directories from the container as one tar
+        stream each and extracts the RPMs to host output directory.  When a
+        directory was bind-mounted the RPMs are already on the host, and are
+        moved from it to the output directory.
         """
+        if self.bind_output is not None:
+            return self._collect_rpms(self.bind_output,
+                                      os.path.dirname(self.bind_output))
+
         exported = []
 
-        for diff in self.client.diff(self.container):
-            if diff['Path'].startswith('/rpmbuild'):
-                if diff['Path'].endswith('.rpm'):
-                    directory, name = os.path.split(diff['Path'])
-                    res = self.client.copy(self.container['Id'], diff['Path'])
-                    with open(os.path.join(output, name), 'wb') as f:
-                        f.write(res.read()[512:])
-                        exported.append(f.name)
+        for directory in RPM_DIRECTORIES:
+            res = self.client.copy(self.container['Id'], directory)
+            exported.extend(self._extract_rpms(res, output))
 
         return exported
 
+    @staticmethod
+    def _extract_rpms(fileobj, output):
+        """Write the RPMs in a tar stream to output, returning their paths."""
+        exported = []
+        archive = tarfile.open(fileobj=fileobj, mode='r|')
+        for member in archive:
+            if not member.isfile() or not member.name.endswith('.rpm'):
+                continue
+            name = os.path.basename(member.name)
+            with open(os.path.join(output, name), 'wb') as f:
+                shutil.copyfileobj(archive.extractfile(member), f,
+                                   READ_BLOCKSIZE)
+                exported.append(f.name)
+        archive.close()
+        return exported
+
     @property
-    def image_name(self):
+    def image_repository(self):
         return 'rpmbuild_%s' % self.context
 
+    @property
+    def image_name(self):
+        """
+        Repository and tag of the package image.  The tag is derived from the
+        context digest, so an image is only reused for identical inputs.
+        """
+        return '%s:%s' % (self.image_repository,
+                          self.context.digest[:DIGEST_TAG_LENGTH])
+
+    def _base_image_id(self):
+        """ID of the base image, pulling it first if it is not present."""
+        try:
+            return self.client.inspect_image(self.context.image)['Id']
+        except docker.errors.APIError:
+            self.client.pull(self.context.image)
+
+        try:
+            return self.client.inspect_image(self.context.image)['Id']
+        except docker.errors.APIError:
+            raise PackagerException(
+                "Could not find base image {0}".format(self.context.image))
+
+    @property
+    def base_image_name(self):
+        """
+        Repository and tag of the toolchain image shared by every package
+        built on the same base image.  The tag is derived from the base image
+        ID and the toolchain Dockerfile.
+        """
+        if self._base_image_name is None:
+            self._base_image_name = self._base_image_tag(self._base_image_id())
+        return self._base_image_name
+
+    def _base_image_tag(self, image_id):
+        digest = hashlib.sha256(image_id.encode('utf-8'))
+        digest.update(self.context.render_base().encode('utf-8'))
+        return '%s:%s' % (BASE_IMAGE_REPOSITORY,
+                          digest.hexdigest()[:DIGEST_TAG_LENGTH])
+
+    def base_image_exists(self):
+        """
+        Whether the toolchain image for the base image has already been
+        built, in which case build_base_image can be skipped.
+        """
+        return self._find_image(BASE_IMAGE_REPOSITORY,
+                                self.base_image_name) is not None
+
+    def base_image_lock(self):
+        """
+        Lock held while building the toolchain image, shared by every build
+        of this process on the same docker host and toolchain, so only one
+        of them builds it.
+        """
+        return named_lock((dict(self.docker_config).get('base_url'),
+                           self.base_image_name))
+
+    def _find_image(self, repository, name):
+        for image in self.client.images(name=repository):
+            if name in (image.get('RepoTags') or []):
+                return image
+        return None
+
     @property
     def image(self):
-        images = self.client.images(name=self.image_name)
+        image = self._find_image(self.image_repository, self.image_name)
 
-        if not images:
+        if image is None:
             raise PackagerException
 
-        return images[0]
+        return image
+
+    def image_exists(self):
+        """
+        Whether an image built from identical inputs is already present, in
+        which case build_image can be skipped.
+        """
+        return self._find_image(self.image_repository,
+                                self.image_name) is not None
+
+    def cache_level(self):
+        """
+        How much of this build the docker host has cached: 2 when it holds
+        the package image, 1 when it holds the toolchain image, else 0.
+        Unlike entering the Packager, this never pulls the base image.
+        """
+        try:
+            self.client.inspect_image(self.context.image)
+        except docker.errors.APIError:
+            return 0
+
+        self.context.base_image = self.base_image_name
+        self.name_deps_image()
+        if self.image_exists():
+            return 2
+        return 1 if self.base_image_exists() else 0
+
+    def build_base_image(self):
+        dockerfile = io.BytesIO(self.context.render_base().encode('utf-8'))
+        return self.client.build(
+            fileobj=dockerfile,
+            tag=self.base_image_name,
+            stream=True
+        )
 
     def build_image(self):
+        """
+        Build the package image.  It starts FROM the toolchain image, or the
+        deps image, which only exist on this docker host, so docker must not
+        try to pull it.
+        """
+        self.stage()
+        if self.context.stream:
+            return self.client.build(
+                fileobj=self.context.archive(),
+                custom_context=True,
+                tag=self.image_name,
+                stream=True,
+                pull=False
+            )
+
         return self.client.build(
             self.context.path,
             tag=self.image_name,
-            stream=True
+            stream=True,
+            pull=False
+        )
+
+    @property
+    def deps_image_name(self):
+        """
+        Repository and tag of the deps image, which has the BuildRequires
+        installed with the yum cache.  The tag is derived from the spec,
+        macrofiles and local repository, so it is reused as long as they
+        do not change, whatever happens to the sources.
+        """
+        return '%s:deps-%s' % (self.image_repository,
+                               self.context.deps_digest[:DIGEST_TAG_LENGTH])
+
+    @property
+    def deps_build_tag(self):
+        """
+        Tag written by build_deps_image.  The BuildRequires are still
+        missing from that image, so it only gets the deps_image_name tag
+        once commit_build_deps has installed them.
+        """
+        return '%s-nobuilddeps' % self.deps_image_name
+
+    def name_deps_image(self):
+        """With a yum cache, have the package image built FROM the deps image."""
+        if self.context.yum_cache:
+            self.context.deps_image = self.deps_image_name
+
+    def deps_image_exists(self):
+        return self._find_image(self.image_repository,
+                                self.deps_image_name) is not None
+
+    def build_deps_image(self):
+        """
+        Build the deps image, up to the spec, from a streamed context that
+        holds none of the sources.
+        """
+        return self.client.build(
+            fileobj=self.context.archive(deps=True),
+            custom_context=True,
+            tag=self.deps_build_tag,
+            stream=True,
+            pull=False
         )
 
-    def build_package(self):
+    def yum_cache_lock(self):
+        """
+        Lock held while installing BuildRequires with the yum cache, so the
+        builds sharing the cache directory, in any process of this host,
+        never run yum on it at once.
+        """
+        cache = os.path.abspath(self.context.yum_cache)
+        if not os.path.isdir(cache):
+            try:
+                os.makedirs(cache)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        return FileLock(os.path.join(cache, '.lock'))
+
+    def install_build_deps(self):
         """
-        Build the RPM package on top of the provided image.
+        Install the BuildRequires in a container on top of the image from
+        build_deps_image, with the host yum cache mounted and keepcache
+        enabled, so downloaded packages are reused by every later build.
         """
-        self.container = self.client.create_container(self.image['Id'])
+        self.deps_container = self.client.create_container(
+            self.deps_build_tag, **self._build_deps_options())
+        self.client.start(self.deps_container)
+        return self.deps_container, self.client.logs(self.deps_container,
+                                                     stream=True)
+
+    def _build_deps_options(self):
+        cache = os.path.abspath(self.context.yum_cache)
+        spec = '/rpmbuild/build/SPECS/%s' % os.path.basename(self.context.spec)
+        return {
+            'command': ['yum-builddep', '-y', '--setopt=keepcache=1', spec],
+            'host_config': {
+                'Binds': ['%s:%s:rw' % (os.path.join(cache, os.path.basename(d)), d)
+                          for d in YUM_CACHE_DIRECTORIES],
+            },
+        }
+
+    def commit_build_deps(self):
+        """
+        Commit the container from install_build_deps as the deps image,
+        keeping the command of the image it was started from.
+        """
+        try:
+            status = self.client.wait(self.deps_container)
+            if status != 0:
+                raise PackagerException(
+                    "yum-builddep exited with status {0}".format(status))
+
+            config = self.client.inspect_image(self.deps_build_tag)['Config']
+            repository, tag = self.deps_image_name.rsplit(':', 1)
+            self.client.commit(self.deps_container, repository=repository,
+                               tag=tag, conf={'Cmd': config['Cmd']})
+        finally:
+            self.client.remove_container(self.deps_container)
+
+        self.client.remove_image(self.deps_build_tag)
+
+    @staticmethod
+    def _collect_rpms(directory, output):
+        """
+        Move the RPMs below directory to the same place below output, then
+        remove directory, returning the new paths.  RPMs in directories the
+        container created owned by root may not be movable, and are copied
+        instead, leaving directory behind.
+        """
+        exported = []
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                if not name.endswith('.rpm'):
+                    continue
+                path = os.path.join(root, name)
+                target = os.path.join(output, os.path.relpath(path, directory))
+                if not os.path.isdir(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                try:
+                    os.rename(path, target)
+                except OSError:
+                    shutil.copy2(path, target)
+                exported.append(target)
+        shutil.rmtree(directory, ignore_errors=True)
+        return sorted(exported)
+
+    def build_package(self, output=None):
+        """
+        Build the RPM package on top of the provided image.  When an output
+        directory is given a new directory in it is bind-mounted over RPMS
+        and SRPMS, so rpmbuild writes the packages straight to the host, owned
+        by this user.  The ccache directory of the context, if any, is
+        mounted as the compiler cache.  With tmpfs_build BUILD and BUILDROOT
+        are tmpfs mounts of that size, so the build tree never goes through
+        the storage driver; RPMS and SRPMS stay on it.
+        """
+        self.container = self.client.create_container(
+            self.image['Id'], **self._package_options(output))
         self.client.start(self.container)
         return self.container, self.client.logs(self.container, stream=True)
 
+    def wait_package(self):
+        """
+        Wait for the container of build_package to exit, raising
+        PackagerException unless rpmbuild succeeded.
+        """
+        status = self.client.wait(self.container)
+        if status != 0:
+            raise PackagerException(
+                "rpmbuild exited with status {0}".format(status))
+
+    def remove_package(self):
+        """Remove the container of build_package, with its build tree."""
+        self.client.remove_container(self.container)
+
+    def _package_options(self, output):
+        """Keyword arguments of create_container for build_package."""
+        kwargs = {}
+        binds = []
+
+        if output is not None:
+            # A directory of its own, so builds running at once into the
+            # same output directory never list each other's RPMs.
+            self.bind_output = tempfile.mkdtemp(prefix='.rpmbuild-',
+                                                dir=os.path.abspath(output))
+            kwargs['volumes'] = list(RPM_DIRECTORIES)
+            binds.extend('%s:%s:rw' % (self.bind_output, directory)
+                         for directory in RPM_DIRECTORIES)
+
+        if self.context.ccache:
+            binds.append('%s:%s:rw' % (os.path.abspath(self.context.ccache),
+                                       CCACHE_DIRECTORY))
+
+        host_config = {}
+        if binds:
+            host_config['Binds'] = binds
+
+        if self.context.tmpfs_build is not None:
+            # tmpfs mounts are noexec by default, which configure scripts
+            # and test suites in BUILD cannot run with.
+            options = 'rw,exec,nosuid,nodev,size=%s' % self.context.tmpfs_build
+            host_config['Tmpfs'] = dict((d, options) for d in TMPFS_DIRECTORIES)
+
+        if self.context.memory is not None:
+            host_config['Memory'] = parse_size(self.context.memory)
+
+        jobs = None
+        if self.context.cpus is not None:
+            host_config['CpuPeriod'] = CPU_PERIOD
+            host_config['CpuQuota'] = int(self.context.cpus * CPU_PERIOD)
+            jobs = self.context.jobs
+
+        if jobs or output is not None:
+            command = self.context.command(jobs)
+            if output is not None:
+                # rpmbuild runs as root: hand the RPMs over to this user, so
+                # export_package can move them out and remove the directory.
+                command = '(%s); status=$?; chown -R %d:%d %s; exit $status' % (
+                    command, os.getuid(), os.getgid(), ' '.join(RPM_DIRECTORIES))
+            kwargs['command'] = ['/bin/sh', '-c', command]
+
+        if host_config:
+            kwargs['host_config'] = host_config
+
+        return kwargs
+
 
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,565 @@
+#!/usr/bin/env python
+
+"""
+Asyncio variant of Packager, so one event loop can drive many package builds
+with their output interleaved, instead of a thread per build.  Requires
+Python 3.6 or later; the rest of the package does not import this module.
+
+    async def build(context, output):
+        async with AsyncPackager(context, docker_config) as p:
+            return await run_packager(p, output)
+
+    loop.run_until_complete(asyncio.gather(*[build(c, output) for c in contexts]))
+"""
+
+import asyncio
+import inspect
+import io
+import json
+import os
+import struct
+import tarfile
+
+from urllib.parse import quote, urlencode
+
+from docker.client import DEFAULT_DOCKER_API_VERSION, DEFAULT_TIMEOUT_SECONDS
+from docker.utils import parse_host, parse_repository_tag
+
+from rpmbuild import (BASE_IMAGE_REPOSITORY, Packager, PackagerException,
+                      READ_BLOCKSIZE, RPM_DIRECTORIES, tar_stream)
+from rpmbuild.build import (BLOCKING, BUILD_OUTPUT, CALL, LOCK, RESULT, log,
+                            log_build_line, packager_steps)
+from rpmbuild.logs import LineBuffer, decode_line
+
+STREAM_HEADER = struct.Struct('>BxxxL')
+LOCK_POLL_INTERVAL = 0.1
+
+
+class APIError(PackagerException):
+    """Error status returned by the docker daemon."""
+
+    def __init__(self, status, message):
+        super().__init__('{0} {1}'.format(status, message))
+        self.status = status
+
+
+def _container_id(container):
+    if isinstance(container, dict):
+        return container['Id']
+    return container
+
+
+def _directory_archive(path):
+    """Tar stream of the contents of a staged context directory."""
+    for name in sorted(os.listdir(path)):
+        yield from tar_stream(os.path.join(path, name), name)
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def _dockerfile_archive(dockerfile):
+    """Build context holding nothing but a Dockerfile."""
+    f = io.BytesIO()
+    info = tarfile.TarInfo('Dockerfile')
+    info.size = len(dockerfile)
+    with tarfile.open(fileobj=f, mode='w') as archive:
+        archive.addfile(info, io.BytesIO(dockerfile))
+    return f.getvalue()
+
+
+class Response(object):
+    """
+    Response of the docker daemon with the body read on demand, decoding
+    chunked transfer encoding.  The connection is closed once the body has
+    been read, or by close().
+    """
+
+    def __init__(self, reader, writer, status, headers):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._writer = writer
+        self._chunked = headers.get('transfer-encoding', '').lower() == 'chunked'
+        self._remaining = None
+        self._chunk_left = 0
+        self._eof = False
+        if not self._chunked and 'content-length' in headers:
+            self._remaining = int(headers['content-length'])
+
+    def close(self):
+        self._eof = True
+        self._writer.close()
+
+    def _end(self):
+        self.close()
+        return b''
+
+    async def _read_at_most(self, n):
+        data = await self._reader.read(n)
+        if not data:
+            self.close()
+            raise PackagerException('Docker closed the connection mid-response')
+        return data
+
+    async def read(self, n=READ_BLOCKSIZE):
+        """Up to n bytes of the body, or b'' at its end."""
+        if self._eof:
+            return b''
+
+        if self._chunked:
+            if not self._chunk_left:
+                self._chunk_left = int((await self._reader.readline()).split(b';')[0], 16)
+                if not self._chunk_left:
+                    await self._reader.readline()
+                    return self._end()
+            data = await self._read_at_most(min(n, self._chunk_left))
+            self._chunk_left -= len(data)
+            if not self._chunk_left:
+                await self._reader.readline()
+            return data
+
+        if self._remaining is not None:
+            if not self._remaining:
+                return self._end()
+            data = await self._read_at_most(min(n, self._remaining))
+            self._remaining -= len(data)
+            return data
+
+        data = await self._reader.read(n)
+        return data or self._end()
+
+    async def readexactly(self, n):
+        """n bytes of the body, or fewer if it ends first."""
+        data = b''
+        while len(data) < n:
+            block = await self.read(n - len(data))
+            if not block:
+                break
+            data += block
+        return data
+
+    async def body(self):
+        blocks = []
+        while True:
+            block = await self.read()
+            if not block:
+                return b''.join(blocks)
+            blocks.append(block)
+
+    async def iter_lines(self):
+        """Lines of a streamed body, however the daemon chunked them."""
+        buf = LineBuffer()
+        while True:
+            block = await self.read()
+            if not block:
+                break
+            for line in buf.feed(block):
+                if line.strip():
+                    yield line
+        for line in buf.flush():
+            if line.strip():
+                yield line
+
+
+class _SyncReader(object):
+    """
+    Blocking file object over a Response, for tarfile running in an executor
+    thread while the event loop keeps serving the other builds.
+    """
+
+    def __init__(self, response, loop):
+        self.response = response
+        self.loop = loop
+
+    def read(self, n=READ_BLOCKSIZE):
+        return asyncio.run_coroutine_threadsafe(
+            self.response.readexactly(n), self.loop).result()
+
+
+class AsyncClient(object):
+    """
+    Minimal asyncio client for the docker remote API calls Packager makes,
+    over a unix socket or plain TCP.  A connection is opened per request.
+    """
+
+    def __init__(self, base_url=None, version=DEFAULT_DOCKER_API_VERSION,
+                 timeout=DEFAULT_TIMEOUT_SECONDS):
+        url = parse_host(base_url)
+        if url.startswith('http+unix://'):
+            self.socket = '/' + url[len('http+unix://'):].lstrip('/')
+            self.address = None
+        elif url.startswith('http://'):
+            host, _, port = url[len('http://'):].rstrip('/').partition(':')
+            self.socket = None
+            self.address = (host, int(port or 80))
+        else:
+            raise PackagerException(
+                'The asyncio client does not support {0}'.format(base_url))
+        self.version = version
+        self.timeout = timeout
+
+    def _connect(self):
+        if self.socket is not None:
+            return asyncio.open_unix_connection(self.socket)
+        return asyncio.open_connection(*self.address)
+
+    async def _read_head(self, reader, writer):
+        status_line = await reader.readline()
+        if not status_line:
+            raise PackagerException('Docker closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                return Response(reader, writer, status, headers)
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    async def request(self, method, path, params=None, body=None, data=None,
+                      headers=None):
+        """
+        Send a request and return its Response.  body is bytes or an
+        iterable of bytes sent chunked; data is sent as JSON.  Error
+        statuses raise APIError.
+        """
+        params = [(k, int(v) if isinstance(v, bool) else v)
+                  for k, v in sorted((params or {}).items()) if v is not None]
+        target = '/v{0}{1}'.format(self.version, path)
+        if params:
+            target += '?' + urlencode(params)
+
+        headers = dict(headers or {}, Host='docker', Connection='close')
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if body is None or isinstance(body, bytes):
+            headers['Content-Length'] = str(len(body or b''))
+        else:
+            headers['Transfer-Encoding'] = 'chunked'
+
+        reader, writer = await asyncio.wait_for(self._connect(), self.timeout)
+        try:
+            writer.write(''.join(
+                ['{0} {1} HTTP/1.1\r\n'.format(method, target)] +
+                ['{0}: {1}\r\n'.format(k, v) for k, v in headers.items()] +
+                ['\r\n']).encode('latin-1'))
+            if isinstance(body, bytes):
+                writer.write(body)
+            elif body is not None:
+                for chunk in body:
+                    if chunk:
+                        writer.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+                        await writer.drain()
+                writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            response = await asyncio.wait_for(self._read_head(reader, writer),
+                                              self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+
+        if response.status >= 400:
+            message = await response.body()
+            raise APIError(response.status,
+                           message.decode('utf-8', 'replace').strip())
+        return response
+
+    async def _json(self, method, path, **kwargs):
+        response = await self.request(method, path, **kwargs)
+        body = await response.body()
+        return json.loads(body.decode('utf-8')) if body.strip() else None
+
+    async def inspect_image(self, image):
+        return await self._json('GET', '/images/{0}/json'.format(image))
+
+    async def images(self, name=None):
+        return await self._json('GET', '/images/json', params={'filter': name})
+
+    async def pull(self, image):
+        repository, tag = parse_repository_tag(image)
+        response = await self.request('POST', '/images/create', params={
+            'fromImage': repository, 'tag': tag})
+        async for line in response.iter_lines():
+            status = json.loads(line.decode('utf-8'))
+            if 'error' in status:
+                raise APIError(500, status['error'])
+
+    async def build(self, context, tag):
+        """Upload a build context; the Response streams the build output."""
+        return await self.request('POST', '/build', params={'t': tag},
+                                  body=context,
+                                  headers={'Content-Type': 'application/tar'})
+
+    async def create_container(self, image, command=None, volumes=None,
+                               host_config=None):
+        config = {'Image': image}
+        if command is not None:
+            config['Cmd'] = command
+        if volumes:
+            config['Volumes'] = dict((volume, {}) for volume in volumes)
+        if host_config:
+            config['HostConfig'] = host_config
+        return await self._json('POST', '/containers/create', data=config)
+
+    async def start(self, container):
+        await self._json('POST', '/containers/{0}/start'.format(
+            _container_id(container)))
+
+    async def logs(self, container):
+        """Follow the output of a container, one multiplexed frame at a time."""
+        response = await self.request(
+            'GET', '/containers/{0}/logs'.format(_container_id(container)),
+            params={'stdout': True, 'stderr': True, 'follow': True})
+        try:
+            while True:
+                header = await response.readexactly(STREAM_HEADER.size)
+                if len(header) < STREAM_HEADER.size:
+                    break
+                _, length = STREAM_HEADER.unpack(header)
+                if not length:
+                    break
+                data = await response.readexactly(length)
+                if not data:
+                    break
+                yield data
+        finally:
+            response.close()
+
+    async def wait(self, container):
+        result = await self._json('POST', '/containers/{0}/wait'.format(
+            _container_id(container)))
+        return result.get('StatusCode', -1)
+
+    async def commit(self, container, repository=None, tag=None, conf=None):
+        return await self._json('POST', '/commit', data=conf, params={
+            'container': _container_id(container),
+            'repo': repository, 'tag': tag})
+
+    async def remove_container(self, container):
+        await self._json('DELETE', '/containers/{0}'.format(
+            _container_id(container)))
+
+    async def remove_image(self, image):
+        await self._json('DELETE', '/images/{0}'.format(quote(image)))
+
+    async def copy(self, container, resource):
+        """Fetch a path of a container; the Response streams it as tar."""
+        return await self.request(
+            'POST', '/containers/{0}/copy'.format(_container_id(container)),
+            data={'Resource': resource})
+
+
+class AsyncPackager(Packager):
+    """
+    Packager talking to docker through AsyncClient.  Use it as an async
+    context manager; the methods reaching docker are coroutines, and the
+    build output and container logs are async iterators.  Image names are
+    only available inside the async with block.
+    """
+
+    def __init__(self, context, docker_config):
+        self.context = context
+        self.docker_config = docker_config
+        self.client = AsyncClient(**dict(docker_config))
+        self.bind_output = None
+        self._base_image_name = None
+
+    async def __aenter__(self):
+        self.check_host()
+        self._base_image_name = self._base_image_tag(await self._base_image_id())
+        self.context.base_image = self._base_image_name
+        await asyncio.get_event_loop().run_in_executor(None,
+                                                       self.name_deps_image)
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await asyncio.get_event_loop().run_in_executor(None, self.context.teardown)
+
+    async def _base_image_id(self):
+        try:
+            return (await self.client.inspect_image(self.context.image))['Id']
+        except APIError:
+            await self.client.pull(self.context.image)
+
+        try:
+            return (await self.client.inspect_image(self.context.image))['Id']
+        except APIError:
+            raise PackagerException(
+                "Could not find base image {0}".format(self.context.image))
+
+    async def _find_image(self, repository, name):
+        for image in await self.client.images(name=repository):
+            if name in (image.get('RepoTags') or []):
+                return image
+        return None
+
+    async def image(self):
+        image = await self._find_image(self.image_repository, self.image_name)
+
+        if image is None:
+            raise PackagerException
+
+        return image
+
+    async def image_exists(self):
+        return await self._find_image(self.image_repository,
+                                      self.image_name) is not None
+
+    async def base_image_exists(self):
+        return await self._find_image(BASE_IMAGE_REPOSITORY,
+                                      self.base_image_name) is not None
+
+    async def deps_image_exists(self):
+        return await self._find_image(self.image_repository,
+                                      self.deps_image_name) is not None
+
+    async def build_base_image(self):
+        dockerfile = self.context.render_base().encode('utf-8')
+        response = await self.client.build(_dockerfile_archive(dockerfile),
+                                           self.base_image_name)
+        return response.iter_lines()
+
+    async def build_image(self):
+        """
+        Upload the build context, returning the build output once docker
+        has received all of it.
+        """
+        await asyncio.get_event_loop().run_in_executor(None, self.stage)
+        if self.context.stream:
+            context = self.context.archive()
+        else:
+            context = _directory_archive(self.context.path)
+        response = await self.client.build(context, self.image_name)
+        return response.iter_lines()
+
+    async def build_deps_image(self):
+        context = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: self.context.archive(deps=True))
+        response = await self.client.build(context, self.deps_build_tag)
+        return response.iter_lines()
+
+    async def install_build_deps(self):
+        options = self._build_deps_options()
+        self.deps_container = await self.client.create_container(
+            self.deps_build_tag, **options)
+        await self.client.start(self.deps_container)
+        return self.deps_container, self.client.logs(self.deps_container)
+
+    async def commit_build_deps(self):
+        try:
+            status = await self.client.wait(self.deps_container)
+            if status != 0:
+                raise PackagerException(
+                    "yum-builddep exited with status {0}".format(status))
+
+            config = (await self.client.inspect_image(
+                self.deps_build_tag))['Config']
+            repository, tag = self.deps_image_name.rsplit(':', 1)
+            await self.client.commit(self.deps_container, repository=repository,
+                                     tag=tag, conf={'Cmd': config['Cmd']})
+        finally:
+            await self.client.remove_container(self.deps_container)
+
+        await self.client.remove_image(self.deps_build_tag)
+
+    async def build_package(self, output=None):
+        options = self._package_options(output)
+        self.container = await self.client.create_container(
+            (await self.image())['Id'], **options)
+        await self.client.start(self.container)
+        return self.container, self.logs(self.container)
+
+    def logs(self, container):
+        return self.client.logs(container)
+
+    async def wait_package(self):
+        status = await self.client.wait(self.container)
+        if status != 0:
+            raise PackagerException(
+                "rpmbuild exited with status {0}".format(status))
+
+    async def remove_package(self):
+        await self.client.remove_container(self.container)
+
+    async def export_package(self, output):
+        """
+        Extract the RPMs of the container to output as Packager does, with
+        tarfile in an executor thread pulling data from the event loop.
+        """
+        if self.bind_output is not None:
+            return super().export_package(output)
+
+        loop = asyncio.get_event_loop()
+        exported = []
+
+        for directory in RPM_DIRECTORIES:
+            response = await self.client.copy(self.container, directory)
+            try:
+                exported.extend(await loop.run_in_executor(
+                    None, self._extract_rpms, _SyncReader(response, loop), output))
+            finally:
+                response.close()
+
+        return exported
+
+
+async def iter_lines(chunks):
+    """rpmbuild.logs.iter_lines for an async iterator of byte chunks."""
+    buf = LineBuffer()
+    async for chunk in chunks:
+        for line in buf.feed(chunk):
+            yield line
+    for line in buf.flush():
+        yield line
+
+
+async def log_build_output(lines, logger=None, report=None):
+    """log_build_output for the async iterators of AsyncPackager."""
+    logger = logger or log
+    async for line in lines:
+        log_build_line(line, logger, report)
+
+    if report is not None:
+        report.end_steps()
+
+
+async def run_packager(p, output, bind_output=False, logger=None, report=None,
+                       skip_unchanged=False):
+    """
+    run_packager for an AsyncPackager: the steps of packager_steps, with
+    the BLOCKING ones run in the executor so hashing, packing and walking
+    the sources do not hold up the other builds on the event loop.  Locks
+    are polled, so builds waiting for one do not hold executor threads.
+    """
+    loop = asyncio.get_event_loop()
+    steps = packager_steps(p, output, bind_output, logger, report,
+                           skip_unchanged)
+    result = error = None
+    while True:
+        step = steps.throw(error) if error is not None else steps.send(result)
+        kind, args = step[0], step[1:]
+        if kind == RESULT:
+            steps.close()
+            return args[0]
+
+        result = error = None
+        try:
+            if kind == CALL:
+                result = args[0](*args[1:])
+                if inspect.isawaitable(result):
+                    result = await result
+            elif kind == BLOCKING:
+                result = await loop.run_in_executor(None, args[0], *args[1:])
+            elif kind == LOCK:
+                while not args[0].acquire(False):
+                    await asyncio.sleep(LOCK_POLL_INTERVAL)
+            elif kind == BUILD_OUTPUT:
+                await log_build_output(*args)
+            else:
+                logs, logger = args
+                async for line in iter_lines(logs):
+                    logger(decode_line(line))
+        except Exception as e:
+            error = e
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
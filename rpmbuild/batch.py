@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+# Python 2/3 Compatibility
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import io
+import os
+import re
+import time
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from rpmbuild import PackagerException
+
+BATCH_EXTENSIONS = ('.spec', '.srpm', '.src.rpm', '.dockerrpm')
+VERSION_OPERATORS = ('<', '<=', '=', '==', '>=', '>')
+MACRO_EXPANSION_DEPTH = 10
+
+SPEC_TAG = re.compile(r'^(Name|Provides|BuildRequires)\s*:\s*(.+)$', re.IGNORECASE)
+SPEC_PACKAGE = re.compile(r'^%package\s+(.+)$')
+SPEC_MACRO = re.compile(r'^%(?:define|global)\s+(\w+)\s+(.+)$')
+MACRO_REFERENCE = re.compile(r'%\{\??(\w+)\}|%(\w+)')
+
+BatchResult = namedtuple('BatchResult', 'path exported error duration')
+
+
+def _first_name(path):
+    name = os.path.basename(path)
+    for extension in BATCH_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def find_specs(paths):
+    """
+    Expand the given spec, srpm and .dockerrpm files and directories into
+    the list of files to build.  A .dockerrpm next to a spec or srpm of the
+    same name is left out, as it is picked up together with that file.
+    """
+    found = []
+
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            candidates = [f for f in sorted(files) if f.endswith(BATCH_EXTENSIONS)]
+            packages = set(_first_name(f) for f in candidates
+                           if not f.endswith('.dockerrpm'))
+            for name in candidates:
+                if name.endswith('.dockerrpm') and _first_name(name) in packages:
+                    continue
+                found.append(os.path.join(root, name))
+
+    return found
+
+
+def _expand(value, macros):
+    for _ in range(MACRO_EXPANSION_DEPTH):
+        expanded = MACRO_REFERENCE.sub(
+            lambda m: macros.get(m.group(1) or m.group(2), m.group(0)), value)
+        if expanded == value:
+            break
+        value = expanded
+    return value
+
+
+def _capabilities(value):
+    """Capability names of a Provides/BuildRequires value, without versions."""
+    names = []
+    tokens = iter(t for t in re.split(r'[\s,]+', value) if t)
+    for token in tokens:
+        if token in VERSION_OPERATORS:
+            next(tokens, None)
+        else:
+            names.append(token)
+    return names
+
+
+def parse_spec(path):
+    """
+    Collect what a spec provides (package and subpackage names, Provides)
+    and what it BuildRequires.  Only %define/%global macros of the spec
+    itself are expanded, and conditionals are ignored, so the result errs on
+    the side of extra dependencies.
+    """
+    macros = {}
+    name = None
+    provides = set()
+    requires = set()
+
+    with io.open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+
+            match = SPEC_MACRO.match(line)
+            if match:
+                macros[match.group(1)] = match.group(2).strip()
+                continue
+
+            match = SPEC_PACKAGE.match(line)
+            if match and name:
+                args = _expand(match.group(1), macros).split()
+                if '-n' in args[:-1]:
+                    provides.add(args[args.index('-n') + 1])
+                else:
+                    provides.add('%s-%s' % (name, args[-1]))
+                continue
+
+            match = SPEC_TAG.match(line)
+            if match:
+                tag = match.group(1).lower()
+                value = _expand(match.group(2), macros)
+                if tag == 'name' and name is None:
+                    name = macros['name'] = value.strip()
+                    provides.add(name)
+                elif tag == 'provides':
+                    provides.update(_capabilities(value))
+                elif tag == 'buildrequires':
+                    requires.update(_capabilities(value))
+
+    return provides, requires
+
+
+def _check_cycles(graph):
+    visiting, visited = set(), set()
+
+    def visit(path, trail):
+        if path in visiting:
+            cycle = trail[trail.index(path):]
+            raise PackagerException('Circular BuildRequires: {0}'.format(
+                ' -> '.join(cycle + [path])))
+        if path in visited:
+            return
+        visiting.add(path)
+        for dependency in sorted(graph[path]):
+            visit(dependency, trail + [path])
+        visiting.remove(path)
+        visited.add(path)
+
+    for path in sorted(graph):
+        visit(path, [])
+
+
+def build_graph(specs):
+    """
+    Map every batch entry to the entries it BuildRequires.  specs maps each
+    entry to its spec file, or None when there is no spec to parse (srpms).
+    Raises PackagerException if the BuildRequires form a cycle.
+    """
+    parsed = dict((path, parse_spec(spec))
+                  for path, spec in specs.items() if spec)
+
+    providers = {}
+    for path, (provides, requires) in parsed.items():
+        for capability in provides:
+            providers.setdefault(capability, set()).add(path)
+
+    graph = {}
+    for path in specs:
+        dependencies = set()
+        if path in parsed:
+            for capability in parsed[path][1]:
+                dependencies.update(providers.get(capability, ()))
+        dependencies.discard(path)
+        graph[path] = dependencies
+
+    _check_cycles(graph)
+    return graph
+
+
+def run_batch(paths, build, workers, done=None, graph=None):
+    """
+    Call build(path, repo) for every path using up to workers threads.  build
+    returns the exported files; any exception it raises marks that path as
+    failed without stopping the others.
+
+    graph maps a path to the paths it depends on.  A path is only started
+    once its dependencies succeeded, and repo then lists the binary RPMs
+    they exported, transitively.  If a dependency failed the path is not
+    built at all.  done, if given, is called with each BatchResult as it
+    completes.
+    """
+    graph = graph or {}
+    results = {}
+    finished = queue.Queue()
+
+    def run(path, repo):
+        start = time.time()
+        try:
+            return BatchResult(path, build(path, repo), None, time.time() - start)
+        except Exception as e:
+            return BatchResult(path, [], str(e) or e.__class__.__name__,
+                               time.time() - start)
+
+    def complete(result):
+        results[result.path] = result
+        if done is not None:
+            done(result)
+
+    def repo_for(path, seen):
+        rpms = []
+        for dependency in sorted(graph.get(path, ())):
+            if dependency not in seen:
+                seen.add(dependency)
+                rpms.extend(f for f in results[dependency].exported
+                            if not f.endswith('.src.rpm'))
+                rpms.extend(repo_for(dependency, seen))
+        return rpms
+
+    pool = ThreadPool(workers)
+    pending = list(paths)
+    running = 0
+    try:
+        while pending or running:
+            for path in list(pending):
+                dependencies = graph.get(path, ())
+                if any(d not in results for d in dependencies):
+                    continue
+                pending.remove(path)
+                failed = sorted(d for d in dependencies
+                                if results[d].error is not None)
+                if failed:
+                    complete(BatchResult(path, [], 'Dependency failed: {0}'.format(
+                        ', '.join(failed)), 0.0))
+                    continue
+                pool.apply_async(run, (path, repo_for(path, set())),
+                                 callback=finished.put)
+                running += 1
+
+            if running:
+                complete(finished.get())
+                running -= 1
+            elif pending and not any(all(d in results for d in graph.get(p, ()))
+                                     for p in pending):
+                raise PackagerException('Unresolvable dependencies: {0}'.format(
+                    ', '.join(pending)))
+    finally:
+        pool.close()
+        pool.join()
+
+    return [results[path] for path in paths]
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -8,27 +8,125 @@ Usage:
                           [--docker-timeout=<seconds>]
                           [--docker-version=<version>]
                           [--define=<option>...]
+                          [--stream-context | --staging-dir=<dir>]
+                          [--bind-output]
+                          [--yum-cache=<dir>]
+                          [--ccache=<dir>]
+                          [--tmpfs-build=<size>]
+                          [--cpus=<n>] [--memory=<size>]
+                          [--report=<file>]
+                          [--quiet] [--log-file=<file> [--log-compression=<codec>]]
+                          [--skip-if-unchanged]
                           (--source=<tarball>...|--sources-dir=<dir>)
                           (--spec=<file> [--macrofile=<file>...] [--retrieve] [--output=<path>])
-                          <image>
+                          <image>...
+    docker-rpmbuild batch [--docker-base_url=<url>]
+                          [--docker-timeout=<seconds>]
+                          [--docker-version=<version>]
+                          [--docker-host=<url>...]
+                          [--docker-max-connections=<n>]
+                          [--define=<option>...]
+                          [--stream-context | --staging-dir=<dir>]
+                          [--bind-output]
+                          [--yum-cache=<dir>]
+                          [--ccache=<dir>]
+                          [--tmpfs-build=<size>]
+                          [--cpus=<n>] [--memory=<size>]
+                          [--report=<file>]
+                          [--quiet] [--log-file=<file> [--log-compression=<codec>]]
+                          [--skip-if-unchanged]
+                          [--workers=<n>]
+                          [--image=<image>]
+                          [--output=<path>]
+                          <path>...
+    docker-rpmbuild serve [--docker-base_url=<url>]
+                          [--docker-timeout=<seconds>]
+                          [--docker-version=<version>]
+                          [--docker-host=<url>...]
+                          [--docker-max-connections=<n>]
+                          [--socket=<path>|--listen=<address>]
+                          [--root=<dir>]
+                          [--workers=<n>]
+                          [--output=<path>]
     docker-rpmbuild rebuild --srpm=<file>
     docker-rpmbuild rebuild [--docker-base_url=<url>]
                             [--docker-timeout=<seconds>]
                             [--docker-version=<version>]
+                            [--stream-context | --staging-dir=<dir>]
+                            [--bind-output]
+                            [--ccache=<dir>]
+                            [--tmpfs-build=<size>]
+                            [--cpus=<n>] [--memory=<size>]
+                            [--report=<file>]
+                            [--quiet] [--log-file=<file> [--log-compression=<codec>]]
+                            [--skip-if-unchanged]
                             (--srpm=<file> [--output=<path>])
-                            <image>
+                            <image>...
 
 Options:
     -h --help            Show this screen.
     --config=<file>      Configuration file
     --define=<option>    Pass a macro to rpmbuild.
     --output=<path>      Output directory for RPMs [default: .].
+    --bind-output        Bind-mount a directory in the output directory into
+                         the container so rpmbuild writes the RPMs straight to
+                         the host, then move them to the output directory.
+    --yum-cache=<dir>    Host directory kept as yum/dnf package cache for
+                         installing BuildRequires, shared by all builds.
+    --ccache=<dir>       Compile through ccache, with <dir> on the host as the
+                         persistent cache.  Statistics are printed after the
+                         build.
+    --tmpfs-build=<size>
+                         Mount BUILD and BUILDROOT in the build container on a
+                         tmpfs of <size>, e.g. 8g, or 0 for no limit.  Needs
+                         docker API 1.22 or later.
+    --cpus=<n>           CPUs the build container may use, e.g. 4 or 1.5.
+                         rpmbuild runs make with as many jobs, rounded up,
+                         through _smp_mflags.  Needs docker API 1.19 or later.
+                         batch, serve and matrix builds without it get an
+                         equal share of the CPUs of the docker hosts per
+                         concurrent build.
+    --memory=<size>      Memory limit of the build container, e.g. 4g.
+    --report=<file>      Write phase and Dockerfile step timings, cache hits,
+                         context size and artifact sizes to <file> as JSON.
+    -q --quiet           Only print progress and errors, not the build output.
+                         The last lines of the output of a failed build are
+                         printed, and kept in its report.
+    --log-file=<file>    Append the build output to <file>, rotating it once
+                         it grows past 64 MiB.
+    --log-compression=<codec>
+                         Compression of rotated log files, gzip or zstd
+                         [default: gzip].
+    --skip-if-unchanged  Skip the build when the RPMs of identical inputs,
+                         the spec, sources, macrofiles, defines and base image
+                         ID, are in the output directory, and record the RPMs
+                         built otherwise.
     --source=<tarball>   Tarball containing package sources.
     --sources-dir=<dir>  Directory containing resources required for spec.
     -r --retrieve        Fetch defined resources in spec file with spectool inside container
     --spec=<file>        RPM Spec file to build.
     --macrofile=<file>   Defines added in a file, will reside together with SPECS/
     --srpm=<file>        SRPM to rebuild.
+    --workers=<n>        Number of packages built concurrently by batch and
+                         serve (default: number of CPUs of the docker hosts,
+                         divided by --cpus, or by 4 without it).
+    --image=<image>      Base docker image for batch packages without an
+                         image in their .dockerrpm.
+    --stream-context     Stream the build context to docker as a tar read from
+                         the original files instead of copying them to a
+                         temporary directory first.
+    --staging-dir=<dir>  Directory the build context is staged in.  On the
+                         filesystem of the sources files are hardlinked or
+                         reflinked instead of copied (default: the system
+                         temporary directory).
+    --socket=<path>      Unix socket the build service listens on
+                         [default: docker-rpmbuild.sock].
+    --listen=<address>   host:port for the build service to listen on instead
+                         of a unix socket.  Only loopback addresses, such as
+                         localhost:8080, are accepted.
+    --root=<dir>         Directory the paths in build service jobs are
+                         relative to, and must be below (default: the current
+                         directory).
 
 Docker Options:
     --docker-base_url=<url>     protocol+hostname+port towards docker
@@ -36,84 +134,595 @@ Docker Options:
     --docker-timeout=<seconds>  HTTP request timeout in seconds towards docker API. (default: 600)
     --docker-version=<version>  API version the docker client will use towards
                                 docker (example: 1.12)
+    --docker-host=<url>         Docker daemon to build on, given once per
+                                host.  Every package goes to the least loaded
+                                host, preferring hosts with its images cached.
+    --docker-max-connections=<n>
+                                Most docker clients, and so connections, a
+                                batch uses at once per docker daemon.  Clients
+                                are reused across packages (default: one per
+                                worker).
 """
 
 from __future__ import print_function, unicode_literals
 
 import json
+import multiprocessing
 import sys
 import os
+import time
 
 from docopt import docopt, DocoptExit
-from rpmbuild import Packager, PackagerContext, PackagerException
-from rpmbuild.config import get_docker_config, get_parsed_config
+from rpmbuild import Packager, PackagerContext, PackagerException, replace_invalid_chars
+from rpmbuild.batch import build_graph, find_specs, run_batch
+from rpmbuild.config import get_docker_configs, get_parsed_config, get_batch_config
+from rpmbuild.logs import BuildLog, LogFile, decode_line, iter_json, iter_lines
+from rpmbuild.manifest import Manifest
+from rpmbuild.pool import ClientPool, HostScheduler
+from rpmbuild.report import BuildReport, write_report
+from rpmbuild.service import JobQueue, make_server, parse_listen
+
+# CPUs, and make jobs, of each build running at once without --cpus.
+BUILD_CPUS = 4
 
 
 def log(message, file=None):
     if file is not None:
-        print(message, file)
+        print(message, file=file)
     else:
         print(message)
 
 
+def log_build_output(lines, logger=None, report=None):
+    """
+    Log the JSON stream of a docker image build, raising PackagerException
+    when the build reports an error.  Steps are timed on report, if given.
+    """
+    logger = logger or log
+    for parsed in iter_json(lines):
+        log_build_object(parsed, logger, report)
+
+    if report is not None:
+        report.end_steps()
+
+
+def log_build_line(line, logger, report=None):
+    """Log one JSON line of a docker image build, see log_build_output."""
+    log_build_object(json.loads(line.decode('utf-8')), logger, report)
+
+
+def log_build_object(parsed, logger, report=None):
+    """Log one object of a docker image build, see log_build_output."""
+    if 'stream' not in parsed:
+        logger(parsed)
+        if 'error' in parsed:
+            if 'errorDetail' in parsed:
+                raise PackagerException(
+                    "{0} : {1}".format(
+                        parsed['error'],
+                        parsed['errorDetail']))
+            raise PackagerException(parsed['error'])
+    else:
+        if report is not None:
+            report.build_output(parsed['stream'])
+        logger(parsed['stream'].strip())
+
+
+# The steps packager_steps yields, see there.
+CALL = 'call'
+BLOCKING = 'blocking'
+BUILD_OUTPUT = 'build_output'
+CONTAINER_OUTPUT = 'container_output'
+LOCK = 'lock'
+RESULT = 'result'
+
+
+def packager_steps(p, output, bind_output=False, logger=None, report=None,
+                   skip_unchanged=False):
+    """
+    The phases of run_packager, shared with its asyncio variant in aio.py:
+    a generator of the steps that wait on docker, the disk or the CPU, for
+    the caller to carry out, sending the result of each back in:
+
+    (CALL, f, args...)               call f, which reaches docker through p
+    (BLOCKING, f, args...)           call f, which hashes or reads the sources
+    (BUILD_OUTPUT, lines, logger, report)
+                                     log_build_output
+    (CONTAINER_OUTPUT, logs, logger) log the output of a container
+    (LOCK, lock)                     acquire a lock (a threading.Lock or a
+                                     FileLock), which the generator releases
+    (RESULT, exported)               the last step, with the exported files
+
+    An exception raised by a step is thrown back into the generator.
+    """
+    logger = logger or log
+    report = report or BuildReport(str(p.context))
+    digest = yield BLOCKING, lambda: p.context.digest
+
+    if skip_unchanged:
+        manifest = Manifest(output)
+        exported = manifest.lookup(digest)
+        if exported is not None:
+            logger('Unchanged, using the RPMs in %s' % output)
+            report.skipped = True
+            report.add_artifacts(exported)
+            yield RESULT, exported
+            return
+
+    report.image_cached = yield CALL, p.image_exists
+
+    if report.image_cached:
+        logger('Using cached image %s' % p.image_name)
+    else:
+        report.base_image_cached = yield CALL, p.base_image_exists
+        if not report.base_image_cached:
+            lock = p.base_image_lock()
+            yield LOCK, lock
+            try:
+                # Another build may have built it while this one waited.
+                report.base_image_cached = yield CALL, p.base_image_exists
+                if not report.base_image_cached:
+                    with report.phase('base_image_build'):
+                        lines = yield CALL, p.build_base_image
+                        yield BUILD_OUTPUT, lines, logger, None
+            finally:
+                lock.release()
+
+        if p.context.yum_cache:
+            deps_cached = yield CALL, p.deps_image_exists
+            if not deps_cached:
+                with report.phase('build_deps'):
+                    lines = yield CALL, p.build_deps_image
+                    yield BUILD_OUTPUT, lines, logger, None
+                    lock = p.yum_cache_lock()
+                    yield LOCK, lock
+                    try:
+                        container, logs = yield CALL, p.install_build_deps
+                        yield CONTAINER_OUTPUT, logs, logger
+                        yield CALL, p.commit_build_deps
+                    finally:
+                        lock.release()
+
+        with report.phase('context_setup'):
+            yield BLOCKING, p.stage
+            report.context_size = yield BLOCKING, lambda: p.context.size
+
+        with report.phase('context_upload'):
+            lines = yield CALL, p.build_image
+        with report.phase('image_build'):
+            yield BUILD_OUTPUT, lines, logger, report
+
+    if bind_output and not p.local:
+        logger('Exporting the RPMs through the docker API, as the docker '
+               'daemon is not on this host')
+        bind_output = False
+
+    with report.phase('container_start'):
+        container, logs = yield CALL, lambda: p.build_package(
+            output=output if bind_output else None)
+
+    try:
+        with report.phase('rpmbuild'):
+            yield CONTAINER_OUTPUT, logs, logger
+            yield CALL, p.wait_package
+
+        with report.phase('export'):
+            exported = yield CALL, p.export_package, output
+    finally:
+        yield CALL, p.remove_package
+
+    if skip_unchanged:
+        manifest.record(digest, str(p.context), exported)
+
+    report.add_artifacts(exported)
+    yield RESULT, exported
+
+
+def run_packager(p, output, bind_output=False, logger=None, report=None,
+                 skip_unchanged=False):
+    """
+    Build the image, unless an identical one exists, then build the package
+    and export it to output.  Returns the exported files.  Every phase is
+    timed on report, if given.  With skip_unchanged the RPMs already built
+    from identical inputs are returned instead, if the Manifest of output
+    lists them, and the RPMs built are added to it otherwise.
+    """
+    steps = packager_steps(p, output, bind_output, logger, report,
+                           skip_unchanged)
+    result = error = None
+    while True:
+        step = steps.throw(error) if error is not None else steps.send(result)
+        kind, args = step[0], step[1:]
+        if kind == RESULT:
+            steps.close()
+            return args[0]
+
+        result = error = None
+        try:
+            if kind in (CALL, BLOCKING):
+                result = args[0](*args[1:])
+            elif kind == LOCK:
+                args[0].acquire()
+            elif kind == BUILD_OUTPUT:
+                log_build_output(*args)
+            else:
+                logs, logger = args
+                for line in iter_lines(logs):
+                    logger(decode_line(line))
+        except Exception as e:
+            error = e
+
+
+def get_images(args, config):
+    """Target images of a build: <image>... or the image(s) of the config."""
+    images = args.get('<image>') or config.get('image') or []
+    if not isinstance(images, list):
+        images = [images]
+    return [image.strip() for image in images if image.strip()]
+
+
 def get_context(args, config, path_to_config):
     context = None
+    images = get_images(args, config) or [None]
     if path_to_config is None:
         path_to_config=''
     path_to_config = os.path.split(path_to_config)[0]
     if args['build'] or config.get('build'):
         context = PackagerContext(
-            args['<image>'] or config.get('image'),
+            images[0],
             defines=args['--define'] or config.get('define'),
             sources=args['--source'] or config.get('source') and [os.path.join(path_to_config, x) for x in config.get('source')],
             sources_dir=args['--sources-dir'] or config.get('sources_dir') and os.path.join(path_to_config, config.get('sources_dir')),
             spec=args['--spec'] or config.get('spec') and os.path.join(path_to_config, config.get('spec')),
             macrofiles=args['--macrofile'] or config.get('macrofile') and [os.path.join(path_to_config, x) for x in config.get('macrofile')],
             retrieve=args['--retrieve'] or config.get('retrieve'),
+            stream=args['--stream-context'] or config.get('stream_context'),
+            staging_dir=args.get('--staging-dir') or config.get('staging_dir') and os.path.join(path_to_config, config.get('staging_dir')),
+            yum_cache=args['--yum-cache'] or config.get('yum_cache') and os.path.join(path_to_config, config.get('yum_cache')),
+            ccache=args['--ccache'] or config.get('ccache') and os.path.join(path_to_config, config.get('ccache')),
+            tmpfs_build=args.get('--tmpfs-build') or config.get('tmpfs_build'),
+            cpus=args.get('--cpus') or config.get('cpus'),
+            memory=args.get('--memory') or config.get('memory'),
         )
 
     if args['rebuild'] or config.get('rebuild'):
         context = PackagerContext(
-            args['<image>'] or config.get('image'),
-            srpm=args['--srpm'] or config.get('srpm')
+            images[0],
+            srpm=args['--srpm'] or config.get('srpm'),
+            stream=args['--stream-context'] or config.get('stream_context'),
+            staging_dir=args.get('--staging-dir') or config.get('staging_dir') and os.path.join(path_to_config, config.get('staging_dir')),
+            ccache=args['--ccache'] or config.get('ccache') and os.path.join(path_to_config, config.get('ccache')),
+            tmpfs_build=args.get('--tmpfs-build') or config.get('tmpfs_build'),
+            cpus=args.get('--cpus') or config.get('cpus'),
+            memory=args.get('--memory') or config.get('memory'),
         )
     if context is None:
         raise DocoptExit('Could not create context, missing configuration')
     return context
 
+def host_cpus(pool, docker_configs):
+    """
+    The CPUs of each docker host of docker_configs, as their daemons report
+    them.  Hosts that cannot be reached are left out, and this host's CPUs
+    are counted if none can.
+    """
+    cpus = []
+    for docker_config in docker_configs:
+        try:
+            with pool.client(docker_config) as client:
+                cpus.append(int(client.info()['NCPU']))
+        except Exception:
+            pass
+    return cpus or [multiprocessing.cpu_count()]
+
+
+def _parse_cpus(value):
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def get_workers(args, cpus, build_cpus=()):
+    """
+    --workers, or as many builds as cpus, the CPUs of the docker hosts, fit
+    at --cpus each, else at the largest of the cpus of the packages, if
+    build_cpus lists them, and BUILD_CPUS.
+    """
+    if args.get('--workers'):
+        return int(args['--workers'])
+    per_build = _parse_cpus(args.get('--cpus'))
+    if per_build is None:
+        per_build = max([BUILD_CPUS] + [c for c in map(_parse_cpus, build_cpus) if c])
+    return max(1, int(sum(cpus) // max(per_build, 1)))
+
+
+def share_cpus(context, cpus, builds):
+    """
+    Limit context, unless it sets cpus itself, to an equal share of cpus,
+    the CPUs of the docker hosts, among builds running at once, and to the
+    CPUs of one host, so they do not oversubscribe the hosts.
+    """
+    if context.cpus is None:
+        context.cpus = float(max(1, min(max(cpus), sum(cpus) // max(builds, 1))))
+
+
+def batch(args):
+    """
+    Build every spec, srpm and .dockerrpm found in args['<path>'] with up to
+    --workers packages in flight, then print a summary.  Packages are built
+    after the packages providing their BuildRequires, whose RPMs are handed
+    to them as a local yum repository.
+    """
+    paths = find_specs(args['<path>'])
+    output = args['--output'] or '.'
+
+    specs = {}
+    package_cpus = []
+    for path in paths:
+        config, path_to_config = get_batch_config(path)
+        package_cpus.append(config.get('cpus'))
+        if path.endswith('.spec'):
+            specs[path] = path
+        elif path.endswith('.dockerrpm') and config.get('spec'):
+            specs[path] = os.path.join(os.path.dirname(path), config.get('spec'))
+        else:
+            specs[path] = None
+
+    try:
+        graph = build_graph(specs)
+    except PackagerException as e:
+        log(str(e), file=sys.stderr)
+        return False
+
+    def build_one(path, repo):
+        config, path_to_config = get_batch_config(path)
+        name = os.path.basename(path)
+        spec = path if path.endswith('.spec') else None
+        srpm = path if path.endswith(('.srpm', '.src.rpm')) else None
+        rebuild = bool(srpm or (config.get('srpm') and not config.get('spec')))
+        context = get_context(dict(args, **{
+            'build': not rebuild,
+            'rebuild': rebuild,
+            '<image>': args['--image'],
+            '--spec': spec,
+            '--srpm': srpm,
+        }), config, path_to_config)
+        context.repo = repo
+        share_cpus(context, cpus, min(workers, len(paths)))
+        if len(get_images(args, config)) > 1:
+            log('[%s] Matrix builds are not supported by batch, building %s '
+                'only' % (name, context.image), file=sys.stderr)
+        report = BuildReport(path)
+        reports.append(report)
+
+        return run_scheduled(
+            scheduler, context, get_docker_configs(args, config), output,
+            bind_output=args['--bind-output'] or config.get('bind_output'),
+            logger=BuildLog(log, log_file, args['--quiet'], '[%s] ' % name),
+            report=report,
+            skip_unchanged=(args['--skip-if-unchanged'] or
+                            config.get('skip_if_unchanged')))
+
+    reports = []
+    pool = ClientPool(int(args['--docker-max-connections'] or 0))
+    scheduler = HostScheduler(pool, log)
+    log_file = open_log_file(args)
+    start = time.time()
+    try:
+        cpus = host_cpus(pool, get_docker_configs(args, {}))
+        workers = get_workers(args, cpus, package_cpus)
+        results = run_batch(paths, build_one, workers, log_result, graph)
+    finally:
+        pool.close()
+        if log_file is not None:
+            log_file.close()
+
+    if args['--report']:
+        write_report(args['--report'], reports)
+
+    return log_summary(results, 'package(s)', start)
+
+
+def matrix(args, config, context, images):
+    """
+    Build context for every one of images in parallel, writing the RPMs of
+    each to a subdirectory of --output named after the image.  The sources
+    are hashed once for all images, and streamed to docker from where they
+    are instead of being staged once per image.
+    """
+    context.stream = True
+    docker_configs = get_docker_configs(args, config)
+    bind_output = args['--bind-output'] or config.get('bind_output')
+    skip_unchanged = (args['--skip-if-unchanged'] or
+                      config.get('skip_if_unchanged'))
+
+    def build_one(image, repo):
+        target = context.for_image(image)
+        output = os.path.join(args['--output'], replace_invalid_chars(image))
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        report = BuildReport(image)
+        reports.append(report)
+
+        return run_scheduled(
+            scheduler, target, docker_configs, output, bind_output=bind_output,
+            logger=BuildLog(log, log_file, args['--quiet'], '[%s] ' % image),
+            report=report, skip_unchanged=skip_unchanged)
+
+    reports = []
+    pool = ClientPool()
+    scheduler = HostScheduler(pool, log)
+    log_file = open_log_file(args)
+    start = time.time()
+    try:
+        cpus = host_cpus(pool, docker_configs)
+        workers = min(len(images), get_workers(args, cpus))
+        share_cpus(context, cpus, workers)
+        results = run_batch(images, build_one, workers, log_result)
+    finally:
+        pool.close()
+        if log_file is not None:
+            log_file.close()
+
+    if args['--report']:
+        write_report(args['--report'], reports)
+
+    return log_summary(results, 'target(s)', start)
+
+
+def run_scheduled(scheduler, context, docker_configs, output, bind_output=False,
+                  logger=None, report=None, skip_unchanged=False):
+    """
+    run_packager on the docker host the scheduler places context on, with
+    the Packager borrowing its client from the scheduler's pool.  report
+    also records why a build failed and, for a BuildLog logger, the last
+    lines it logged.  Those are printed when the output was quiet.
+    """
+    report = report or BuildReport(str(context))
+    try:
+        with scheduler.place(context, docker_configs) as docker_config:
+            with Packager(context, docker_config, pool=scheduler.pool) as p:
+                return run_packager(p, output, bind_output, logger=logger,
+                                    report=report,
+                                    skip_unchanged=skip_unchanged)
+    except Exception as e:
+        report.error = str(e) or e.__class__.__name__
+        if isinstance(logger, BuildLog):
+            report.log_tail = logger.tail()
+            if logger.quiet:
+                for line in report.log_tail:
+                    log(logger.prefix + line, file=sys.stderr)
+        raise
+
+
+def open_log_file(args):
+    """The LogFile of --log-file, or None."""
+    if not args.get('--log-file'):
+        return None
+    return LogFile(args['--log-file'], args.get('--log-compression') or 'gzip')
+
+
+def log_result(result):
+    """Log a BatchResult as it completes."""
+    if result.error is None:
+        log('[%s] OK in %.1fs, %d file(s)' % (
+            result.path, result.duration, len(result.exported)))
+    else:
+        log('[%s] FAILED in %.1fs: %s' % (
+            result.path, result.duration, result.error), file=sys.stderr)
+
+
+def log_summary(results, what, start):
+    """Log the outcome of run_batch, returning whether everything built."""
+    failed = [r for r in results if r.error is not None]
+
+    log('%d %s built, %d failed in %.1fs' % (
+        len(results) - len(failed), what, len(failed), time.time() - start))
+    for result in failed:
+        log('Failed: %s' % result.path, file=sys.stderr)
+
+    return not failed
+
+
+def serve(args):
+    """
+    Run the build service: jobs with PackagerContext arguments are taken over
+    HTTP, on a unix socket or TCP, and built by --workers threads sharing
+    their docker clients, with the logs and RPMs of each job served back.
+    """
+    docker_configs = get_docker_configs(args, {})
+    pool = ClientPool(int(args['--docker-max-connections'] or 0))
+    scheduler = HostScheduler(pool, log)
+    cpus = host_cpus(pool, docker_configs)
+    workers = get_workers(args, cpus)
+
+    def build_job(job):
+        arguments = dict(job.arguments)
+        bind_output = arguments.pop('bind_output', False)
+
+        def log_job(message):
+            job.log(message)
+            log('[%s] %s' % (job.id, message))
+
+        context = PackagerContext(**arguments)
+        share_cpus(context, cpus, workers)
+        return run_scheduled(scheduler, context, docker_configs, job.output,
+                             bind_output, logger=BuildLog(log_job),
+                             report=job.report)
+
+    if args['--listen']:
+        try:
+            address = parse_listen(args['--listen'])
+        except PackagerException as e:
+            log(str(e), file=sys.stderr)
+            sys.exit(1)
+    else:
+        address = args['--socket']
+
+    jobs = JobQueue(build_job, workers, os.path.abspath(args['--output']),
+                    root=args['--root'] or '.')
+
+    server = make_server(address, jobs, log)
+    log('Serving on %s with %d worker(s)' % (args['--listen'] or address, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        if not args['--listen']:
+            os.unlink(address)
+
+
 def main():
     args = docopt(__doc__, version='Docker Packager 0.0.1')
+
+    if args['batch']:
+        if not batch(args):
+            sys.exit(1)
+        return
+
+    if args['serve']:
+        serve(args)
+        return
+
     config, path_to_config = get_parsed_config(args)
     context = get_context(args, config, path_to_config)
+    images = get_images(args, config)
+
+    if len(images) > 1:
+        if not matrix(args, config, context, images):
+            sys.exit(1)
+        return
+
+    report = BuildReport(str(context))
+    scheduler = HostScheduler(ClientPool())
+    log_file = open_log_file(args)
 
     try:
-        with Packager(context,  get_docker_config(args, config)) as p:
-            for line in p.build_image():
-                parsed = json.loads(line.decode('utf-8'))
-                if 'stream' not in parsed:
-                    log(parsed)
-                    if 'error' in parsed:
-                        if 'errorDetail' in parsed:
-                            raise PackagerException(
-                                "{0} : {1}".format(
-                                    parsed['error'],
-                                    parsed['errorDetail']))
-                        raise PackagerException(parsed['error'])
-                else:
-                    log(parsed['stream'].strip())
-
-            container, logs = p.build_package()
-
-            for line in logs:
-                log(line.decode('utf-8').strip())
-
-            for path in p.export_package(args['--output']):
-                log('Wrote: %s' % path)
+        bind_output = args['--bind-output'] or config.get('bind_output')
+        for path in run_scheduled(scheduler, context,
+                                  get_docker_configs(args, config),
+                                  args['--output'], bind_output,
+                                  logger=BuildLog(log, log_file, args['--quiet']),
+                                  report=report,
+                                  skip_unchanged=(args['--skip-if-unchanged'] or
+                                                  config.get('skip_if_unchanged'))):
+            log('Wrote: %s' % path)
 
     except PackagerException:
         log('Container build failed!', file=sys.stderr)
         sys.exit(1)
 
+    finally:
+        scheduler.pool.close()
+        if log_file is not None:
+            log_file.close()
+        if args['--report']:
+            write_report(args['--report'], report)
+
 if __name__ == '__main__':
     main()
 
@@ -13,11 +13,14 @@ import os
 
 
 DEFAULT_TIMEOUT = '600'
+GLOBAL_CONFIG = '~/.docker-rpmbuild'
+GLOBAL_CONFIG_ENVIRONMENT = 'DOCKER_RPMBUILD_CONFIG'
 
 CONFIG_OPTIONS_DOCKER = {
     'version': 'get',
     'timeout': 'getint',
-    'base_url': 'get'
+    'base_url': 'get',
+    'hosts': 'multi-get'
 }
 
 CONFIG_OPTIONS_RPMBUILD = {
@@ -26,8 +29,19 @@ CONFIG_OPTIONS_RPMBUILD = {
     'sources_dir': 'get',
     'macrofile': 'multi-get',
     'retrieve': 'getboolean',
+    'spec': 'get',
+    'srpm': 'get',
     'output': 'get',
-    'image': 'get'
+    'bind_output': 'getboolean',
+    'skip_if_unchanged': 'getboolean',
+    'image': 'multi-get',
+    'stream_context': 'getboolean',
+    'staging_dir': 'get',
+    'yum_cache': 'get',
+    'ccache': 'get',
+    'tmpfs_build': 'get',
+    'cpus': 'get',
+    'memory': 'get'
 }
 
 SECTION_CONFIG_MAP = {
@@ -108,7 +122,51 @@ def get_parsed_config(args):
 
 
 
+def get_batch_config(path):
+    """
+    Configuration for one batch entry, which is either a .dockerrpm file or a
+    spec/srpm that may have a .dockerrpm next to it.
+    """
+    if path.endswith('.dockerrpm'):
+        return (_open_and_read_config(path), path)
+    return _read_config_if_exists(path)
+
+
+def get_global_config():
+    """
+    Docker section of the global configuration file, $DOCKER_RPMBUILD_CONFIG
+    or ~/.docker-rpmbuild, which provides defaults for every package.
+    """
+    path = os.environ.get(GLOBAL_CONFIG_ENVIRONMENT) or os.path.expanduser(GLOBAL_CONFIG)
+    if not os.path.isfile(path):
+        return defaultdict(None, {})
+
+    config = configparser.RawConfigParser()
+    with open(path) as config_filehandle:
+        config.readfp(config_filehandle)
+    return defaultdict(None, _read_section('docker', CONFIG_OPTIONS_DOCKER, config))
+
+
+def get_docker_configs(docopt_args, config):
+    """
+    One docker configuration per docker host to build on.  The hosts are the
+    --docker-host arguments, else --docker-base_url, else the hosts of the
+    config or of the global config, else the single get_docker_config.
+    """
+    docker_config = get_docker_config(docopt_args, config)
+    hosts = docopt_args.get('--docker-host')
+    if not hosts and not docopt_args.get('--docker-base_url'):
+        hosts = config.get('hosts') or get_global_config().get('hosts')
+    hosts = [host.strip() for host in hosts or () if host.strip()]
+    if not hosts:
+        return [docker_config]
+    return [defaultdict(None, dict(docker_config, base_url=host)) for host in hosts]
+
+
 def get_docker_config(docopt_args, config):
+    defaults = get_global_config()
+    defaults.update(config)
+    config = defaults
     args_overriden_docker_config = {
         'base_url': docopt_args['--docker-base_url'] or config.get('base_url'),
          'timeout': int(docopt_args['--docker-timeout'] or config.get('timeout') or DEFAULT_TIMEOUT),
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def named_lock(name):
+    """
+    The threading.Lock of name, shared by every thread of this process,
+    created on first use.  name is any hashable value.
+    """
+    with _locks_lock:
+        lock = _locks.get(name)
+        if lock is None:
+            lock = _locks[name] = threading.Lock()
+        return lock
+
+
+class FileLock(object):
+    """
+    An flock on path, so processes sharing a directory take turns.  Threads
+    of this process also share a named_lock of path first, as flock does
+    not exclude other descriptors of the same process reliably.  Without
+    fcntl only the named_lock is taken.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = named_lock(('file', path))
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        if not self.lock.acquire(blocking):
+            return False
+        if fcntl is None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking
+                        else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            self.lock.release()
+            if blocking:
+                raise
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            fd, self.fd = self.fd, None
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
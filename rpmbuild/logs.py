@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+import codecs
+import gzip
+import io
+import json
+import os
+import shutil
+import threading
+
+from collections import deque
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from rpmbuild import PackagerException, READ_BLOCKSIZE
+
+MAX_LINE_LENGTH = 1 << 20
+TAIL_LINES = 200
+LOG_FILE_ROTATE_BYTES = 64 << 20
+LOG_FILE_BACKUPS = 5
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+class LineBuffer(object):
+    """
+    Reassembles lines from byte chunks that are not line aligned, as docker
+    sends container logs.  At most max_length bytes are held: a longer line
+    is cut into pieces of that length.
+    """
+
+    def __init__(self, max_length=MAX_LINE_LENGTH):
+        self.max_length = max_length
+        self._pending = b''
+
+    def feed(self, chunk):
+        """The lines completed by chunk, without their newline."""
+        lines = []
+        for line in (self._pending + chunk).split(b'\n'):
+            while len(line) > self.max_length:
+                lines.append(line[:self.max_length])
+                line = line[self.max_length:]
+            lines.append(line)
+        self._pending = lines.pop()
+        return lines
+
+    def flush(self):
+        """The last line, if the stream did not end with a newline."""
+        pending, self._pending = self._pending, b''
+        return [pending] if pending else []
+
+
+def iter_lines(chunks, max_length=MAX_LINE_LENGTH):
+    """Lines, as bytes without newline, of a stream of byte chunks."""
+    buf = LineBuffer(max_length)
+    for chunk in chunks:
+        for line in buf.feed(chunk):
+            yield line
+    for line in buf.flush():
+        yield line
+
+
+def decode_line(line):
+    return line.decode('utf-8', 'replace').rstrip()
+
+
+def iter_json(chunks, max_length=MAX_LINE_LENGTH):
+    """
+    Objects of a docker build stream, however it was chunked: an object may
+    span chunks, and a chunk may hold several objects, with or without
+    newlines between them.  PackagerException is raised when max_length
+    characters do not make a complete object.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')('replace')
+    pending = ''
+    for chunk in chunks:
+        pending += text.decode(chunk)
+        while True:
+            pending = pending.lstrip()
+            if not pending:
+                break
+            try:
+                parsed, end = decoder.raw_decode(pending)
+            except ValueError:
+                if len(pending) > max_length:
+                    raise PackagerException(
+                        'Invalid docker build output: {0}'.format(pending[:80]))
+                break
+            pending = pending[end:]
+            yield parsed
+
+    pending = (pending + text.decode(b'', True)).strip()
+    if pending:
+        yield json.loads(pending)
+
+
+def _compress(path, compression):
+    """Compress path into path plus the suffix of compression, then remove it."""
+    target = path + COMPRESSION_SUFFIXES[compression]
+    with open(path, 'rb') as src:
+        if compression == 'zstd':
+            with open(target, 'wb') as f:
+                zstandard.ZstdCompressor().copy_stream(src, f)
+        else:
+            with gzip.open(target, 'wb') as f:
+                shutil.copyfileobj(src, f, READ_BLOCKSIZE)
+    os.remove(path)
+
+
+class LogFile(object):
+    """
+    Build log written to path, shared by every build of a batch.  When it
+    grows past max_bytes it is rotated to path.1 compressed with gzip or
+    zstd, shifting older logs up to path.<backups>.
+    """
+
+    def __init__(self, path, compression='gzip', max_bytes=LOG_FILE_ROTATE_BYTES,
+                 backups=LOG_FILE_BACKUPS):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise PackagerException('Unknown log compression: {0}'.format(compression))
+        if compression == 'zstd' and zstandard is None:
+            raise PackagerException('zstd log compression needs the zstandard module')
+        self.path = path
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        self._file = io.open(self.path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+
+    def _backup(self, n):
+        return '{0}.{1}{2}'.format(self.path, n,
+                                   COMPRESSION_SUFFIXES[self.compression])
+
+    def _rotate(self):
+        self._file.close()
+        if os.path.exists(self._backup(self.backups)):
+            os.remove(self._backup(self.backups))
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._backup(n)):
+                os.rename(self._backup(n), self._backup(n + 1))
+        os.rename(self.path, self.path + '.1')
+        _compress(self.path + '.1', self.compression)
+        self._open()
+
+    def write(self, line):
+        data = line + '\n'
+        with self._lock:
+            self._file.write(data)
+            self._size += len(data.encode('utf-8'))
+            if self.max_bytes and self._size >= self.max_bytes:
+                self._rotate()
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class BuildLog(object):
+    """
+    Logger of one build: lines go to logger, unless quiet, and to log_file.
+    Only the last tail lines are kept in memory, for the report of a failed
+    build.
+    """
+
+    def __init__(self, logger=None, log_file=None, quiet=False, prefix='',
+                 tail=TAIL_LINES):
+        self.logger = logger
+        self.log_file = log_file
+        self.quiet = quiet
+        self.prefix = prefix
+        self._tail = deque(maxlen=tail)
+
+    def __call__(self, message):
+        self._tail.append(message)
+        if self.log_file is not None:
+            self.log_file.write('{0}{1}'.format(self.prefix, message))
+        if not self.quiet and self.logger is not None:
+            self.logger('{0}{1}'.format(self.prefix, message)
+                        if self.prefix else message)
+
+    def tail(self):
+        return ['{0}'.format(message) for message in self._tail]
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
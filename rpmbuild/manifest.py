@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+MANIFEST_NAME = '.docker-rpmbuild.json'
+
+_lock = threading.Lock()
+
+
+def _has_binary_rpms(paths):
+    return any(p.endswith('.rpm') and not p.endswith('.src.rpm')
+               for p in paths)
+
+
+class Manifest(object):
+    """
+    Record, kept in an output directory, of the RPMs built there for each
+    context digest.  The digest covers the rendered Dockerfile, with the
+    defines and the base image ID, and the content of the spec, sources,
+    macrofiles and local repository, so an entry stands for the exact
+    inputs of a build.  Only the latest entry of each package is kept.
+    RPMs are listed relative to the output directory, so those written to
+    per-architecture subdirectories by --bind-output are found again.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.path = os.path.join(output, MANIFEST_NAME)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def lookup(self, digest):
+        """
+        Paths of the RPMs built from digest, or None if there is no such
+        build, it has no binary RPM, or any of its RPMs is gone from the
+        output directory.
+        """
+        entry = self.load().get(digest)
+        if entry is None or not _has_binary_rpms(entry['artifacts']):
+            return None
+        paths = [os.path.join(self.output, name) for name in entry['artifacts']]
+        if not all(os.path.isfile(path) for path in paths):
+            return None
+        return paths
+
+    def record(self, digest, name, paths):
+        """
+        Note that paths were built from digest for the package name.  A
+        build is only recorded if it produced binary RPMs, not only a SRPM.
+        """
+        if not _has_binary_rpms(paths):
+            return
+        with _lock:
+            entries = dict((d, e) for d, e in self.load().items()
+                           if e.get('name') != name)
+            entries[digest] = {
+                'name': name,
+                'artifacts': sorted(os.path.relpath(p, self.output)
+                                    for p in paths),
+                'built': time.time(),
+            }
+            fd, tmp = tempfile.mkstemp(dir=self.output, prefix=MANIFEST_NAME)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+            os.rename(tmp, self.path)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+import threading
+
+from contextlib import contextmanager
+
+import docker
+
+from rpmbuild import Packager, PackagerException, is_local_docker
+
+
+class ClientPool(object):
+    """
+    docker.Client instances shared by the Packagers of a batch, so their
+    connection pools are reused instead of set up for every package.  Clients
+    are kept per docker configuration, as returned by get_docker_config, and
+    at most max_clients of each are lent out at once; acquire blocks until
+    one is released.  A Packager keeps at most one request in flight on its
+    client, so max_clients also bounds the connections to each daemon.
+    """
+
+    def __init__(self, max_clients=None):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    @staticmethod
+    def _key(docker_config):
+        return tuple(sorted(dict(docker_config).items()))
+
+    def acquire(self, docker_config):
+        """Borrow a client for docker_config, creating one if none is idle."""
+        key = self._key(docker_config)
+
+        with self._lock:
+            if key not in self._slots:
+                self._idle[key] = []
+                self._slots[key] = (threading.BoundedSemaphore(self.max_clients)
+                                    if self.max_clients else None)
+            slots = self._slots[key]
+
+        if slots is not None:
+            slots.acquire()
+
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop()
+
+        try:
+            return docker.Client(**dict(docker_config))
+        except Exception:
+            if slots is not None:
+                slots.release()
+            raise
+
+    def release(self, docker_config, client):
+        """Return a client borrowed with acquire."""
+        key = self._key(docker_config)
+
+        with self._lock:
+            self._idle[key].append(client)
+            slots = self._slots[key]
+
+        if slots is not None:
+            slots.release()
+
+    @contextmanager
+    def client(self, docker_config):
+        client = self.acquire(docker_config)
+        try:
+            yield client
+        finally:
+            self.release(docker_config, client)
+
+    def close(self):
+        """Close the connections of every idle client."""
+        with self._lock:
+            for clients in self._idle.values():
+                while clients:
+                    clients.pop().close()
+
+
+class HostScheduler(object):
+    """
+    Places builds on one of several docker hosts: the least loaded one, where
+    the load of a host is the number of builds placed on it and running.
+    A host holding the package image of the build counts as two builds less
+    loaded, and one holding its toolchain image as one less, so builds go
+    where their images are cached unless that host is busier.  Hosts that
+    cannot be reached are skipped, and so are remote hosts for builds
+    mounting a yum or ccache cache of this host.  The RPMs are exported
+    through the docker API, or bind-mounted on a local host, so they are
+    collected on this host wherever the build ran.
+    """
+
+    def __init__(self, pool, log=None):
+        self.pool = pool
+        self.log = log
+        self._lock = threading.Lock()
+        self._load = {}
+
+    def load(self, docker_config):
+        with self._lock:
+            return self._load.get(ClientPool._key(docker_config), 0)
+
+    def _cache_level(self, context, docker_config):
+        """cache_level of the build on a host, or None if it is unreachable."""
+        try:
+            with self.pool.client(docker_config) as client:
+                probe = Packager(context, docker_config, pool=self.pool)
+                probe.client = client
+                return probe.cache_level()
+        except Exception as e:
+            if self.log is not None:
+                self.log('Skipping docker host %s: %s' % (
+                    docker_config.get('base_url'), e))
+            return None
+
+    @contextmanager
+    def place(self, context, docker_configs):
+        """Choose the docker configuration to build context with."""
+        if context.yum_cache or context.ccache:
+            docker_configs = [c for c in docker_configs if is_local_docker(c)]
+            if not docker_configs:
+                raise PackagerException(
+                    'yum_cache and ccache need a docker daemon on this host')
+        if len(docker_configs) == 1:
+            yield docker_configs[0]
+            return
+
+        levels = [(self._cache_level(context, c), c) for c in docker_configs]
+        levels = [(level, c) for level, c in levels if level is not None]
+        if not levels:
+            raise PackagerException('No docker host is reachable')
+
+        with self._lock:
+            level, docker_config = min(levels, key=lambda lc: (
+                self._load.get(ClientPool._key(lc[1]), 0) - lc[0], -lc[0]))
+            key = ClientPool._key(docker_config)
+            self._load[key] = self._load.get(key, 0) + 1
+
+        try:
+            yield docker_config
+        finally:
+            with self._lock:
+                self._load[key] -= 1
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import json
+import os
+import time
+
+from contextlib import contextmanager
+
+
+class BuildReport(object):
+    """
+    Timings and sizes of one package build, written as JSON by --report.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.phases = []
+        self.steps = []
+        self.image_cached = False
+        self.skipped = False
+        self.base_image_cached = None
+        self.context_size = None
+        self.artifacts = []
+        self.error = None
+        self.log_tail = None
+        self._step = None
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as the phase name."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    def record(self, name, duration):
+        self.phases.append({'name': name, 'duration': duration})
+
+    def build_output(self, stream):
+        """
+        Follow docker build output to time every Dockerfile step and note
+        which of them were served from the layer cache.
+        """
+        now = time.time()
+        if stream.startswith('Step '):
+            self.end_steps(now)
+            self._step = {'step': stream, 'start': now, 'cached': False}
+            self.steps.append(self._step)
+        elif self._step is not None and 'Using cache' in stream:
+            self._step['cached'] = True
+
+    def end_steps(self, now=None):
+        if self._step is not None:
+            self._step['duration'] = (now or time.time()) - self._step.pop('start')
+            self._step = None
+
+    def add_artifacts(self, paths):
+        self.artifacts.extend(paths)
+
+    def to_dict(self):
+        self.end_steps()
+        artifacts = [{'path': path, 'size': os.path.getsize(path)}
+                     for path in self.artifacts]
+        return {
+            'name': self.name,
+            'duration': time.time() - self.started,
+            'phases': self.phases,
+            'steps': self.steps,
+            'image_cached': self.image_cached,
+            'skipped': self.skipped,
+            'base_image_cached': self.base_image_cached,
+            'cached_steps': len([s for s in self.steps if s['cached']]),
+            'context_size': self.context_size,
+            'artifacts': artifacts,
+            'artifacts_size': sum(a['size'] for a in artifacts),
+            'error': self.error,
+            'log_tail': self.log_tail,
+        }
+
+
+def write_report(path, reports):
+    """Write one report, or a list of them for a batch, as JSON to path."""
+    if isinstance(reports, BuildReport):
+        data = reports.to_dict()
+    else:
+        data = {'packages': [r.to_dict() for r in reports]}
+
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+
+# Python 2/3 Compatibility
+try:
+    import Queue as queue
+    import SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError:
+    import queue
+    import socketserver
+    from http.server import BaseHTTPRequestHandler
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+
+from rpmbuild import PackagerException, READ_BLOCKSIZE
+from rpmbuild.logs import LogFile
+from rpmbuild.report import BuildReport
+
+JOB_ARGUMENTS = ('image', 'spec', 'srpm', 'sources', 'sources_dir', 'defines',
+                 'macrofiles', 'retrieve', 'stream', 'yum_cache', 'ccache',
+                 'tmpfs_build', 'cpus', 'memory', 'bind_output')
+FINISHED_JOBS_KEPT = 1000
+JOB_LOG = 'build.log'
+JOB_PATH_ARGUMENTS = ('spec', 'srpm', 'sources', 'sources_dir', 'macrofiles',
+                      'yum_cache', 'ccache')
+LOOPBACK_HOSTS = re.compile(r'^(localhost|127(\.\d{1,3}){3})$')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class Job(object):
+    """
+    A build submitted to the service.  arguments are the PackagerContext
+    arguments, plus bind_output.  Log lines are written to the JOB_LOG file
+    of the output directory of the job, so any number of clients can follow
+    them, from the start, while the job runs.
+    """
+
+    def __init__(self, arguments, output):
+        self.id = uuid.uuid4().hex[:12]
+        self.arguments = arguments
+        self.output = os.path.join(output, self.id)
+        self.log_path = os.path.join(self.output, JOB_LOG)
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.exported = []
+        self.error = None
+        self.report = BuildReport(self.id)
+        self._log_file = None
+        self._log_size = 0
+        self._changed = threading.Condition()
+
+        os.makedirs(self.output)
+        io.open(self.log_path, 'a').close()
+
+    @property
+    def finished(self):
+        return self.state in (SUCCEEDED, FAILED)
+
+    def log(self, message):
+        message = '{0}'.format(message)
+        with self._changed:
+            if self._log_file is None:
+                self._log_file = LogFile(self.log_path, max_bytes=0)
+            self._log_file.write(message)
+            self._log_file.flush()
+            self._log_size += len((message + '\n').encode('utf-8'))
+            self._changed.notify_all()
+
+    def _finish(self, state, exported=None, error=None):
+        with self._changed:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+            self.state = state
+            self.exported = exported or []
+            self.error = error
+            self.report.error = error
+            self._changed.notify_all()
+
+    def follow(self):
+        """
+        Yield the lines of the job log, waiting for new ones until the job
+        finished.
+        """
+        with io.open(self.log_path, 'rb') as f:
+            read = 0
+            pending = b''
+            while True:
+                with self._changed:
+                    while read == self._log_size and not self.finished:
+                        self._changed.wait()
+                    size = self._log_size
+                    finished = self.finished
+                data = f.read(size - read)
+                read += len(data)
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line.decode('utf-8', 'replace')
+                if finished and read == size:
+                    return
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'arguments': self.arguments,
+            'submitted': self.submitted,
+            'artifacts': [os.path.basename(path) for path in self.exported],
+            'error': self.error,
+            'report': self.report.to_dict() if self.finished else None,
+        }
+
+
+class JobQueue(object):
+    """
+    Jobs run by a fixed number of worker threads, in submission order.
+    build(job) builds a job, returning the exported files; any exception it
+    raises fails that job only.  Only the last FINISHED_JOBS_KEPT finished
+    jobs are remembered.  The paths in job arguments are taken relative to
+    root, and must be below it.
+    """
+
+    def __init__(self, build, workers, output, keep=FINISHED_JOBS_KEPT,
+                 root=None):
+        self.build = build
+        self.output = output
+        self.keep = keep
+        self.root = os.path.realpath(root or os.getcwd())
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._workers = [threading.Thread(target=self._work)
+                         for _ in range(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def submit(self, arguments):
+        """Queue a job, raising PackagerException for invalid arguments."""
+        unknown = sorted(set(arguments) - set(JOB_ARGUMENTS))
+        if unknown:
+            raise PackagerException('Unknown job arguments: {0}'.format(
+                ', '.join(unknown)))
+        if not arguments.get('image'):
+            raise PackagerException('Must provide base docker image')
+        if not arguments.get('spec') and not arguments.get('srpm'):
+            raise PackagerException('Must provide spec or srpm')
+
+        arguments = dict(arguments)
+        for name in JOB_PATH_ARGUMENTS:
+            value = arguments.get(name)
+            if isinstance(value, list):
+                arguments[name] = [self._path(name, v) for v in value]
+            elif value:
+                arguments[name] = self._path(name, value)
+
+        job = Job(arguments, self.output)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._queue.put(job)
+        return job
+
+    def _path(self, name, value):
+        """value of the path argument name, resolved below root."""
+        if not isinstance(value, string_types):
+            raise PackagerException('{0} must be a path'.format(name))
+        path = os.path.realpath(os.path.join(self.root, value))
+        if path != self.root and not path.startswith(
+                self.root.rstrip(os.sep) + os.sep):
+            raise PackagerException('{0} is outside of {1}: {2}'.format(
+                name, self.root, value))
+        return path
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _forget_finished(self):
+        with self._lock:
+            finished = [j for j in self._jobs.values() if j.finished]
+            for job in finished[:max(0, len(finished) - self.keep)]:
+                del self._jobs[job.id]
+                if os.path.isdir(job.output):
+                    shutil.rmtree(job.output)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            job.state = RUNNING
+            try:
+                job._finish(SUCCEEDED, exported=self.build(job))
+            except Exception as e:
+                job.log(str(e) or e.__class__.__name__)
+                job._finish(FAILED, error=str(e) or e.__class__.__name__)
+            self._forget_finished()
+
+    def close(self):
+        """Stop the workers once the jobs queued so far are done."""
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    routes = [
+        ('POST', re.compile(r'^/jobs$'), 'submit'),
+        ('GET', re.compile(r'^/jobs$'), 'list_jobs'),
+        ('GET', re.compile(r'^/jobs/(\w+)$'), 'get_job'),
+        ('GET', re.compile(r'^/jobs/(\w+)/logs$'), 'logs'),
+        ('GET', re.compile(r'^/jobs/(\w+)/artifacts/([^/]+)$'), 'artifact'),
+    ]
+
+    def log_message(self, format, *args):
+        self.server.log(format % args)
+
+    def _dispatch(self, method):
+        path = self.path.split('?', 1)[0]
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                return getattr(self, name)(*match.groups())
+        self.reply(404, {'error': 'Not found'})
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def reply(self, status, body):
+        data = json.dumps(body, indent=2, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job(self, job_id):
+        job = self.server.jobs.get(job_id)
+        if job is None:
+            self.reply(404, {'error': 'No such job: %s' % job_id})
+        return job
+
+    def submit(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            arguments = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(arguments, dict):
+                raise ValueError('A job is a JSON object')
+            job = self.server.jobs.submit(arguments)
+        except (ValueError, PackagerException) as e:
+            return self.reply(400, {'error': str(e)})
+        self.reply(201, job.to_dict())
+
+    def list_jobs(self):
+        self.reply(200, [job.to_dict() for job in self.server.jobs.jobs()])
+
+    def get_job(self, job_id):
+        job = self._job(job_id)
+        if job is not None:
+            self.reply(200, job.to_dict())
+
+    def logs(self, job_id):
+        """Stream the log of a job until it finishes, then close."""
+        job = self._job(job_id)
+        if job is None:
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        for line in job.follow():
+            self.wfile.write((line + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+    def artifact(self, job_id, name):
+        job = self._job(job_id)
+        if job is None:
+            return
+        paths = [p for p in job.exported if os.path.basename(p) == name]
+        if not paths:
+            return self.reply(404, {'error': 'No such artifact: %s' % name})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-rpm')
+        self.send_header('Content-Length', str(os.path.getsize(paths[0])))
+        self.end_headers()
+        with open(paths[0], 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, READ_BLOCKSIZE)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_listen(address):
+    """
+    The (host, port) of a host:port the service listens on, raising
+    PackagerException unless host is a loopback address: the API has no
+    authentication, and builds whatever host paths its jobs name.
+    """
+    host, _, port = address.rpartition(':')
+    if not LOOPBACK_HOSTS.match(host):
+        raise PackagerException(
+            'The build service only listens on loopback addresses, not {0}; '
+            'use --socket to share it'.format(host or address))
+    try:
+        return host, int(port)
+    except ValueError:
+        raise PackagerException('Invalid port: {0}'.format(port))
+
+
+def make_server(address, jobs, log):
+    """
+    HTTP API server for jobs on a unix socket path, or on a (host, port)
+    pair.  A stale socket file from an earlier run is replaced.
+    """
+    if isinstance(address, tuple):
+        server = _TCPServer(address, _Handler)
+    else:
+        if os.path.exists(address):
+            os.unlink(address)
+        server = _UnixServer(address, _Handler)
+    server.jobs = jobs
+    server.log = log
+    return server
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
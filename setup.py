@@ -1,6 +1,20 @@
 #!/usr/bin/env python
 
+import sys
+
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class BuildPy(build_py):
+    """Leave out aio.py where its syntax cannot be byte-compiled."""
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info < (3, 6):
+            modules = [m for m in modules if m[:2] != ('rpmbuild', 'aio')]
+        return modules
+
 
 setup(
     name='docker-rpmbuild',
@@ -22,6 +36,7 @@ setup(
         'console_scripts': ['docker-rpmbuild=rpmbuild.build:main']
     },
     packages=['rpmbuild'],
+    cmdclass={'build_py': BuildPy},
 )
 
 # vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
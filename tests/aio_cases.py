@@ -0,0 +1,114 @@
+"""
+Tests for aio.py, which needs Python 3.6.  They use its syntax, so they
+are kept out of the modules collected on older versions; aio_test.py
+imports them where they can run.
+"""
+import asyncio
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from mock import patch
+
+import rpmbuild
+from benchmarks.daemon import FakeDaemon, Recording
+from rpmbuild import PackagerContext, PackagerException, RPM_DIRECTORIES
+from rpmbuild import aio
+
+
+class AsyncPackagerTestCase(unittest.TestCase):
+    """Tests for aio.py, against the fake daemon of the benchmarks"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.output = os.path.join(self.path, 'output')
+        os.mkdir(self.output)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.archives = {}
+        rpm = os.path.join(self.path, 'foo.rpm')
+        with open(rpm, 'wb') as f:
+            f.write(b'\xed\xab\xee\xdb' * 50000)
+        for directory in RPM_DIRECTORIES:
+            name = os.path.basename(directory)
+            self.archives[directory] = os.path.join(self.path, name + '.tar')
+            with tarfile.open(self.archives[directory], 'w') as archive:
+                archive.add(rpm, '%s/foo-1.0-1.%s.rpm' % (
+                    name, 'src' if name == 'SRPMS' else 'x86_64'))
+
+    def context(self, name, **kwargs):
+        spec = os.path.join(self.path, name)
+        with open(spec, 'w') as f:
+            f.write('Name: %s\n' % name)
+        return PackagerContext('centos:7', spec=spec, **kwargs)
+
+    def run_packagers(self, daemon, contexts):
+        lines = []
+
+        async def build(context):
+            async with aio.AsyncPackager(context, {'base_url': daemon.base_url}) as p:
+                return await aio.run_packager(p, self.output, logger=lines.append)
+
+        async def build_all():
+            return await asyncio.gather(*[build(c) for c in contexts])
+
+        return self.loop.run_until_complete(build_all()), lines
+
+    def test_run_packager_builds_and_exports_concurrently(self):
+        recording = Recording(
+            build=[b'{"stream": "Step 0 : FROM centos:7\\n"}\r\n',
+                   b'{"stream": "Successfully built 0123456789ab\\n"}\r\n'],
+            logs=[b'+ make\n', b'Wrote: foo.rpm\n'],
+            copy=self.archives)
+
+        with FakeDaemon(recording, images=['centos:7']) as daemon:
+            contexts = [self.context('foo.spec'), self.context('bar.spec', stream=True)]
+            results, lines = self.run_packagers(daemon, contexts)
+
+        self.assertEqual(results, [
+            [os.path.join(self.output, 'foo-1.0-1.x86_64.rpm'),
+             os.path.join(self.output, 'foo-1.0-1.src.rpm')]] * 2)
+        self.assertEqual(os.path.getsize(results[0][0]), 200000)
+        self.assertEqual(lines.count('Wrote: foo.rpm'), 2)
+        # One toolchain image build, shared by both packages.
+        self.assertEqual(len(daemon.uploaded), 3)
+        self.assertEqual(lines.count('Step 0 : FROM centos:7'), len(daemon.uploaded))
+        self.assertTrue(all(size > 0 for size in daemon.uploaded))
+
+    def test_sources_are_hashed_off_the_event_loop(self):
+        threads = []
+        update_digest = rpmbuild.update_digest
+
+        def record_thread(*args):
+            threads.append(threading.current_thread())
+            update_digest(*args)
+
+        recording = Recording(copy=self.archives)
+        with FakeDaemon(recording, images=['centos:7']) as daemon:
+            with patch('rpmbuild.update_digest', side_effect=record_thread):
+                self.run_packagers(daemon, [self.context('foo.spec')])
+
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_build_errors_raise_packager_exception(self):
+        recording = Recording(build=[b'{"error": "broken", "errorDetail": {}}\r\n'])
+
+        with FakeDaemon(recording, images=['centos:7']) as daemon:
+            with self.assertRaises(PackagerException):
+                self.run_packagers(daemon, [self.context('foo.spec')])
+
+    def test_missing_base_image_raises_packager_exception(self):
+        with FakeDaemon(Recording()) as daemon:
+            daemon.tag = lambda name: None
+            with self.assertRaises(PackagerException):
+                self.run_packagers(daemon, [self.context('foo.spec')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,7 @@
+import sys
+
+# aio.py and its tests use syntax older versions cannot even compile.
+if sys.version_info >= (3, 6):
+    from aio_cases import AsyncPackagerTestCase  # noqa: F401
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,145 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+if sys.version_info >= (3,):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from rpmbuild import PackagerException
+from rpmbuild.batch import build_graph, find_specs, parse_spec, run_batch
+
+
+class BatchTestCase(unittest.TestCase):
+    """Tests for batch.py"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def touch(self, *names):
+        for name in names:
+            path = os.path.join(self.path, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+
+    def test_find_specs_walks_directories(self):
+        self.touch('a/foo.spec', 'a/foo.dockerrpm', 'a/README',
+                   'b/bar.dockerrpm', 'b/baz.src.rpm')
+        self.assertEqual(find_specs([self.path]), [
+            os.path.join(self.path, 'a', 'foo.spec'),
+            os.path.join(self.path, 'b', 'bar.dockerrpm'),
+            os.path.join(self.path, 'b', 'baz.src.rpm'),
+        ])
+
+    def test_find_specs_keeps_files_as_given(self):
+        self.touch('foo.spec')
+        self.assertEqual(find_specs(['foo.dockerrpm', os.path.join(self.path, 'foo.spec')]),
+                         ['foo.dockerrpm', os.path.join(self.path, 'foo.spec')])
+
+    def test_run_batch_collects_results_and_failures(self):
+        def build(path, repo):
+            if path == 'bad.spec':
+                raise PackagerException('broken')
+            return ['%s.rpm' % path]
+
+        done = []
+        results = run_batch(['foo.spec', 'bad.spec'], build, 2, done.append)
+
+        self.assertEqual([r.path for r in results], ['foo.spec', 'bad.spec'])
+        self.assertEqual(results[0].exported, ['foo.spec.rpm'])
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[1].exported, [])
+        self.assertEqual(results[1].error, 'broken')
+        self.assertEqual(len(done), 2)
+
+    def test_run_batch_runs_builds_concurrently(self):
+        barrier = threading.Event()
+        started = []
+
+        def build(path, repo):
+            started.append(path)
+            if len(started) == 2:
+                barrier.set()
+            if not barrier.wait(5):
+                raise PackagerException('builds ran serially')
+            return []
+
+        results = run_batch(['foo.spec', 'bar.spec'], build, 2)
+        self.assertEqual([r.error for r in results], [None, None])
+
+    def write_spec(self, name, content):
+        path = os.path.join(self.path, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_parse_spec(self):
+        spec = self.write_spec('foo.spec', """
+%global libname libfoo
+Name:           foo
+Version:        1.0
+Provides:       foo-api = %{version}, %{libname}
+BuildRequires:  gcc, bar-devel >= 1.2
+BuildRequires:  pkgconfig(baz)
+
+%package devel
+Summary: devel
+Requires: %{name} = %{version}
+
+%package -n python-foo
+Summary: python
+""")
+        provides, requires = parse_spec(spec)
+        self.assertEqual(provides, set(['foo', 'foo-api', 'libfoo', 'foo-devel', 'python-foo']))
+        self.assertEqual(requires, set(['gcc', 'bar-devel', 'pkgconfig(baz)']))
+
+    def test_build_graph_links_build_requires_to_providers(self):
+        bar = self.write_spec('bar.spec', 'Name: bar\n%package devel\n')
+        foo = self.write_spec('foo.spec', 'Name: foo\nBuildRequires: bar-devel, gcc\n')
+        graph = build_graph({foo: foo, bar: bar, 'baz.src.rpm': None})
+        self.assertEqual(graph, {foo: set([bar]), bar: set(), 'baz.src.rpm': set()})
+
+    def test_build_graph_rejects_cycles(self):
+        foo = self.write_spec('foo.spec', 'Name: foo\nBuildRequires: bar\n')
+        bar = self.write_spec('bar.spec', 'Name: bar\nBuildRequires: foo\n')
+        with self.assertRaises(PackagerException):
+            build_graph({foo: foo, bar: bar})
+
+    def test_run_batch_orders_dependencies_and_passes_their_rpms(self):
+        graph = {'app.spec': set(['lib.spec']), 'lib.spec': set(['base.spec']),
+                 'base.spec': set()}
+        order = []
+
+        def build(path, repo):
+            order.append((path, sorted(repo)))
+            name = path[:-len('.spec')]
+            return ['/out/%s.rpm' % name, '/out/%s.src.rpm' % name]
+
+        results = run_batch(['app.spec', 'lib.spec', 'base.spec'], build, 4, graph=graph)
+
+        self.assertEqual(order, [
+            ('base.spec', []),
+            ('lib.spec', ['/out/base.rpm']),
+            ('app.spec', ['/out/base.rpm', '/out/lib.rpm']),
+        ])
+        self.assertEqual([r.error for r in results], [None, None, None])
+
+    def test_run_batch_skips_dependents_of_failed_builds(self):
+        graph = {'app.spec': set(['lib.spec']), 'lib.spec': set(), 'other.spec': set()}
+        built = []
+
+        def build(path, repo):
+            built.append(path)
+            if path == 'lib.spec':
+                raise PackagerException('broken')
+            return []
+
+        results = run_batch(['app.spec', 'lib.spec', 'other.spec'], build, 2, graph=graph)
+
+        self.assertEqual(sorted(built), ['lib.spec', 'other.spec'])
+        self.assertEqual(results[0].error, 'Dependency failed: lib.spec')
+        self.assertIsNone(results[2].error)
@@ -8,7 +8,12 @@ except ImportError:
     from configparser import ConfigParser
     from io import StringIO
 
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 if sys.version_info >= (3,):
     from unittest import TestCase
 else:
@@ -18,7 +23,10 @@ from docker import Client
 from docopt import DocoptExit
 
 from mock import call, MagicMock, patch
-from rpmbuild import build, PackagerException
+from rpmbuild import build, PackagerContext, PackagerException
+from rpmbuild.logs import BuildLog
+from rpmbuild.pool import ClientPool, HostScheduler
+from rpmbuild.report import BuildReport
 
 
 class BuildTest(TestCase):
@@ -48,6 +56,8 @@ class BuildTest(TestCase):
         ]):
 
             packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = False
             packager_mock_enter.build_image.side_effect = PackagerException('foo')
             packager_mock.return_value.__enter__.return_value = packager_mock_enter
             config_mock.return_value = defaultdict(None, {}), None
@@ -73,11 +83,13 @@ class BuildTest(TestCase):
                                 'docker_image'
         ]):
             packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = False
             packager_mock_enter.build_image.return_value = [
                 b'{"stream": "Step 1..."}',
                 b'{"error":"Error...", "errorDetail":{"code": 123, "message": "Error..."}}',
             ]
-            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), [MagicMock()]]
+            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), [b'Wrote: foo.rpm\n']]
             packager_mock.return_value.__enter__.return_value = packager_mock_enter
             config_mock.return_value = defaultdict(None, {}), None
 
@@ -99,12 +111,14 @@ class BuildTest(TestCase):
                                 'docker_image'
         ]):
             packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = False
             packager_mock_enter.build_image.return_value = [
                 b'{"stream": "Step 1..."}',
                 b'{"stream": "..."}'
             ]
             packager_mock_enter.export_package.return_value = ['/tmp/a_build.rpm']
-            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), [MagicMock()]]
+            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), [b'Wrote: foo.rpm\n']]
             packager_mock.return_value.__enter__.return_value = packager_mock_enter
             config_mock.return_value = defaultdict(None, {}), None
 
@@ -114,8 +128,10 @@ class BuildTest(TestCase):
 
             calls_on_packager = [
                 call.build_image(),
-                call.build_package(),
+                call.build_package(output=None),
+                call.wait_package(),
                 call.export_package('/tmp/'),
+                call.remove_package(),
             ]
             packager_mock_enter.assert_has_calls(calls_on_packager)
 
@@ -131,12 +147,14 @@ class BuildTest(TestCase):
                                 'docker_image'
         ]):
             packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = False
             packager_mock_enter.build_image.return_value = [
                 b'{"stream": "Step 1..."}',
                 b'{"stream": "..."}'
             ]
             packager_mock_enter.export_package.return_value = ['/rpmbuild/a_build.rpm']
-            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), [MagicMock()]]
+            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), [b'Wrote: foo.rpm\n']]
             packager_mock.return_value.__enter__.return_value = packager_mock_enter
             config_mock.return_value = defaultdict(None, {}), None
 
@@ -146,11 +164,425 @@ class BuildTest(TestCase):
 
             calls_on_packager = [
                 call.build_image(),
-                call.build_package(),
+                call.build_package(output=None),
+                call.wait_package(),
                 call.export_package('.'),
+                call.remove_package(),
             ]
             packager_mock_enter.assert_has_calls(calls_on_packager)
 
+    @patch('rpmbuild.build.PackagerContext')
+    @patch('rpmbuild.build.Packager')
+    @patch('rpmbuild.build.get_parsed_config')
+    @patch('rpmbuild.build.log')
+    def test_build_skips_build_image_when_image_exists(self, print_mock, config_mock, packager_mock, context_mock):
+        with patch('sys.argv', ['docker-rpmbuild',
+                                'build',
+                                '--source', 'foo.tar',
+                                '--spec', 'bar.spec',
+                                'docker_image'
+        ]):
+            packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = True
+            packager_mock_enter.image_name = 'rpmbuild_bar.spec:0123456789ab'
+            packager_mock_enter.export_package.return_value = []
+            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), []]
+            packager_mock.return_value.__enter__.return_value = packager_mock_enter
+            config_mock.return_value = defaultdict(None, {}), None
+
+            build.main()
+
+            self.assertFalse(packager_mock_enter.build_image.called)
+            packager_mock_enter.build_package.assert_called_with(output=None)
+            print_mock.assert_any_call('Using cached image rpmbuild_bar.spec:0123456789ab')
+
+    @patch('rpmbuild.build.PackagerContext')
+    @patch('rpmbuild.build.Packager')
+    @patch('rpmbuild.build.get_parsed_config')
+    @patch('rpmbuild.build.log')
+    def test_build_builds_base_image_when_missing(self, print_mock, config_mock, packager_mock, context_mock):
+        with patch('sys.argv', ['docker-rpmbuild',
+                                'build',
+                                '--source', 'foo.tar',
+                                '--spec', 'bar.spec',
+                                'docker_image'
+        ]):
+            packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = False
+            packager_mock_enter.base_image_exists.return_value = False
+            packager_mock_enter.build_base_image.return_value = [b'{"stream": "Step 1..."}']
+            packager_mock_enter.build_image.return_value = [b'{"stream": "Step 1..."}']
+            packager_mock_enter.export_package.return_value = []
+            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), []]
+            packager_mock.return_value.__enter__.return_value = packager_mock_enter
+            config_mock.return_value = defaultdict(None, {}), None
+
+            build.main()
+
+            names = [c[0] for c in packager_mock_enter.mock_calls]
+            self.assertLess(names.index('build_base_image'),
+                            names.index('build_image'))
+            packager_mock_enter.base_image_lock.return_value.release.assert_called_once_with()
+
+    @patch('rpmbuild.build.PackagerContext')
+    @patch('rpmbuild.build.Packager')
+    @patch('rpmbuild.build.get_parsed_config')
+    @patch('rpmbuild.build.log')
+    def test_build_with_bind_output_passes_output_to_build_package(self, print_mock, config_mock, packager_mock, context_mock):
+        with patch('sys.argv', ['docker-rpmbuild',
+                                'build',
+                                '--source', 'foo.tar',
+                                '--spec', 'bar.spec',
+                                '--bind-output',
+                                '--output', '/tmp/',
+                                'docker_image'
+        ]):
+            packager_mock_enter = MagicMock()
+            packager_mock_enter.context.yum_cache = None
+            packager_mock_enter.image_exists.return_value = True
+            packager_mock_enter.export_package.return_value = []
+            packager_mock_enter.build_package.return_value = [MagicMock(spec=Client), []]
+            packager_mock.return_value.__enter__.return_value = packager_mock_enter
+            config_mock.return_value = defaultdict(None, {}), None
+
+            build.main()
+
+            packager_mock_enter.build_package.assert_called_with(output='/tmp/')
+            packager_mock_enter.export_package.assert_called_with('/tmp/')
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_exports_through_the_api_from_remote_hosts(self, print_mock):
+        packager = MagicMock()
+        packager.local = False
+        packager.image_exists.return_value = True
+        packager.build_package.return_value = [MagicMock(), []]
+
+        build.run_packager(packager, '/tmp', bind_output=True)
+
+        packager.build_package.assert_called_with(output=None)
+        packager.export_package.assert_called_with('/tmp')
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_fails_when_rpmbuild_fails(self, print_mock):
+        packager = MagicMock()
+        packager.image_exists.return_value = True
+        packager.build_package.return_value = [MagicMock(), [b'error: Installed (but unpackaged) file(s) found']]
+        packager.wait_package.side_effect = PackagerException('rpmbuild exited with status 1')
+
+        with self.assertRaises(PackagerException):
+            build.run_packager(packager, '/tmp')
+
+        self.assertFalse(packager.export_package.called)
+        packager.remove_package.assert_called_once_with()
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_installs_build_deps_with_yum_cache(self, print_mock):
+        packager = MagicMock()
+        packager.context.yum_cache = '/var/cache/rpmbuild'
+        packager.image_exists.return_value = False
+        packager.base_image_exists.return_value = True
+        packager.deps_image_exists.return_value = False
+        packager.build_deps_image.return_value = [b'{"stream": "Step 1..."}']
+        packager.build_image.return_value = [b'{"stream": "Step 1..."}']
+        packager.install_build_deps.return_value = [MagicMock(), [b'Installing gcc']]
+        packager.build_package.return_value = [MagicMock(), []]
+        packager.export_package.return_value = ['/tmp/foo.rpm']
+
+        self.assertEqual(build.run_packager(packager, '/tmp'), ['/tmp/foo.rpm'])
+
+        names = [c[0] for c in packager.mock_calls]
+        order = ['build_deps_image', 'yum_cache_lock().acquire',
+                 'install_build_deps', 'commit_build_deps',
+                 'yum_cache_lock().release', 'stage', 'build_image',
+                 'build_package']
+        indices = [names.index(n) for n in order]
+        self.assertEqual(indices, sorted(indices))
+        print_mock.assert_any_call('Installing gcc')
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_reuses_deps_image_when_sources_change(self, print_mock):
+        packager = MagicMock()
+        packager.context.yum_cache = '/var/cache/rpmbuild'
+        packager.image_exists.return_value = False
+        packager.base_image_exists.return_value = True
+        packager.deps_image_exists.return_value = True
+        packager.build_image.return_value = []
+        packager.build_package.return_value = [MagicMock(), []]
+        packager.export_package.return_value = ['/tmp/foo.rpm']
+
+        build.run_packager(packager, '/tmp')
+
+        self.assertFalse(packager.build_deps_image.called)
+        self.assertFalse(packager.install_build_deps.called)
+        packager.build_image.assert_called_once_with()
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_builds_toolchain_image_once(self, print_mock):
+        built = []
+        lock = threading.Lock()
+
+        def build_base_image():
+            time.sleep(0.1)
+            built.append(True)
+            return [b'{"stream": "Step 0 : FROM centos:7"}']
+
+        def run():
+            packager = MagicMock()
+            packager.context.yum_cache = None
+            packager.image_exists.return_value = False
+            packager.base_image_exists.side_effect = lambda: bool(built)
+            packager.base_image_lock.return_value = lock
+            packager.build_base_image.side_effect = build_base_image
+            packager.build_image.return_value = []
+            packager.build_package.return_value = [MagicMock(), []]
+            packager.export_package.return_value = []
+            build.run_packager(packager, '/tmp')
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(built, [True])
+        self.assertFalse(lock.locked())
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_logs_whole_lines_of_container_output(self, print_mock):
+        packager = MagicMock()
+        packager.context.yum_cache = None
+        packager.image_exists.return_value = True
+        packager.build_package.return_value = [
+            MagicMock(), [b'gcc -c fo', b'o.c\ngcc -c', b' bar.c\n']]
+        packager.export_package.return_value = []
+
+        build.run_packager(packager, '/tmp')
+
+        print_mock.assert_any_call('gcc -c foo.c')
+        print_mock.assert_any_call('gcc -c bar.c')
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_skips_unchanged_build(self, print_mock):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        rpm = os.path.join(output, 'foo-1.0-1.x86_64.rpm')
+        packager = MagicMock()
+        packager.context.yum_cache = None
+        packager.context.digest = 'abc'
+        packager.context.__str__.return_value = 'foo.spec'
+        packager.image_exists.return_value = False
+        packager.base_image_exists.return_value = True
+        packager.build_image.return_value = []
+        packager.build_package.return_value = [MagicMock(), []]
+
+        def export_package(output):
+            open(rpm, 'w').close()
+            return [rpm]
+
+        packager.export_package.side_effect = export_package
+
+        self.assertEqual(build.run_packager(packager, output, skip_unchanged=True), [rpm])
+        report = BuildReport('foo.spec')
+        self.assertEqual(build.run_packager(packager, output, report=report,
+                                            skip_unchanged=True), [rpm])
+        self.assertEqual(packager.build_package.call_count, 1)
+        # The context is only staged for builds that are not skipped.
+        self.assertEqual(packager.stage.call_count, 1)
+        self.assertTrue(report.skipped)
+
+        packager.context.digest = 'def'
+        build.run_packager(packager, output, skip_unchanged=True)
+        self.assertEqual(packager.build_package.call_count, 2)
+
+    @patch('rpmbuild.build.log')
+    def test_run_scheduled_keeps_log_tail_of_failed_build(self, print_mock):
+        packager = MagicMock()
+        packager.context.yum_cache = None
+        packager.image_exists.return_value = True
+        packager.build_package.return_value = [
+            MagicMock(), [b'line 1\nline 2\nerror: broken\n']]
+        packager.export_package.side_effect = PackagerException('No RPMs')
+        report = BuildReport('foo.spec')
+        build_log = BuildLog(build.log, quiet=True, tail=2)
+
+        with patch('rpmbuild.build.Packager') as packager_mock:
+            packager_mock.return_value.__enter__.return_value = packager
+            with self.assertRaises(PackagerException):
+                build.run_scheduled(HostScheduler(ClientPool()), MagicMock(),
+                                    [{}], '/tmp', logger=build_log,
+                                    report=report)
+
+        self.assertEqual(report.error, 'No RPMs')
+        self.assertEqual(report.log_tail, ['line 2', 'error: broken'])
+        self.assertEqual(print_mock.call_args_list, [
+            call('line 2', file=sys.stderr),
+            call('error: broken', file=sys.stderr)])
+
+    @patch('rpmbuild.build.log')
+    def test_run_packager_times_phases_on_report(self, print_mock):
+        packager = MagicMock()
+        packager.context.yum_cache = None
+        packager.context.size = 2048
+        packager.image_exists.return_value = False
+        packager.base_image_exists.return_value = True
+        packager.build_image.return_value = [
+            b'{"stream": "Step 0 : FROM rpmbuild_base:abc\\n"}',
+            b'{"stream": " ---> Using cache\\n"}',
+        ]
+        packager.build_package.return_value = [MagicMock(), []]
+        packager.export_package.return_value = []
+        report = BuildReport('foo.spec')
+
+        build.run_packager(packager, '/tmp', report=report)
+
+        self.assertEqual([p['name'] for p in report.phases],
+                         ['context_setup', 'context_upload', 'image_build',
+                          'container_start', 'rpmbuild', 'export'])
+        self.assertEqual(report.context_size, 2048)
+        self.assertFalse(report.image_cached)
+        self.assertTrue(report.base_image_cached)
+        self.assertEqual(report.to_dict()['cached_steps'], 1)
+
+    @patch('rpmbuild.build.Packager')
+    @patch('rpmbuild.build.build_graph', return_value={})
+    @patch('rpmbuild.build.get_batch_config')
+    @patch('rpmbuild.build.log')
+    @patch('sys.exit')
+    def test_batch_builds_every_spec_and_exits_1_on_failure(
+            self, sys_exit_mock, print_mock, config_mock, graph_mock, packager_mock):
+        with patch('sys.argv', ['docker-rpmbuild',
+                                'batch',
+                                '--workers', '2',
+                                '--image', 'centos:7',
+                                '--output', '/tmp/',
+                                'foo.spec', 'bar.spec', 'baz.src.rpm'
+        ]):
+            config_mock.return_value = defaultdict(None, {}), None
+            packagers = {}
+            pools = set()
+
+            def packager(context, docker_config, pool=None):
+                pools.add(pool)
+                name = str(context)
+                p = MagicMock()
+                p.image_exists.return_value = True
+                p.build_package.return_value = [MagicMock(spec=Client), []]
+                p.export_package.return_value = ['/tmp/%s.rpm' % name]
+                if name == 'bar.spec':
+                    p.build_package.side_effect = PackagerException('broken')
+                packagers[name] = p
+                packager_mock = MagicMock()
+                packager_mock.__enter__.return_value = p
+                return packager_mock
+
+            packager_mock.side_effect = packager
+
+            build.main()
+
+        self.assertEqual(sorted(packagers), ['bar.spec', 'baz.src.rpm', 'foo.spec'])
+        self.assertEqual(len(pools), 1)
+        self.assertIsInstance(pools.pop(), ClientPool)
+        packagers['foo.spec'].export_package.assert_called_with('/tmp/')
+        self.assertFalse(packagers['bar.spec'].export_package.called)
+        self.assertTrue(any(c[0][0].startswith('2 package(s) built, 1 failed in ')
+                            for c in print_mock.call_args_list))
+        print_mock.assert_any_call('Failed: bar.spec', file=sys.stderr)
+        sys_exit_mock.assert_called_once_with(1)
+
+    @patch('rpmbuild.build.PackagerContext')
+    @patch('rpmbuild.build.Packager')
+    @patch('rpmbuild.build.get_parsed_config')
+    @patch('rpmbuild.build.log')
+    @patch('sys.exit')
+    def test_build_with_several_images_builds_each_into_own_output(
+            self, sys_exit_mock, print_mock, config_mock, packager_mock,
+            context_mock):
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        with patch('sys.argv', ['docker-rpmbuild',
+                                'build',
+                                '--source', 'foo.tar',
+                                '--spec', 'bar.spec',
+                                '--output', output,
+                                'centos:6', 'centos:7'
+        ]):
+            config_mock.return_value = defaultdict(None, {}), None
+            context_mock.return_value.for_image.side_effect = lambda image: MagicMock(
+                image=image, yum_cache=None, ccache=None)
+            packagers = {}
+
+            def packager(context, docker_config, pool=None):
+                p = MagicMock()
+                p.image_exists.return_value = True
+                p.build_package.return_value = [MagicMock(spec=Client), []]
+                p.export_package.return_value = ['%s.rpm' % context.image]
+                packagers[context.image] = p
+                packager_mock = MagicMock()
+                packager_mock.__enter__.return_value = p
+                return packager_mock
+
+            packager_mock.side_effect = packager
+
+            build.main()
+
+        self.assertTrue(context_mock.return_value.stream)
+        self.assertEqual(sorted(packagers), ['centos:6', 'centos:7'])
+        packagers['centos:6'].export_package.assert_called_with(
+            os.path.join(output, 'centos_6'))
+        packagers['centos:7'].export_package.assert_called_with(
+            os.path.join(output, 'centos_7'))
+        self.assertTrue(os.path.isdir(os.path.join(output, 'centos_7')))
+        self.assertTrue(any(c[0][0].startswith('2 target(s) built, 0 failed in ')
+                            for c in print_mock.call_args_list))
+        self.assertFalse(sys_exit_mock.called)
+
+    @patch('multiprocessing.cpu_count', return_value=8)
+    def test_workers_fit_the_cpus_of_the_docker_hosts(self, cpu_count_mock):
+        pool = MagicMock()
+        client = pool.client.return_value.__enter__.return_value
+        client.info.side_effect = [{'NCPU': 16}, {'NCPU': 32}, Exception('down')]
+        hosts = [{'base_url': 'tcp://a:2375'}, {'base_url': 'tcp://b:2375'},
+                 {'base_url': 'tcp://c:2375'}]
+        cpus = build.host_cpus(pool, hosts)
+        self.assertEqual(cpus, [16, 32])
+        self.assertEqual(build.get_workers({'--workers': None, '--cpus': '4'}, cpus), 12)
+        self.assertEqual(build.get_workers({'--workers': '3', '--cpus': '4'}, cpus), 3)
+        self.assertEqual(build.get_workers({'--workers': None, '--cpus': None}, cpus), 12)
+        self.assertEqual(build.get_workers({'--workers': None, '--cpus': None}, cpus,
+                                           [None, '6', '1.5']), 8)
+
+        client.info.side_effect = Exception('down')
+        self.assertEqual(build.host_cpus(pool, hosts), [8])
+
+    def test_concurrent_builds_do_not_oversubscribe_the_cpus(self):
+        for cpus, workers_arg, build_cpus in (
+                ([64], None, []), ([8, 8], None, []), ([6], None, []),
+                ([2], None, []), ([64], '3', []), ([64], None, ['6', None])):
+            workers = build.get_workers({'--workers': workers_arg, '--cpus': None},
+                                        cpus, build_cpus)
+            contexts = [PackagerContext('foo', spec='foo.spec', cpus=c)
+                        for c in build_cpus + [None] * workers][:workers]
+            for context in contexts:
+                build.share_cpus(context, cpus, workers)
+            self.assertLessEqual(sum(c.jobs for c in contexts), sum(cpus))
+            self.assertLessEqual(max(c.jobs for c in contexts), max(cpus))
+            self.assertGreaterEqual(min(c.jobs for c in contexts), min(4, max(cpus)))
+
+        single = PackagerContext('foo', spec='foo.spec')
+        build.share_cpus(single, [16, 8], 1)
+        self.assertEqual(single.jobs, 16)
+        limited = PackagerContext('foo', spec='foo.spec', cpus=2)
+        build.share_cpus(limited, [16], 1)
+        self.assertEqual(limited.jobs, 2)
+
+    def test_get_images_accepts_one_image_or_several(self):
+        self.assertEqual(build.get_images({'<image>': 'centos:7'}, {}), ['centos:7'])
+        self.assertEqual(build.get_images({'<image>': []}, {'image': ['', 'centos:6', 'centos:7 ']}),
+                         ['centos:6', 'centos:7'])
+        self.assertEqual(build.get_images({}, {}), [])
+
     @patch('rpmbuild.build.Packager')
     @patch('os.path.exists', return_value=True)
     def test_build_with_only_values_from_config_provides_valid_package_context(
@@ -177,6 +609,9 @@ class BuildTest(TestCase):
             '--macrofile': None,
             '--spec': None,
             '--srpm': None,
+            '--stream-context': False,
+            '--yum-cache': None,
+            '--ccache': None,
             '<image>': None,
             'build': True,
             'rebuild': False
@@ -213,7 +648,21 @@ class BuildTest(TestCase):
     def test_print_with_file_include_filehandle_in_print_statement(self, stderr_mock):
         with self.mock_it('print') as print_mock:
             build.log('foo', sys.stderr)
-            print_mock.assert_called_with('foo', stderr_mock)
+            print_mock.assert_called_with('foo', file=stderr_mock)
+
+    def test_failures_are_logged_to_stderr(self):
+        results = [MagicMock(path='foo.spec', error=None, duration=1, exported=[]),
+                   MagicMock(path='bar.spec', error='broken', duration=2)]
+        with patch('sys.stdout', new_callable=StringIO) as stdout, \
+                patch('sys.stderr', new_callable=StringIO) as stderr:
+            for result in results:
+                build.log_result(result)
+            self.assertFalse(build.log_summary(results, 'package(s)', 0))
+
+        self.assertIn('[foo.spec] OK', stdout.getvalue())
+        self.assertIn('1 package(s) built, 1 failed', stdout.getvalue())
+        self.assertEqual(stderr.getvalue().splitlines(), [
+            '[bar.spec] FAILED in 2.0s: broken', 'Failed: bar.spec'])
 
 
     def test_print_without_file(self):
@@ -7,7 +7,10 @@ except ImportError:
     from configparser import ConfigParser
     from io import StringIO
 
+import os
+import shutil
 import sys
+import tempfile
 if sys.version_info >= (3,):
     import unittest
 else:
@@ -17,6 +20,7 @@ from collections import defaultdict
 
 from mock import mock_open, patch
 from rpmbuild.config import _read_config, _read_section, get_docker_config, DEFAULT_TIMEOUT, get_parsed_config
+from rpmbuild.config import get_docker_configs
 
 
 class ConfigTestCase(unittest.TestCase):
@@ -299,4 +303,40 @@ sources_dir=super_directory_with_sources
 
         config, path_to_config = get_parsed_config(docopt_args)
         self.assertIsInstance(config, defaultdict)
-        self.assertEqual(0, len(config.keys()))
\ No newline at end of file
+        self.assertEqual(0, len(config.keys()))
+
+    def global_config(self, raw_config):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        with open(os.path.join(path, 'config'), 'w') as f:
+            f.write(raw_config)
+        patcher = patch.dict(os.environ, {'DOCKER_RPMBUILD_CONFIG': os.path.join(path, 'config')})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_docker_config_falls_back_to_global_config(self):
+        self.global_config("[docker]\nbase_url=tcp://global:2375\nversion=1.15\n")
+
+        config = get_docker_config(self.docopt_with_only_config_file_without_timeout,
+                                   defaultdict(None, {'version': '1.16'}))
+
+        self.assertEqual(config['base_url'], 'tcp://global:2375')
+        self.assertEqual(config['version'], '1.16')
+
+    def test_get_docker_configs_has_one_config_per_host(self):
+        self.global_config("[docker]\nhosts=tcp://a:2375\n      tcp://b:2375\n")
+        docopt_args = dict(self.docopt_with_only_config_file_without_timeout,
+                           **{'--docker-host': []})
+
+        configs = get_docker_configs(docopt_args, defaultdict(None, {}))
+        self.assertEqual([c['base_url'] for c in configs], ['tcp://a:2375', 'tcp://b:2375'])
+        self.assertTrue(all(c['timeout'] == int(DEFAULT_TIMEOUT) for c in configs))
+
+        docopt_args['--docker-host'] = ['tcp://c:2375']
+        configs = get_docker_configs(docopt_args, defaultdict(None, {}))
+        self.assertEqual([c['base_url'] for c in configs], ['tcp://c:2375'])
+
+        docopt_args['--docker-host'] = []
+        docopt_args['--docker-base_url'] = 'tcp://d:2375'
+        configs = get_docker_configs(docopt_args, defaultdict(None, {}))
+        self.assertEqual([c['base_url'] for c in configs], ['tcp://d:2375'])
@@ -0,0 +1,87 @@
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info >= (3,):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from rpmbuild import PackagerException
+from rpmbuild.logs import BuildLog, LogFile, iter_json, iter_lines
+
+
+class LogsTestCase(unittest.TestCase):
+    """Tests for logs.py"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_iter_lines_reassembles_chunks(self):
+        chunks = [b'gcc -c fo', b'o.c\ngcc -c bar.c\ngcc', b' -c baz.c']
+        self.assertEqual(list(iter_lines(chunks)),
+                         [b'gcc -c foo.c', b'gcc -c bar.c', b'gcc -c baz.c'])
+
+    def test_iter_lines_cuts_long_lines(self):
+        self.assertEqual(list(iter_lines([b'abcde', b'fg\nh'], max_length=3)),
+                         [b'abc', b'def', b'g', b'h'])
+
+    def test_iter_json_decodes_objects_across_chunks(self):
+        chunks = [b'{"stream": "Step 1"}{"str', b'eam": "\xc3', b'\xa6"}\r\n',
+                  b'{"stream": "done"}']
+        self.assertEqual(list(iter_json(chunks)), [
+            {'stream': 'Step 1'}, {'stream': u'\xe6'}, {'stream': 'done'}])
+
+    def test_iter_json_raises_on_garbage(self):
+        with self.assertRaises(PackagerException):
+            list(iter_json([b'not json' * 10], max_length=20))
+        with self.assertRaises(ValueError):
+            list(iter_json([b'{"stream": ']))
+
+    def test_log_file_rotates_compressed(self):
+        path = os.path.join(self.path, 'build.log')
+        log_file = LogFile(path, max_bytes=10, backups=2)
+        for line in ('first line', 'second line', 'third line', 'fourth'):
+            log_file.write(line)
+        log_file.close()
+
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['build.log', 'build.log.1.gz', 'build.log.2.gz'])
+        with gzip.open(path + '.1.gz') as f:
+            self.assertEqual(f.read(), b'third line\n')
+        with gzip.open(path + '.2.gz') as f:
+            self.assertEqual(f.read(), b'second line\n')
+        with io.open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'fourth\n')
+
+    def test_log_file_rejects_unknown_compression(self):
+        with self.assertRaises(PackagerException):
+            LogFile(os.path.join(self.path, 'build.log'), compression='lzma')
+
+    def test_build_log_keeps_bounded_tail(self):
+        lines = []
+        path = os.path.join(self.path, 'build.log')
+        log_file = LogFile(path)
+        build_log = BuildLog(lines.append, log_file, prefix='[foo] ', tail=2)
+        for i in range(5):
+            build_log('line %d' % i)
+        log_file.close()
+
+        self.assertEqual(build_log.tail(), ['line 3', 'line 4'])
+        self.assertEqual(lines[0], '[foo] line 0')
+        with io.open(path, encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+    def test_quiet_build_log_only_writes_log_file(self):
+        lines = []
+        build_log = BuildLog(lines.append, quiet=True)
+        build_log('line')
+        self.assertEqual(lines, [])
+        self.assertEqual(build_log.tail(), ['line'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info >= (3,):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from rpmbuild.manifest import Manifest, MANIFEST_NAME
+
+
+class ManifestTestCase(unittest.TestCase):
+    """Tests for manifest.py"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def touch(self, name):
+        path = os.path.join(self.path, name)
+        open(path, 'w').close()
+        return path
+
+    def test_lookup_returns_recorded_rpms(self):
+        rpms = [self.touch('foo-1.0-1.x86_64.rpm'), self.touch('foo-1.0-1.src.rpm')]
+        Manifest(self.path).record('abc', 'foo.spec', rpms)
+
+        self.assertEqual(Manifest(self.path).lookup('abc'), sorted(rpms))
+        self.assertIsNone(Manifest(self.path).lookup('def'))
+
+    def test_lookup_finds_rpms_in_architecture_directories(self):
+        os.mkdir(os.path.join(self.path, 'x86_64'))
+        rpms = [self.touch('foo-1.0-1.src.rpm'), self.touch('x86_64/foo-1.0-1.x86_64.rpm')]
+        Manifest(self.path).record('abc', 'foo.spec', rpms)
+
+        self.assertEqual(Manifest(self.path).lookup('abc'), rpms)
+
+    def test_lookup_misses_when_an_rpm_is_gone(self):
+        rpms = [self.touch('foo-1.0-1.x86_64.rpm'), self.touch('foo-1.0-1.src.rpm')]
+        Manifest(self.path).record('abc', 'foo.spec', rpms)
+        os.remove(rpms[0])
+
+        self.assertIsNone(Manifest(self.path).lookup('abc'))
+
+    def test_builds_without_binary_rpms_are_not_cached(self):
+        srpm = self.touch('foo-1.0-1.src.rpm')
+        manifest = Manifest(self.path)
+        manifest.record('abc', 'foo.spec', [srpm])
+        self.assertFalse(os.path.exists(manifest.path))
+
+        with open(manifest.path, 'w') as f:
+            json.dump({'abc': {'name': 'foo.spec', 'built': 0,
+                               'artifacts': ['foo-1.0-1.src.rpm']}}, f)
+        self.assertIsNone(manifest.lookup('abc'))
+
+    def test_record_replaces_older_entry_of_package(self):
+        manifest = Manifest(self.path)
+        manifest.record('abc', 'foo.spec', [self.touch('foo-1.0-1.x86_64.rpm')])
+        manifest.record('bcd', 'bar.spec', [self.touch('bar-1.0-1.x86_64.rpm')])
+        manifest.record('def', 'foo.spec', [self.touch('foo-1.1-1.x86_64.rpm')])
+
+        with open(os.path.join(self.path, MANIFEST_NAME)) as f:
+            self.assertEqual(sorted(json.load(f)), ['bcd', 'def'])
+        self.assertEqual(os.listdir(self.path).count(MANIFEST_NAME), 1)
+
+    def test_unreadable_manifest_is_empty(self):
+        with open(os.path.join(self.path, MANIFEST_NAME), 'w') as f:
+            f.write('{')
+
+        self.assertIsNone(Manifest(self.path).lookup('abc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,25 +1,25 @@
 #!/usr/bin/env python
+import io
+import os
+import shutil
 import sys
+import tarfile
+import tempfile
 if sys.version_info >= (3,):
     import unittest
 else:
     import unittest2 as unittest
 
-from mock import mock_open, patch, MagicMock
+from mock import patch, MagicMock
 
+from docker.errors import APIError
 from rpmbuild import Packager, PackagerException
 
 
 @patch('rpmbuild.PackagerContext')
 class PackagetTestCase(unittest.TestCase):
 
-    docker_file_header = ''.join(['0' for x in range(512)])
-    docker_file_content = 'foobar'
-
     def setUp(self):
-        self.open = mock_open()
-        self.docker_file = MagicMock()
-        self.docker_file.read.return_value = self.docker_file_header + self.docker_file_content
         self.docker_client_patcher = patch('docker.Client')
         self.docker_client = self.docker_client_patcher.start()
 
@@ -28,18 +28,80 @@ class PackagetTestCase(unittest.TestCase):
         Packager(context, {'foo': 'bar'})
         self.docker_client.assert_called_with(**{'foo': 'bar'})
 
+    def test_packager_borrows_client_from_pool_while_entered(self, PackagerContext):
+        context = PackagerContext.return_value
+        pool = MagicMock()
+        packager = Packager(context, {'foo': 'bar'}, pool=pool)
+        packager.__dict__['_base_image_name'] = 'rpmbuild_base:0123456789ab'
+        self.assertFalse(self.docker_client.called)
+
+        with packager:
+            pool.acquire.assert_called_with({'foo': 'bar'})
+            self.assertEqual(packager.client, pool.acquire.return_value)
+
+        pool.release.assert_called_with({'foo': 'bar'}, pool.acquire.return_value)
+        self.assertIsNone(packager.client)
+
+    def test_packager_returns_client_to_pool_when_enter_fails(self, PackagerContext):
+        context = PackagerContext.return_value
+        pool = MagicMock()
+        pool.acquire.return_value.inspect_image.side_effect = APIError('', MagicMock())
+        packager = Packager(context, {}, pool=pool)
+
+        with self.assertRaises(PackagerException):
+            with packager:
+                pass
+
+        pool.release.assert_called_with({}, pool.acquire.return_value)
+
+    def test_packager_refuses_host_directories_on_remote_hosts(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.yum_cache = None
+        context.ccache = '/cache'
+        for base_url in (None, 'unix://var/run/docker.sock', 'tcp://127.0.0.1:2375',
+                         'http://localhost:2375'):
+            self.assertTrue(Packager(context, {'base_url': base_url}).local)
+        packager = Packager(context, {'base_url': 'tcp://build.example.com:2375'})
+        self.assertFalse(packager.local)
+
+        with self.assertRaises(PackagerException):
+            with packager:
+                pass
+        self.assertFalse(packager.client.inspect_image.called)
+
     def test_packager_image_name(self, PackagerContext):
         context = PackagerContext.return_value
         context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
         packager = Packager(context, {})
-        self.assertEqual(packager.image_name, 'rpmbuild-foo')
+        self.assertEqual(packager.image_name, 'rpmbuild_foo:0123456789ab')
 
     def test_packager_image_with_matches(self, PackagerContext):
         context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
         packager = Packager(context, {})
         packager.client = MagicMock()
-        packager.client.images.return_value = ['foo', 'bar']
-        self.assertEqual(packager.image, 'foo')
+        packager.client.images.return_value = [
+            {'Id': 1, 'RepoTags': ['rpmbuild_foo:ba9876543210']},
+            {'Id': 2, 'RepoTags': ['rpmbuild_foo:0123456789ab']},
+        ]
+        self.assertEqual(packager.image, {'Id': 2, 'RepoTags': ['rpmbuild_foo:0123456789ab']})
+        packager.client.images.assert_called_with(name='rpmbuild_foo')
+
+    def test_packager_image_exists(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.images.return_value = [
+            {'Id': 1, 'RepoTags': ['rpmbuild_foo:ba9876543210']},
+        ]
+        self.assertFalse(packager.image_exists())
+        packager.client.images.return_value.append(
+            {'Id': 2, 'RepoTags': ['rpmbuild_foo:0123456789ab']})
+        self.assertTrue(packager.image_exists())
 
     def test_packager_image_without_matches(self, PackagerContext):
         context = PackagerContext.return_value
@@ -49,29 +111,51 @@ class PackagetTestCase(unittest.TestCase):
         with self.assertRaises(PackagerException):
             packager.image
 
+    def _archive(self, members):
+        archive = io.BytesIO()
+        tar = tarfile.open(fileobj=archive, mode='w')
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+        tar.close()
+        archive.seek(0)
+        return archive
+
     def test_packager_export_package(self, PackagerContext):
         context = PackagerContext.return_value
         packager = Packager(context, {})
         packager.container = {'Id': 0}
         packager.client = MagicMock()
-        packager.client.copy.return_value = self.docker_file
-        packager.client.diff.return_value = [
-            {'Path': '/foo'},
-            {'Path': '/rpmbuild/SOURCES/foo.tar.gz'},
-            {'Path': '/rpmbuild/SPECS/foo.spec'},
-            {'Path': '/rpmbuild/foo.rpm'},
-            {'Path': '/rpmbuild/foo.src.rpm'},
+        packager.client.copy.side_effect = [
+            self._archive([
+                ('RPMS', None),
+                ('RPMS/x86_64', None),
+                ('RPMS/x86_64/foo.rpm', b'foo'),
+                ('RPMS/x86_64/foo.txt', b'not an rpm'),
+            ]),
+            self._archive([
+                ('SRPMS', None),
+                ('SRPMS/foo.src.rpm', b'foo source'),
+            ]),
         ]
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
 
-        with patch('rpmbuild.open', self.open, create=True):
-            packager.export_package('/tmp')
+        exported = packager.export_package(output)
 
-        packager.client.copy.assert_any_call(0, '/rpmbuild/foo.rpm')
-        packager.client.copy.assert_any_call(0, '/rpmbuild/foo.src.rpm')
-        self.open.assert_any_call('/tmp/foo.rpm', 'wb')
-        self.open.assert_any_call('/tmp/foo.src.rpm', 'wb')
-        exported = self.open()
-        exported.write.assert_called_with(self.docker_file_content)
+        packager.client.copy.assert_any_call(0, '/rpmbuild/build/RPMS')
+        packager.client.copy.assert_any_call(0, '/rpmbuild/build/SRPMS')
+        self.assertFalse(packager.client.diff.called)
+        self.assertEqual(exported, [os.path.join(output, 'foo.rpm'),
+                                    os.path.join(output, 'foo.src.rpm')])
+        self.assertEqual(sorted(os.listdir(output)), ['foo.rpm', 'foo.src.rpm'])
+        with open(os.path.join(output, 'foo.src.rpm'), 'rb') as f:
+            self.assertEqual(f.read(), b'foo source')
 
     def test_packager_string(self, PackagerContext):
         context = PackagerContext.return_value
@@ -81,24 +165,118 @@ class PackagetTestCase(unittest.TestCase):
 
     def test_packager_with_statement(self, PackagerContext):
         context = PackagerContext.return_value
-        with Packager(context, {}):
+        context.render_base.return_value = 'FROM centos:7'
+        self.docker_client.return_value.inspect_image.return_value = {'Id': 'abc'}
+        context.stream = False
+        context.path = None
+        with Packager(context, {}) as packager:
+            self.assertEqual(context.base_image, packager.base_image_name)
+            self.assertFalse(context.setup.called)
+            packager.stage()
             context.setup.assert_called_with()
         context.teardown.assert_called_with()
 
+    def test_packager_base_image_name(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.image = 'centos:7'
+        context.render_base.return_value = 'FROM centos:7'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.inspect_image.return_value = {'Id': 'abc'}
+        name = packager.base_image_name
+        self.assertTrue(name.startswith('rpmbuild_base:'))
+        packager.client.inspect_image.assert_called_with('centos:7')
+
+        other = Packager(context, {})
+        other.client = MagicMock()
+        other.client.inspect_image.return_value = {'Id': 'def'}
+        self.assertNotEqual(name, other.base_image_name)
+
+    def test_packager_base_image_name_pulls_missing_image(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.image = 'centos:7'
+        context.render_base.return_value = 'FROM centos:7'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.inspect_image.side_effect = [
+            APIError('not found', MagicMock()), {'Id': 'abc'}]
+        packager.base_image_name
+        packager.client.pull.assert_called_with('centos:7')
+
+    def test_packager_base_image_name_raises_if_pull_fails(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.image = 'centos:7'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.inspect_image.side_effect = APIError('not found', MagicMock())
+        with self.assertRaises(PackagerException):
+            packager.base_image_name
+
+    def test_packager_build_base_image(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.render_base.return_value = 'FROM centos:7'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.inspect_image.return_value = {'Id': 'abc'}
+        packager.build_base_image()
+        kwargs = packager.client.build.call_args[1]
+        self.assertEqual(kwargs['fileobj'].getvalue(), b'FROM centos:7')
+        self.assertEqual(kwargs['tag'], packager.base_image_name)
+        self.assertTrue(kwargs['stream'])
+        # The toolchain image is built FROM a registry image, which may be
+        # pulled; package images are built FROM local toolchain images.
+        self.assertNotIn('pull', kwargs)
+
+    def test_packager_base_image_lock_is_shared_per_host_and_tag(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.render_base.return_value = 'FROM centos:7'
+        packagers = []
+        for base_url in ('unix://a.sock', 'unix://a.sock', 'unix://b.sock'):
+            packager = Packager(context, {'base_url': base_url})
+            packager.client = MagicMock()
+            packager.client.inspect_image.return_value = {'Id': 'abc'}
+            packagers.append(packager)
+
+        self.assertIs(packagers[0].base_image_lock(), packagers[1].base_image_lock())
+        self.assertIsNot(packagers[0].base_image_lock(), packagers[2].base_image_lock())
+
     def test_packager_build_image(self, PackagerContext):
         context = PackagerContext.return_value
         context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
         context.path = '/tmp'
+        context.stream = False
+        context.yum_cache = None
         packager = Packager(context, {})
         packager.client.build = MagicMock()
         packager.build_image()
-        packager.client.build.assert_called_with('/tmp', tag='rpmbuild-foo', stream=True)
+        packager.client.build.assert_called_with('/tmp', tag='rpmbuild_foo:0123456789ab',
+                                                stream=True, pull=False)
+
+    def test_packager_build_image_streamed(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
+        context.stream = True
+        context.yum_cache = None
+        packager = Packager(context, {})
+        packager.client.build = MagicMock()
+        packager.build_image()
+        packager.client.build.assert_called_with(
+            fileobj=context.archive.return_value, custom_context=True,
+            tag='rpmbuild_foo:0123456789ab', stream=True, pull=False)
 
     def test_packager_build_package(self, PackagerContext):
         context = PackagerContext.return_value
+        context.ccache = None
+        context.tmpfs_build = None
+        context.memory = None
+        context.cpus = None
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
         packager = Packager(context, {})
         packager.client = MagicMock()
-        packager.client.images.return_value = [{'Id': 0}]
+        packager.client.images.return_value = [{'Id': 0, 'RepoTags': ['rpmbuild_foo:0123456789ab']}]
         result_container, result_logs = packager.build_package()
         container = packager.client.create_container.return_value
         packager.client.create_container.assert_called_with(0)
@@ -106,6 +284,204 @@ class PackagetTestCase(unittest.TestCase):
         packager.client.start.assert_called_with(container)
         self.assertEqual(result_container, container)
 
+    def test_packager_build_package_with_ccache(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
+        context.ccache = '/cache/ccache'
+        context.tmpfs_build = None
+        context.memory = None
+        context.cpus = None
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.images.return_value = [{'Id': 0, 'RepoTags': ['rpmbuild_foo:0123456789ab']}]
+        packager.build_package()
+        packager.client.create_container.assert_called_with(
+            0, host_config={'Binds': ['/cache/ccache:/rpmbuild/ccache:rw']})
+
+    def test_packager_build_package_with_tmpfs_build(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
+        context.ccache = None
+        context.tmpfs_build = '8g'
+        context.memory = None
+        context.cpus = None
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.images.return_value = [{'Id': 0, 'RepoTags': ['rpmbuild_foo:0123456789ab']}]
+        packager.build_package()
+        options = 'rw,exec,nosuid,nodev,size=8g'
+        packager.client.create_container.assert_called_with(
+            0, host_config={'Tmpfs': {'/rpmbuild/build/BUILD': options,
+                                      '/rpmbuild/build/BUILDROOT': options}})
+
+    def test_packager_wait_package_raises_unless_rpmbuild_succeeded(self, PackagerContext):
+        packager = Packager(PackagerContext.return_value, {})
+        packager.client = MagicMock()
+        packager.container = {'Id': 'abc'}
+        packager.client.wait.return_value = 0
+        packager.wait_package()
+        packager.client.wait.return_value = 1
+        with self.assertRaises(PackagerException):
+            packager.wait_package()
+        packager.client.wait.assert_called_with({'Id': 'abc'})
+
+        packager.remove_package()
+        packager.client.remove_container.assert_called_with({'Id': 'abc'})
+
+    def test_packager_build_package_with_resource_limits(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
+        context.ccache = None
+        context.tmpfs_build = None
+        context.memory = '4g'
+        context.cpus = 1.5
+        context.jobs = 2
+        context.command.return_value = "rpmbuild --define '_smp_mflags -j2' -ba foo.spec"
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.images.return_value = [{'Id': 0, 'RepoTags': ['rpmbuild_foo:0123456789ab']}]
+        packager.build_package()
+        context.command.assert_called_with(2)
+        packager.client.create_container.assert_called_with(
+            0, command=['/bin/sh', '-c', "rpmbuild --define '_smp_mflags -j2' -ba foo.spec"],
+            host_config={'Memory': 4 << 30, 'CpuPeriod': 100000,
+                         'CpuQuota': 150000})
+
+    def bind_output_packager(self, context):
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.images.return_value = [{'Id': 0, 'RepoTags': ['rpmbuild_foo:0123456789ab']}]
+        return packager
+
+    def test_packager_build_package_with_bind_output(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.ccache = None
+        context.tmpfs_build = None
+        context.memory = None
+        context.cpus = None
+        context.__str__.return_value = 'foo'
+        context.digest = '0123456789abcdef'
+        context.command.return_value = 'rpmbuild -ba foo.spec'
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        with open(os.path.join(output, 'old.rpm'), 'w') as f:
+            f.write('old')
+
+        packagers = [self.bind_output_packager(context) for _ in range(2)]
+        for packager in packagers:
+            packager.build_package(output=output)
+
+        bound = packagers[0].bind_output
+        self.assertEqual(os.path.dirname(bound), output)
+        self.assertNotEqual(bound, packagers[1].bind_output)
+        context.command.assert_called_with(None)
+        packagers[0].client.create_container.assert_called_with(
+            0, volumes=['/rpmbuild/build/RPMS', '/rpmbuild/build/SRPMS'],
+            command=['/bin/sh', '-c',
+                     '(rpmbuild -ba foo.spec); status=$?; chown -R %d:%d '
+                     '/rpmbuild/build/RPMS /rpmbuild/build/SRPMS; exit $status' % (
+                         os.getuid(), os.getgid())],
+            host_config={'Binds': [
+                '%s:/rpmbuild/build/RPMS:rw' % bound,
+                '%s:/rpmbuild/build/SRPMS:rw' % bound,
+            ]})
+
+        # Both builds run at once, each writing to its own directory.
+        for packager, name in zip(packagers, ('foo', 'bar')):
+            os.mkdir(os.path.join(packager.bind_output, 'x86_64'))
+            for rpm in ('x86_64/%s.rpm' % name, '%s.src.rpm' % name):
+                with open(os.path.join(packager.bind_output, rpm), 'w') as f:
+                    f.write(rpm)
+
+        self.assertEqual(packagers[0].export_package(output), [
+            os.path.join(output, 'foo.src.rpm'),
+            os.path.join(output, 'x86_64', 'foo.rpm'),
+        ])
+        self.assertEqual(packagers[1].export_package(output), [
+            os.path.join(output, 'bar.src.rpm'),
+            os.path.join(output, 'x86_64', 'bar.rpm'),
+        ])
+        self.assertEqual(sorted(os.listdir(output)),
+                         ['bar.src.rpm', 'foo.src.rpm', 'old.rpm', 'x86_64'])
+        with open(os.path.join(output, 'x86_64', 'foo.rpm')) as f:
+            self.assertEqual(f.read(), 'x86_64/foo.rpm')
+        self.assertFalse(packagers[0].client.copy.called)
+
+    def test_packager_builds_deps_image_without_sources(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.deps_digest = 'fedcba9876543210'
+        context.yum_cache = '/cache'
+        packager = Packager(context, {})
+        packager.client.build = MagicMock()
+        packager.name_deps_image()
+        self.assertEqual(context.deps_image, 'rpmbuild_foo:deps-fedcba987654')
+
+        packager.build_deps_image()
+
+        context.archive.assert_called_with(deps=True)
+        packager.client.build.assert_called_with(
+            fileobj=context.archive.return_value, custom_context=True,
+            tag='rpmbuild_foo:deps-fedcba987654-nobuilddeps', stream=True,
+            pull=False)
+
+    def test_packager_yum_cache_lock_is_in_the_cache(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.yum_cache = os.path.join(tempfile.mkdtemp(), 'cache')
+        self.addCleanup(shutil.rmtree, os.path.dirname(context.yum_cache))
+        packager = Packager(context, {})
+
+        with packager.yum_cache_lock() as lock:
+            self.assertEqual(lock.path, os.path.join(context.yum_cache, '.lock'))
+            self.assertFalse(packager.yum_cache_lock().acquire(False))
+        self.assertTrue(os.path.exists(lock.path))
+
+    def test_packager_install_and_commit_build_deps(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.__str__.return_value = 'foo'
+        context.deps_digest = '0123456789abcdef'
+        context.spec = '/src/foo.spec'
+        context.yum_cache = '/cache'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.wait.return_value = 0
+        packager.client.inspect_image.return_value = {'Config': {'Cmd': ['rpmbuild', '-ba']}}
+
+        container, logs = packager.install_build_deps()
+
+        packager.client.create_container.assert_called_with(
+            'rpmbuild_foo:deps-0123456789ab-nobuilddeps',
+            command=['yum-builddep', '-y', '--setopt=keepcache=1',
+                     '/rpmbuild/build/SPECS/foo.spec'],
+            host_config={'Binds': ['/cache/yum:/var/cache/yum:rw',
+                                   '/cache/dnf:/var/cache/dnf:rw']})
+        packager.client.start.assert_called_with(container)
+
+        packager.commit_build_deps()
+
+        packager.client.commit.assert_called_with(
+            container, repository='rpmbuild_foo', tag='deps-0123456789ab',
+            conf={'Cmd': ['rpmbuild', '-ba']})
+        packager.client.remove_container.assert_called_with(container)
+        packager.client.remove_image.assert_called_with('rpmbuild_foo:deps-0123456789ab-nobuilddeps')
+
+    def test_packager_commit_build_deps_raises_on_failure(self, PackagerContext):
+        context = PackagerContext.return_value
+        context.spec = '/src/foo.spec'
+        context.yum_cache = '/cache'
+        packager = Packager(context, {})
+        packager.client = MagicMock()
+        packager.client.wait.return_value = 1
+        container, logs = packager.install_build_deps()
+
+        with self.assertRaises(PackagerException):
+            packager.commit_build_deps()
+        self.assertFalse(packager.client.commit.called)
+        packager.client.remove_container.assert_called_with(container)
+
     def tearDown(self):
         self.docker_client_patcher.stop()
 
@@ -1,4 +1,10 @@
+import errno
+import io
+import os
+import shutil
 import sys
+import tarfile
+import tempfile
 if sys.version_info >= (3,):
     import unittest
 else:
@@ -6,7 +12,7 @@ else:
 
 from mock import mock_open, patch, DEFAULT, MagicMock
 
-from rpmbuild import PackagerContext, PackagerException
+from rpmbuild import PackagerContext, PackagerException, stage_file
 
 
 class PackagerContextTestCase(unittest.TestCase):
@@ -15,13 +21,20 @@ class PackagerContextTestCase(unittest.TestCase):
     def setUp(self):
         self.context_defaults = dict(
                 image=None,
+                base_image=None,
+                deps=False,
+                deps_image=None,
                 defines=[],
                 macrofiles=[],
                 sources=[],
                 sources_dir=None,
                 spec=None,
                 retrieve=None,
-                srpm=None)
+                srpm=None,
+                repo=False,
+                yum_cache=False,
+                ccache=False,
+                ccache_dir='/rpmbuild/ccache')
         self.open = mock_open()
 
     def test_packager_context_str(self):
@@ -30,41 +43,100 @@ class PackagerContextTestCase(unittest.TestCase):
         context = PackagerContext('foo', srpm='foo.srpm')
         self.assertEqual(str(context), 'foo.srpm')
 
+    @patch('os.makedirs')
     @patch('shutil.copy')
     @patch('tempfile.mkdtemp', return_value='/context')
-    def test_packager_context_setup_macrofiles(self, mkdtemp, copy):
+    def test_packager_context_setup_macrofiles(self, mkdtemp, copy, makedirs):
         with patch('rpmbuild.open', self.open, create=True):
             context = PackagerContext('foo', macrofiles=['foo.macro'], spec='foo.spec')
             context.setup()
-            copy.assert_any_call('foo.macro', '/context')
+            copy.assert_any_call('foo.macro', '/context/SPECS/foo.macro')
 
+    @patch('os.makedirs')
     @patch('shutil.copy')
     @patch('tempfile.mkdtemp', return_value='/context')
-    def test_packager_context_setup_spec(self, mkdtemp, copy):
+    def test_packager_context_setup_spec(self, mkdtemp, copy, makedirs):
         with patch('rpmbuild.open', self.open, create=True):
             context = PackagerContext('foo', spec='foo.spec')
-            context.template.render = MagicMock()
+            context.template = MagicMock()
             context.setup()
-            copy.assert_called_with('foo.spec', '/context')
-            self.context_defaults.update(image='foo', spec='foo.spec')
+            copy.assert_called_with('foo.spec', '/context/SPECS/foo.spec')
+            self.context_defaults.update(
+                image='foo', spec='foo.spec',
+                command='rpmbuild -ba /rpmbuild/build/SPECS/foo.spec')
             context.template.render.assert_called_with(**self.context_defaults)
 
+    @patch('os.makedirs')
     @patch('shutil.copy')
     @patch('tempfile.mkdtemp', return_value='/context')
-    def test_packager_context_setup_sources(self, mkdtemp, copy):
+    def test_packager_context_setup_sources(self, mkdtemp, copy, makedirs):
         with patch('rpmbuild.open', self.open, create=True):
             context = PackagerContext('foo', sources=['foo.tar.gz'], spec='foo.spec')
             context.setup()
-            copy.assert_any_call('foo.tar.gz', '/context')
+            copy.assert_any_call('foo.tar.gz', '/context/SOURCES/foo.tar.gz')
 
-    @patch.multiple('shutil', copy=DEFAULT, copytree=DEFAULT)
-    @patch('tempfile.mkdtemp', return_value='/context')
-    def test_packager_context_setup_spec_sources_dir(self, mkdtemp, copy, copytree):
-        with patch('rpmbuild.open', self.open, create=True):
-            context = PackagerContext('foo', spec='foo.spec', sources_dir='/tmp')
+    def test_packager_context_setup_spec_sources_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        sources_dir = os.path.join(path, 'SOURCES')
+        os.makedirs(os.path.join(sources_dir, 'patches'))
+        for name in (spec, os.path.join(sources_dir, 'patches', 'foo.patch')):
+            with open(name, 'w') as f:
+                f.write(name)
+
+        context = PackagerContext('foo', spec=spec, sources_dir=sources_dir,
+                                  staging_dir=path)
+        context.setup()
+        self.addCleanup(context.teardown)
+
+        self.assertEqual(os.path.dirname(context.path), path)
+        staged = os.path.join(context.path, 'SOURCES', 'patches', 'foo.patch')
+        self.assertTrue(os.path.samefile(
+            staged, os.path.join(sources_dir, 'patches', 'foo.patch')))
+        self.assertTrue(os.path.samefile(os.path.join(context.path, 'SPECS', 'foo.spec'), spec))
+
+    def test_setup_does_not_write_through_staged_sources_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        sources_dir = os.path.join(path, 'SOURCES')
+        source = os.path.join(path, 'foo.patch')
+        os.makedirs(sources_dir)
+        for name, content in ((spec, 'spec'), (source, 'new'),
+                              (os.path.join(sources_dir, 'foo.patch'), 'old')):
+            with open(name, 'w') as f:
+                f.write(content)
+
+        context = PackagerContext('foo', spec=spec, sources=[source],
+                                  sources_dir=sources_dir, staging_dir=path)
+        with patch('os.link', side_effect=OSError(errno.EPERM, 'Operation not permitted')):
             context.setup()
-            copy.assert_called_with('foo.spec', '/context')
-            copytree.assert_called_with('/tmp', '/context/SOURCES')
+        self.addCleanup(context.teardown)
+
+        with open(os.path.join(context.path, 'SOURCES', 'foo.patch')) as f:
+            self.assertEqual(f.read(), 'new')
+        with open(os.path.join(sources_dir, 'foo.patch')) as f:
+            self.assertEqual(f.read(), 'old')
+
+    @patch('shutil.copy')
+    @patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link'))
+    @patch('rpmbuild._reflink')
+    def test_stage_file_copies_across_filesystems(self, reflink, link, copy):
+        stage_file('foo.spec', '/context')
+        copy.assert_called_with('foo.spec', '/context')
+        self.assertFalse(reflink.called)
+
+    @patch('shutil.copy')
+    @patch('os.link', side_effect=OSError(errno.EPERM, 'Operation not permitted'))
+    @patch('rpmbuild._reflink')
+    def test_stage_file_reflinks_when_hardlinks_are_refused(self, reflink, link, copy):
+        stage_file('foo.spec', '/context')
+        reflink.assert_called_with('foo.spec', '/context/foo.spec')
+        self.assertFalse(copy.called)
+        reflink.side_effect = OSError(errno.EOPNOTSUPP, 'Operation not supported')
+        stage_file('foo.spec', '/context')
+        copy.assert_called_with('foo.spec', '/context')
 
     @patch('shutil.copy')
     @patch('tempfile.mkdtemp', return_value='/context')
@@ -72,11 +144,12 @@ class PackagerContextTestCase(unittest.TestCase):
         with patch('rpmbuild.open', self.open, create=True):
             context = PackagerContext('foo', srpm='foo.srpm')
             context.setup()
-            copy.assert_called_with('foo.srpm', '/context')
+            copy.assert_called_with('foo.srpm', '/context/foo.srpm')
 
     @patch.multiple('shutil', copy=DEFAULT, rmtree=DEFAULT)
+    @patch('os.makedirs')
     @patch('tempfile.mkdtemp', return_value='/context')
-    def test_packager_context_teardown(self, mkdtemp, copy, rmtree):
+    def test_packager_context_teardown(self, mkdtemp, makedirs, copy, rmtree):
         with patch('rpmbuild.open', self.open, create=True):
             context = PackagerContext('foo', spec='foo.spec')
             context.setup()
@@ -87,6 +160,42 @@ class PackagerContextTestCase(unittest.TestCase):
         with self.assertRaises(PackagerException):
             PackagerContext(image=None)
 
+    def test_invalid_tmpfs_size_throws_packagerexception(self):
+        self.assertEqual(PackagerContext('foo', spec='foo.spec', tmpfs_build='8g').tmpfs_build, '8g')
+        with self.assertRaises(PackagerException):
+            PackagerContext('foo', spec='foo.spec', tmpfs_build='8g,exec')
+
+    def test_invalid_resource_limits_throw_packagerexception(self):
+        with self.assertRaises(PackagerException):
+            PackagerContext('foo', spec='foo.spec', memory='4 GB')
+        for cpus in ('many', '0', -2):
+            with self.assertRaises(PackagerException):
+                PackagerContext('foo', spec='foo.spec', cpus=cpus)
+
+    def test_cpus_set_smp_mflags(self):
+        context = PackagerContext('foo', spec='foo.spec', cpus='1.5')
+        self.assertEqual(context.jobs, 2)
+        self.assertEqual(context.command(context.jobs),
+                         "rpmbuild --define '_smp_mflags -j2' -ba /rpmbuild/build/SPECS/foo.spec")
+        rebuild = PackagerContext('foo', srpm='foo.src.rpm', cpus=4, ccache='/cache')
+        self.assertEqual(rebuild.command(rebuild.jobs),
+                         "ccache -z; rpmbuild --define '_smp_mflags -j4' --rebuild "
+                         "/rpmbuild/foo.src.rpm; status=$?; ccache -s; exit $status")
+        self.assertIsNone(PackagerContext('foo', spec='foo.spec').jobs)
+
+    def test_cpus_do_not_change_the_image(self):
+        context = PackagerContext('foo', spec='foo.spec', cpus=4)
+        self.assertNotIn('_smp_mflags', context.render())
+        self.assertEqual(context.render(),
+                         PackagerContext('foo', spec='foo.spec', cpus=2).render())
+
+    def test_cpus_keep_defined_smp_mflags(self):
+        context = PackagerContext('foo', spec='foo.spec', cpus=4,
+                                  defines=['_smp_mflags -j1'])
+        self.assertIsNone(context.jobs)
+        self.assertIn("--define '_smp_mflags -j1'", context.command(context.jobs))
+        self.assertNotIn('-j4', context.command(context.jobs))
+
     def test_defines_is_empty_list_if_not_provided(self):
         self.assertEqual(PackagerContext(spec='foo.spec', image='foo').defines, [])
 
@@ -115,4 +224,314 @@ class PackagerContextTestCase(unittest.TestCase):
 
         # These are valid:
         PackagerContext('foo', spec='bar.spec', srpm=None)
-        PackagerContext('foo', srpm='foo.srpm')
\ No newline at end of file
+        PackagerContext('foo', srpm='foo.srpm')
+
+    def test_digest_is_stable_and_tracks_file_content(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        source = os.path.join(path, 'foo.tar.gz')
+        for name in (spec, source):
+            with open(name, 'w') as f:
+                f.write(name)
+
+        digest = PackagerContext('foo', spec=spec, sources=[source]).digest
+        self.assertEqual(digest, PackagerContext('foo', spec=spec, sources=[source]).digest)
+
+        with open(source, 'w') as f:
+            f.write('changed')
+        self.assertNotEqual(digest, PackagerContext('foo', spec=spec, sources=[source]).digest)
+
+    def test_digest_tracks_dockerfile(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        with open(spec, 'w') as f:
+            f.write('Name: foo')
+
+        self.assertNotEqual(
+            PackagerContext('foo', spec=spec).digest,
+            PackagerContext('foo', spec=spec, defines=['foo bar']).digest)
+
+    def test_digest_walks_sources_dir(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        sources_dir = os.path.join(path, 'SOURCES')
+        os.mkdir(sources_dir)
+        for name in (spec, os.path.join(sources_dir, 'foo.patch')):
+            with open(name, 'w') as f:
+                f.write(name)
+
+        digest = PackagerContext('foo', spec=spec, sources_dir=sources_dir).digest
+        with open(os.path.join(sources_dir, 'bar.patch'), 'w') as f:
+            f.write('bar')
+        self.assertNotEqual(digest, PackagerContext('foo', spec=spec, sources_dir=sources_dir).digest)
+
+    def test_digest_tracks_modes_symlinks_and_empty_directories(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        sources_dir = os.path.join(path, 'SOURCES')
+        linked = os.path.join(path, 'linked')
+        os.mkdir(sources_dir)
+        os.mkdir(linked)
+        for name in (spec, os.path.join(sources_dir, 'configure'),
+                     os.path.join(linked, 'a'), os.path.join(linked, 'b')):
+            with open(name, 'w') as f:
+                f.write('same')
+        os.symlink(linked, os.path.join(sources_dir, 'linked'))
+        os.symlink('a', os.path.join(sources_dir, 'current'))
+
+        def digest():
+            return PackagerContext('foo', spec=spec, sources_dir=sources_dir).digest
+
+        digests = [digest()]
+        os.chmod(os.path.join(sources_dir, 'configure'), 0o755)
+        digests.append(digest())
+        os.remove(os.path.join(sources_dir, 'current'))
+        os.symlink('b', os.path.join(sources_dir, 'current'))
+        digests.append(digest())
+        os.mkdir(os.path.join(sources_dir, 'empty'))
+        digests.append(digest())
+        with open(os.path.join(linked, 'a'), 'w') as f:
+            f.write('changed')
+        digests.append(digest())
+        self.assertEqual(len(set(digests)), len(digests))
+
+    def test_unused_packed_sources_are_evicted(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        source = os.path.join(path, 'foo-1.0')
+        cache = os.path.join(path, 'cache')
+        os.mkdir(source)
+        os.mkdir(cache)
+        for name in (spec, os.path.join(cache, 'old.tar.gz'),
+                     os.path.join(cache, 'recent.tar.gz')):
+            with open(name, 'w') as f:
+                f.write(name)
+        os.utime(os.path.join(cache, 'old.tar.gz'), (0, 0))
+
+        with patch('rpmbuild.PACKED_SOURCES_CACHE', cache):
+            tarball = PackagerContext('foo', spec=spec, sources=[source]).pack_sources()[source]
+            os.utime(tarball, (0, 0))
+            PackagerContext('foo', spec=spec, sources=[source]).pack_sources()
+
+        self.assertEqual(sorted(os.listdir(cache)),
+                         sorted(['recent.tar.gz', os.path.basename(tarball)]))
+
+    def test_for_image_copies_context_and_hashes_files_once(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        with open(spec, 'w') as f:
+            f.write('Name: foo')
+
+        context = PackagerContext('centos:6', spec=spec)
+        with patch('rpmbuild.update_digest') as update_digest:
+            targets = [context.for_image(image) for image in ('centos:6', 'centos:7')]
+            digests = [target.digest for target in targets]
+        self.assertEqual(update_digest.call_count, 1)
+        self.assertEqual([t.image for t in targets], ['centos:6', 'centos:7'])
+        self.assertEqual(digests[0], digests[1])
+        self.assertEqual(context.image, 'centos:6')
+
+    def test_directory_sources_are_packed_once(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        source = os.path.join(path, 'foo-1.0')
+        os.makedirs(os.path.join(source, 'src'))
+        for name in (spec, os.path.join(source, 'src', 'foo.c')):
+            with open(name, 'w') as f:
+                f.write(name)
+
+        with patch('rpmbuild.PACKED_SOURCES_CACHE', os.path.join(path, 'cache')):
+            context = PackagerContext('foo', spec=spec, sources=[source])
+            tarball = context.pack_sources()[source]
+            with tarfile.open(tarball) as archive:
+                self.assertEqual(archive.getnames(), ['.', './src', './src/foo.c'])
+                self.assertEqual(archive.getmember('./src/foo.c').uname, 'root')
+
+            with patch('rpmbuild.pack_directory') as pack_directory:
+                context = PackagerContext('foo', spec=spec, sources=[source])
+                self.assertEqual(context.pack_sources(), {source: tarball})
+                self.assertFalse(pack_directory.called)
+
+                archive = tarfile.open(fileobj=io.BytesIO(b''.join(context.archive())))
+                with open(tarball, 'rb') as f:
+                    self.assertEqual(archive.extractfile('SOURCES/foo-1.0').read(), f.read())
+
+        dockerfile = context.render()
+        self.assertIn('COPY SOURCES /rpmbuild/build/SOURCES', dockerfile)
+        self.assertNotIn('tar -C', dockerfile)
+
+    def test_setup_stages_directory_sources_under_their_own_name(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        source = os.path.join(path, 'mysrc')
+        os.mkdir(source)
+        for name in (spec, os.path.join(source, 'foo.c')):
+            with open(name, 'w') as f:
+                f.write(name)
+
+        with patch('rpmbuild.PACKED_SOURCES_CACHE', os.path.join(path, 'cache')):
+            context = PackagerContext('foo', spec=spec, sources=[source],
+                                      staging_dir=path)
+            context.setup()
+        self.addCleanup(context.teardown)
+
+        self.assertEqual(os.listdir(os.path.join(context.path, 'SOURCES')), ['mysrc'])
+        with tarfile.open(os.path.join(context.path, 'SOURCES', 'mysrc')) as archive:
+            self.assertEqual(archive.getnames(), ['.', './foo.c'])
+        streamed = tarfile.open(fileobj=io.BytesIO(b''.join(context.archive())))
+        self.assertIn('SOURCES/mysrc', streamed.getnames())
+
+    def test_templates_are_compiled_once(self):
+        self.assertIs(PackagerContext('foo', spec='foo.spec').template,
+                      PackagerContext('bar', srpm='bar.src.rpm').template)
+
+    def test_size_counts_context_files_and_dockerfile(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        sources_dir = os.path.join(path, 'SOURCES')
+        os.mkdir(sources_dir)
+        for name, size in ((spec, 10), (os.path.join(sources_dir, 'foo.patch'), 100)):
+            with open(name, 'w') as f:
+                f.write('x' * size)
+
+        context = PackagerContext('foo', spec=spec, sources_dir=sources_dir)
+        self.assertEqual(context.size, 110 + len(context.render().encode('utf-8')))
+
+    def test_dockerfile_installs_build_requires_before_adding_sources(self):
+        context = PackagerContext('foo', spec='/tmp/foo.spec', sources=['/tmp/foo.tar.gz'],
+                                  sources_dir='/tmp', retrieve=True)
+        dockerfile = context.render()
+        builddep = dockerfile.index('RUN yum-builddep -y /rpmbuild/build/SPECS/foo.spec')
+        self.assertLess(dockerfile.index('COPY SPECS'), builddep)
+        self.assertLess(dockerfile.index('RUN spectool'), builddep)
+        self.assertLess(builddep, dockerfile.index('COPY SOURCES'))
+        self.assertLess(dockerfile.index('COPY SOURCES'), dockerfile.index('CMD rpmbuild'))
+        self.assertEqual(dockerfile.count('COPY SOURCES'), 1)
+        self.assertNotIn('chown', dockerfile)
+
+    def test_dockerfile_builds_on_base_image(self):
+        context = PackagerContext('centos:7', spec='foo.spec')
+        context.base_image = 'rpmbuild_base:0123456789ab'
+        self.assertIn('FROM rpmbuild_base:0123456789ab', context.render())
+        self.assertNotIn('rpmdev-setuptree', context.render())
+        self.assertIn('FROM centos:7', context.render_base())
+        self.assertIn('rpmdev-setuptree', context.render_base())
+
+    @patch('shutil.copy')
+    @patch('tempfile.mkdtemp')
+    def test_packager_context_setup_streamed_does_not_stage(self, mkdtemp, copy):
+        context = PackagerContext('foo', spec='foo.spec', stream=True)
+        context.setup()
+        self.assertIsNone(context.path)
+        self.assertFalse(mkdtemp.called)
+        self.assertFalse(copy.called)
+
+    def test_archive_is_a_tar_of_the_context(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        source = os.path.join(path, 'foo.tar.gz')
+        sources_dir = os.path.join(path, 'sources')
+        os.makedirs(os.path.join(sources_dir, 'patches'))
+        contents = {
+            spec: b'Name: foo',
+            source: b'x' * 70000,
+            os.path.join(sources_dir, 'patches', 'foo.patch'): b'patch',
+        }
+        for name, content in contents.items():
+            with open(name, 'wb') as f:
+                f.write(content)
+
+        context = PackagerContext('foo', spec=spec, sources=[source],
+                                  sources_dir=sources_dir, stream=True)
+        context.base_image = 'rpmbuild_base:0123456789ab'
+        archive = tarfile.open(fileobj=io.BytesIO(b''.join(context.archive())))
+
+        self.assertEqual(archive.getnames(), [
+            'Dockerfile', 'SPECS/foo.spec', 'SOURCES', 'SOURCES/patches',
+            'SOURCES/patches/foo.patch', 'SOURCES/foo.tar.gz'])
+        self.assertEqual(archive.extractfile('Dockerfile').read(),
+                         context.render().encode('utf-8'))
+        self.assertEqual(archive.extractfile('SOURCES/foo.tar.gz').read(), contents[source])
+        self.assertEqual(archive.extractfile('SOURCES/patches/foo.patch').read(), b'patch')
+        self.assertTrue(archive.getmember('SOURCES/patches').isdir())
+
+    def test_repo_is_added_and_enabled_before_builddep(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        spec = os.path.join(path, 'foo.spec')
+        rpm = os.path.join(path, 'bar-devel-1.0-1.x86_64.rpm')
+        for name in (spec, rpm):
+            with open(name, 'w') as f:
+                f.write(name)
+
+        context = PackagerContext('foo', spec=spec, repo=[rpm])
+        dockerfile = context.render()
+        self.assertLess(dockerfile.index('ADD repo /rpmbuild/repo'),
+                        dockerfile.index('RUN yum-builddep'))
+        self.assertIn('baseurl=file:///rpmbuild/repo', dockerfile)
+        self.assertNotIn('ADD repo', PackagerContext('foo', spec=spec).render())
+
+        context.setup()
+        self.addCleanup(context.teardown)
+        self.assertEqual(os.listdir(os.path.join(context.path, 'repo')),
+                         ['bar-devel-1.0-1.x86_64.rpm'])
+
+    def test_dockerfile_leaves_builddep_to_packager_with_yum_cache(self):
+        self.assertIn('yum-builddep', PackagerContext('foo', spec='foo.spec').render())
+        self.assertNotIn('yum-builddep', PackagerContext('foo', spec='foo.spec',
+                                                         yum_cache='/cache').render())
+
+    def test_yum_cache_installs_build_deps_before_the_sources(self):
+        context = PackagerContext('foo', spec='foo.spec', sources=['foo.tar.gz'],
+                                  yum_cache='/cache')
+        context.base_image = 'rpmbuild_base:abc'
+        deps = context.render(deps=True)
+        self.assertIn('FROM rpmbuild_base:abc', deps)
+        self.assertIn('COPY SPECS', deps)
+        self.assertNotIn('SOURCES', deps)
+        self.assertEqual(context._context_files(deps=True),
+                         [('foo.spec', 'SPECS/foo.spec')])
+
+        context.deps_image = 'rpmbuild_foo:deps-abc'
+        dockerfile = context.render()
+        self.assertIn('FROM rpmbuild_foo:deps-abc', dockerfile)
+        self.assertIn('COPY SOURCES', dockerfile)
+        self.assertNotIn('COPY SPECS', dockerfile)
+
+    def test_deps_digest_ignores_the_sources(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        spec, source = os.path.join(tmp, 'foo.spec'), os.path.join(tmp, 'foo.c')
+        for path in spec, source:
+            with open(path, 'w') as f:
+                f.write('1')
+        context = PackagerContext('foo', spec=spec, sources=[source],
+                                  yum_cache='/cache')
+        context.base_image = 'rpmbuild_base:abc'
+        deps_digest, digest = context.deps_digest, context.digest
+
+        with open(source, 'w') as f:
+            f.write('2')
+        context = PackagerContext('foo', spec=spec, sources=[source],
+                                  yum_cache='/cache')
+        context.base_image = 'rpmbuild_base:abc'
+        self.assertEqual(context.deps_digest, deps_digest)
+        self.assertNotEqual(context.digest, digest)
+
+    def test_dockerfile_compiles_through_ccache(self):
+        dockerfile = PackagerContext('foo', spec='foo.spec', ccache='/cache').render()
+        self.assertIn('yum -y install ccache', dockerfile)
+        self.assertIn('ENV CCACHE_DIR /rpmbuild/ccache', dockerfile)
+        self.assertIn('CMD ccache -z; rpmbuild', dockerfile)
+        self.assertIn('; status=$?; ccache -s; exit $status', dockerfile)
+        self.assertNotIn('ccache', PackagerContext('foo', spec='foo.spec').render())
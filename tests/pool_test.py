@@ -0,0 +1,123 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+if sys.version_info >= (3,):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from mock import patch, MagicMock
+
+from benchmarks.daemon import FakeDaemon, Recording
+from rpmbuild import Packager, PackagerContext, PackagerException
+from rpmbuild.pool import ClientPool, HostScheduler
+
+
+class ClientPoolTestCase(unittest.TestCase):
+    """Tests for pool.py"""
+
+    def setUp(self):
+        patcher = patch('docker.Client', side_effect=lambda **kwargs: MagicMock())
+        self.docker_client = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_released_clients_are_reused_per_config(self):
+        pool = ClientPool()
+        client = pool.acquire({'base_url': 'unix://a'})
+        pool.release({'base_url': 'unix://a'}, client)
+
+        self.assertIs(pool.acquire({'base_url': 'unix://a'}), client)
+        self.assertIsNot(pool.acquire({'base_url': 'unix://b'}), client)
+        self.assertIsNot(pool.acquire({'base_url': 'unix://a'}), client)
+        self.assertEqual(self.docker_client.call_count, 3)
+
+    def test_acquire_blocks_at_max_clients(self):
+        pool = ClientPool(max_clients=1)
+        client = pool.acquire({})
+        acquired = []
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire({})))
+        waiter.start()
+
+        time.sleep(0.1)
+        self.assertEqual(acquired, [])
+        pool.release({}, client)
+        waiter.join(5)
+
+        self.assertEqual(acquired, [client])
+        self.assertEqual(self.docker_client.call_count, 1)
+
+    def test_close_closes_idle_clients(self):
+        pool = ClientPool()
+        with pool.client({}) as client:
+            pass
+        pool.close()
+        client.close.assert_called_with()
+
+
+
+class HostSchedulerTestCase(unittest.TestCase):
+    """Tests for HostScheduler, against fake docker daemons"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        spec = os.path.join(self.path, 'foo.spec')
+        with open(spec, 'w') as f:
+            f.write('Name: foo\n')
+        self.context = PackagerContext('centos:7', spec=spec)
+        self.pool = ClientPool()
+        self.scheduler = HostScheduler(self.pool)
+
+        self.daemons = []
+        for _ in range(2):
+            daemon = FakeDaemon(Recording(), images=['centos:7']).__enter__()
+            self.addCleanup(daemon.__exit__, None, None, None)
+            self.daemons.append(daemon)
+        self.configs = [{'base_url': d.base_url} for d in self.daemons]
+        self.unreachable = {'base_url': 'unix://' + os.path.join(self.path, 'none.sock')}
+
+    def test_builds_go_to_cached_host_unless_it_is_busier(self):
+        with Packager(self.context, self.configs[1], pool=self.pool) as p:
+            self.daemons[1].tag(p.image_name)
+
+        placements = []
+        with self.scheduler.place(self.context, self.configs) as first:
+            with self.scheduler.place(self.context, self.configs) as second:
+                with self.scheduler.place(self.context, self.configs) as third:
+                    with self.scheduler.place(self.context, self.configs) as fourth:
+                        placements = [first, second, third, fourth]
+                        self.assertEqual(self.scheduler.load(self.configs[1]), 3)
+
+        self.assertEqual(placements, [self.configs[1]] * 3 + [self.configs[0]])
+        self.assertEqual(self.scheduler.load(self.configs[1]), 0)
+
+    def test_builds_spread_over_hosts_without_cache(self):
+        with self.scheduler.place(self.context, self.configs) as first:
+            with self.scheduler.place(self.context, self.configs) as second:
+                self.assertNotEqual(first, second)
+
+    def test_unreachable_hosts_are_skipped(self):
+        with self.scheduler.place(self.context, [self.unreachable, self.configs[0]]) as config:
+            self.assertEqual(config, self.configs[0])
+
+        with self.assertRaises(PackagerException):
+            with self.scheduler.place(self.context, [self.unreachable, self.unreachable]):
+                pass
+
+
+    def test_builds_mounting_host_directories_stay_on_local_hosts(self):
+        context = PackagerContext('centos:7', spec=self.context.spec,
+                                  ccache=os.path.join(self.path, 'ccache'))
+        remote = {'base_url': 'tcp://build.example.com:2375'}
+        with self.scheduler.place(context, [remote, self.configs[0]]) as config:
+            self.assertEqual(config, self.configs[0])
+
+        with self.assertRaises(PackagerException):
+            with self.scheduler.place(context, [remote]):
+                pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+if sys.version_info >= (3,):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from rpmbuild.report import BuildReport, write_report
+
+
+class BuildReportTestCase(unittest.TestCase):
+    """Tests for report.py"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_phase_is_recorded_even_on_error(self):
+        report = BuildReport('foo.spec')
+        with report.phase('image_build'):
+            pass
+        with self.assertRaises(ValueError):
+            with report.phase('rpmbuild'):
+                raise ValueError()
+
+        self.assertEqual([p['name'] for p in report.phases],
+                         ['image_build', 'rpmbuild'])
+        self.assertTrue(all(p['duration'] >= 0 for p in report.phases))
+
+    def test_build_output_times_steps_and_counts_cache_hits(self):
+        report = BuildReport('foo.spec')
+        for line in ['Step 0 : FROM centos:7\n', ' ---> abc\n',
+                     'Step 1 : RUN true\n', ' ---> Using cache\n',
+                     'Step 2 : CMD rpmbuild\n', ' ---> Running in def\n']:
+            report.build_output(line)
+
+        data = report.to_dict()
+        self.assertEqual([s['cached'] for s in data['steps']], [False, True, False])
+        self.assertEqual(data['cached_steps'], 1)
+        self.assertTrue(all('duration' in s for s in data['steps']))
+
+    def test_write_report_includes_artifact_sizes(self):
+        rpm = os.path.join(self.path, 'foo.rpm')
+        with open(rpm, 'wb') as f:
+            f.write(b'x' * 10)
+        report = BuildReport('foo.spec')
+        report.add_artifacts([rpm])
+
+        write_report(os.path.join(self.path, 'report.json'), report)
+
+        with open(os.path.join(self.path, 'report.json')) as f:
+            data = json.load(f)
+        self.assertEqual(data['name'], 'foo.spec')
+        self.assertEqual(data['artifacts'], [{'path': rpm, 'size': 10}])
+        self.assertEqual(data['artifacts_size'], 10)
+        self.assertIsNone(data['error'])
+
+    def test_write_report_lists_batch_packages(self):
+        reports = [BuildReport('foo.spec'), BuildReport('bar.spec')]
+        reports[1].error = 'broken'
+
+        write_report(os.path.join(self.path, 'report.json'), reports)
+
+        with open(os.path.join(self.path, 'report.json')) as f:
+            data = json.load(f)
+        self.assertEqual([p['name'] for p in data['packages']],
+                         ['foo.spec', 'bar.spec'])
+        self.assertEqual(data['packages'][1]['error'], 'broken')
+
+
+if __name__ == '__main__':
+    unittest.main()
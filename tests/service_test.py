@@ -0,0 +1,181 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+if sys.version_info >= (3,):
+    import unittest
+else:
+    import unittest2 as unittest
+
+from rpmbuild import PackagerException
+from rpmbuild.build import log_build_object
+from rpmbuild.logs import BuildLog
+from rpmbuild.service import (FAILED, SUCCEEDED, JobQueue, make_server,
+                              parse_listen)
+
+
+class ServiceTestCase(unittest.TestCase):
+    """Tests for service.py"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.release = threading.Event()
+
+    def build(self, job):
+        spec = os.path.basename(job.arguments['spec'])
+        job.log('building %s' % spec)
+        self.release.wait(5)
+        if spec == 'broken.spec':
+            raise PackagerException('broken')
+        rpm = os.path.join(job.output, 'foo-1.0-1.x86_64.rpm')
+        with open(rpm, 'wb') as f:
+            f.write(b'rpm')
+        return [rpm]
+
+    def queue(self, **kwargs):
+        jobs = JobQueue(self.build, 2, self.path, root=self.path, **kwargs)
+        self.addCleanup(jobs.close)
+        self.addCleanup(self.release.set)
+        return jobs
+
+    def serve(self, jobs):
+        address = os.path.join(self.path, 'service.sock')
+        server = make_server(address, jobs, lambda message: None)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return address
+
+    def request(self, address, method, path, body=None):
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(address)
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        client.sendall(('%s %s HTTP/1.0\r\nContent-Length: %d\r\n\r\n' % (
+            method, path, len(data))).encode('ascii') + data)
+        response = b''
+        while True:
+            block = client.recv(65536)
+            if not block:
+                break
+            response += block
+        client.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), body
+
+    def test_jobs_run_and_report_their_artifacts(self):
+        jobs = self.queue()
+        job = jobs.submit({'image': 'centos:7', 'spec': 'foo.spec'})
+        failing = jobs.submit({'image': 'centos:7', 'spec': 'broken.spec'})
+        self.release.set()
+
+        self.assertEqual(list(job.follow()), ['building foo.spec'])
+        self.assertEqual(list(failing.follow()), ['building broken.spec', 'broken'])
+        self.assertEqual(job.state, SUCCEEDED)
+        self.assertEqual(job.to_dict()['artifacts'], ['foo-1.0-1.x86_64.rpm'])
+        self.assertEqual(failing.state, FAILED)
+        self.assertEqual(failing.to_dict()['error'], 'broken')
+
+    def test_job_logs_are_written_to_the_job_output(self):
+        jobs = self.queue()
+        job = jobs.submit({'image': 'centos:7', 'spec': 'foo.spec'})
+        follower = job.follow()
+        lines = []
+        thread = threading.Thread(target=lambda: lines.extend(follower))
+        thread.start()
+        self.release.set()
+        thread.join(5)
+
+        self.assertEqual(lines, ['building foo.spec'])
+        with open(os.path.join(job.output, 'build.log')) as f:
+            self.assertEqual(f.read(), 'building foo.spec\n')
+        self.assertEqual(list(job.follow()), ['building foo.spec'])
+
+    def test_jobs_log_build_objects_without_stream(self):
+        def build(job):
+            logger = BuildLog(job.log)
+            log_build_object({'aux': {'ID': 'sha256:abc'}}, logger)
+            log_build_object({'error': 'no space left'}, logger)
+
+        jobs = JobQueue(build, 1, self.path, root=self.path)
+        self.addCleanup(jobs.close)
+        job = jobs.submit({'image': 'centos:7', 'spec': 'foo.spec'})
+        lines = list(job.follow())
+
+        self.assertEqual(job.state, FAILED)
+        self.assertEqual(job.error, 'no space left')
+        self.assertIn("'aux'", lines[0])
+        self.assertIn("'error'", lines[1])
+
+    def test_submit_rejects_invalid_jobs(self):
+        jobs = self.queue()
+        for arguments in ({'spec': 'foo.spec'}, {'image': 'centos:7'},
+                          {'image': 'centos:7', 'spec': 'foo.spec', 'foo': 1}):
+            with self.assertRaises(PackagerException):
+                jobs.submit(arguments)
+
+    def test_job_paths_must_be_below_the_root(self):
+        jobs = self.queue()
+        job = jobs.submit({'image': 'centos:7', 'spec': 'foo.spec',
+                           'sources': ['src/foo.tar.gz'],
+                           'yum_cache': os.path.join(self.path, 'cache')})
+        self.assertEqual(job.arguments['spec'], os.path.join(self.path, 'foo.spec'))
+        self.assertEqual(job.arguments['sources'],
+                         [os.path.join(self.path, 'src', 'foo.tar.gz')])
+
+        os.symlink('/etc', os.path.join(self.path, 'etc'))
+        for arguments in ({'spec': '/etc/foo.spec'}, {'spec': '../foo.spec'},
+                          {'spec': 'foo.spec', 'sources': ['etc/shadow']},
+                          {'spec': 'foo.spec', 'ccache': '/root/.ccache'},
+                          {'spec': 'foo.spec', 'sources_dir': 5}):
+            with self.assertRaises(PackagerException):
+                jobs.submit(dict(arguments, image='centos:7'))
+
+    def test_service_only_listens_on_loopback(self):
+        self.assertEqual(parse_listen('localhost:8080'), ('localhost', 8080))
+        self.assertEqual(parse_listen('127.0.0.1:8080'), ('127.0.0.1', 8080))
+        for address in ('0.0.0.0:8080', ':8080', 'build.example.com:8080',
+                        'localhost:http'):
+            with self.assertRaises(PackagerException):
+                parse_listen(address)
+
+    def test_only_the_last_finished_jobs_are_kept(self):
+        jobs = self.queue(keep=1)
+        self.release.set()
+        first = jobs.submit({'image': 'centos:7', 'spec': 'foo.spec'})
+        list(first.follow())
+        second = jobs.submit({'image': 'centos:7', 'spec': 'foo.spec'})
+        list(second.follow())
+        jobs.close()
+
+        self.assertEqual(jobs.jobs(), [second])
+        self.assertFalse(os.path.exists(first.output))
+
+    def test_http_api_submits_jobs_and_serves_logs_and_artifacts(self):
+        address = self.serve(self.queue())
+
+        status, body = self.request(address, 'POST', '/jobs',
+                                    {'image': 'centos:7', 'spec': 'foo.spec'})
+        self.assertEqual(status, 201)
+        job_id = json.loads(body.decode('utf-8'))['id']
+        self.release.set()
+
+        status, body = self.request(address, 'GET', '/jobs/%s/logs' % job_id)
+        self.assertEqual((status, body), (200, b'building foo.spec\n'))
+        status, body = self.request(address, 'GET', '/jobs/%s' % job_id)
+        self.assertEqual(json.loads(body.decode('utf-8'))['state'], SUCCEEDED)
+        status, body = self.request(
+            address, 'GET', '/jobs/%s/artifacts/foo-1.0-1.x86_64.rpm' % job_id)
+        self.assertEqual((status, body), (200, b'rpm'))
+
+        self.assertEqual(self.request(address, 'GET', '/jobs/nope')[0], 404)
+        self.assertEqual(self.request(address, 'POST', '/jobs', {'spec': 'foo.spec'})[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()